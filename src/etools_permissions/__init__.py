@@ -1,2 +1,4 @@
 NAME = "etools-permissions"
 VERSION = __version__ = "0.1.0a0"
+
+default_app_config = 'etools_permissions.apps.RealmConfig'
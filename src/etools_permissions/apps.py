@@ -1,5 +1,41 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import import_string
 
 
 class RealmConfig(AppConfig):
     name = 'etools_permissions'
+
+    def ready(self):
+        from etools_permissions import signals  # noqa
+        from etools_permissions.utils import inheritance
+
+        inheritance.build()
+        self.preload_serializers()
+
+    def preload_serializers(self):
+        """Collect permission targets of the serializers listed in
+        `AUTH_PERMISSION_PRELOAD_SERIALIZERS`, so it does not happen
+        while handling requests.
+
+        Targets are collected for each of the permission classes listed
+        in `AUTH_PERMISSION_PRELOAD_PERMISSIONS`, `RealmPermission`
+        by default.
+        """
+        serializers = getattr(
+            settings,
+            'AUTH_PERMISSION_PRELOAD_SERIALIZERS',
+            [],
+        )
+        if not serializers:
+            return
+
+        permission_classes = getattr(
+            settings,
+            'AUTH_PERMISSION_PRELOAD_PERMISSIONS',
+            ['etools_permissions.permissions.RealmPermission'],
+        )
+        for permission_class in permission_classes:
+            permission = import_string(permission_class)()
+            for serializer in serializers:
+                permission.preload_serializer(import_string(serializer))
@@ -1,15 +1,29 @@
 from django.contrib.auth.backends import ModelBackend
 from django.core.exceptions import PermissionDenied
 
-from etools_permissions.models import Permission, Realm
+from etools_permissions import cache, instrumentation
+from etools_permissions.conditions import object_conditions
+from etools_permissions.index import PermissionIndex
+from etools_permissions.models import (
+    effective_permissions_enabled,
+    EffectivePermission,
+    Permission,
+    PermissionRecord,
+    Realm,
+)
+from etools_permissions.utils import get_current_workspace, get_user_realm, run_in_thread
 
 
 class RealmBackend(ModelBackend):
     def _get_realm(self, user):
-        try:
-            return Realm.objects.get(user=user)
-        except Realm.DoesNotExist:
+        """
+        Return the realm of `user` in the current workspace, the same
+        realm instance as `request.realm` when checked during a request.
+        """
+        realm = get_user_realm(user, workspace=get_current_workspace())
+        if realm is None:
             raise PermissionDenied
+        return realm
 
     def _get_realm_permissions(self, realm):
         return realm.permissions.all()
@@ -21,6 +35,18 @@ class RealmBackend(ModelBackend):
         )
         return Permission.objects.filter(**{realm_groups_query: realm})
 
+    @staticmethod
+    def _exclude_conditional_disallow(perms):
+        """
+        Exclude disallow permissions that have conditions, as without an
+        object it is not known whether their conditions hold. They are
+        applied by the object checks.
+        """
+        return perms.exclude(
+            permission_type=Permission.TYPE_DISALLOW,
+            condition__len__gt=0,
+        )
+
     def _get_permissions(self, realm, obj, from_name):
         """
         Return the permissions of `realm` from `from_name`. `from_name` can
@@ -39,7 +65,7 @@ class RealmBackend(ModelBackend):
                     self,
                     '_get_{}_permissions'.format(from_name)
                 )(realm)
-            perms = perms.values_list(
+            perms = self._exclude_conditional_disallow(perms).values_list(
                 'permission',
                 'permission_type',
                 'target',
@@ -69,10 +95,85 @@ class RealmBackend(ModelBackend):
         """
         return self._get_permissions(realm, obj, 'group')
 
+    def _get_object_permissions(self, realm):
+        """
+        Return the permissions of `realm`, with their conditions,
+        as records. Cached on the realm, and shared between requests
+        like the permission index when `AUTH_PERMISSION_CACHE` is set.
+        """
+        if not hasattr(realm, '_object_perm_cache'):
+            records = cache.get_object_permissions(realm)
+            if records is None:
+                if realm.user.is_superuser:
+                    records = Permission.objects.all().records()
+                elif self._use_effective_permissions(realm, None):
+                    records = [
+                        PermissionRecord(*row)
+                        for row in EffectivePermission.objects.filter(
+                            realm=realm,
+                        ).values_list(
+                            'permission',
+                            'permission_type',
+                            'target',
+                            'condition',
+                        ).distinct()
+                    ]
+                else:
+                    perms = self._get_realm_permissions(realm) | self._get_group_permissions(realm)
+                    records = perms.distinct().records()
+                cache.set_object_permissions(realm, records)
+            realm._object_perm_cache = records
+        return realm._object_perm_cache
+
+    def _get_object_allowed_targets(self, realm, targets, kind, contexts):
+        """
+        Return the set of `targets` allowed for `kind` in each of
+        `contexts`, each distinct context is only evaluated once.
+        """
+        candidates = set(Permission.expand_targets(targets))
+        permissions = [
+            perm for perm in self._get_object_permissions(realm)
+            if perm.target in candidates
+        ]
+        decisions = {}
+        allowed = []
+        for context in contexts:
+            if context not in decisions:
+                decisions[context] = set(Permission.apply_permissions(
+                    [perm for perm in permissions if context.issuperset(perm.condition)],
+                    targets,
+                    kind,
+                ))
+            allowed.append(decisions[context])
+        return allowed
+
+    def _get_effective_permissions(self, realm):
+        return {
+            "{}.{}.{}".format(perm_type, perm, target)
+            for perm, perm_type, target in self._exclude_conditional_disallow(
+                EffectivePermission.objects.filter(realm=realm),
+            ).values_list('permission', 'permission_type', 'target')
+        }
+
+    def _use_effective_permissions(self, realm, obj):
+        return (
+            obj is None and
+            not realm.user.is_superuser and
+            effective_permissions_enabled() and
+            not hasattr(realm, '_realm_perm_cache')
+        )
+
     def get_all_permissions(self, realm, obj=None):
-        if not realm.user.is_active or realm.user.is_anonymous:
+        """
+        Return a set of permission strings the `realm` has, permissions
+        for an object are decided by `has_realm_perm_bulk` instead.
+        """
+        if not realm.user.is_active or realm.user.is_anonymous or obj is not None:
             return set()
         if not hasattr(realm, '_perm_cache'):
+            if self._use_effective_permissions(realm, obj):
+                realm._perm_cache = self._get_effective_permissions(realm)
+                return realm._perm_cache
             realm._perm_cache = set()
             realm._perm_cache.update(self.get_realm_permissions(realm, obj))
             realm._perm_cache.update(self.get_group_permissions(realm, obj))
@@ -81,39 +182,164 @@ class RealmBackend(ModelBackend):
     def _parse_target(self, target):
         """Target may have preceding data"""
         perm, actual_target = target.split(".", 1)
-        # If we have any packages named "edit" or "view"
+        # If we have any packages named "edit", "view" or "action"
         # this falls apart! Doh!
-        if perm in [Permission.EDIT, Permission.VIEW]:
+        if perm in dict(Permission.PERMISSION_CHOICES):
             return perm, actual_target
         else:
             return None, target
 
+    @staticmethod
+    def _is_valid_target(target):
+        """Check if `target` names a field, model or app wildcard"""
+        try:
+            Permission.parse_target(target)
+        except (LookupError, ValueError):
+            return False
+        return True
+
+    def get_permission_index(self, realm):
+        """
+        Return the permissions of `realm` compiled into a
+        `PermissionIndex`, the index is cached on the realm.
+
+        If `AUTH_PERMISSION_CACHE` is set, the index is also shared
+        between requests through the cache framework. Permissions
+        for an object are decided by `has_realm_perm_bulk` instead.
+        """
+        if hasattr(realm, '_perm_index'):
+            instrumentation.record_cache(hit=True)
+        else:
+            index = cache.get_permission_index(realm)
+            instrumentation.record_cache(hit=index is not None)
+            if index is None:
+                index = PermissionIndex(self.get_all_permissions(realm))
+                cache.set_permission_index(realm, index)
+            realm._perm_index = index
+        return realm._perm_index
+
     def perm_valid(self, permissions, target):
         """Check if target matches any permissions user has"""
+        if not isinstance(permissions, PermissionIndex):
+            permissions = PermissionIndex(permissions)
         target_perm, target = self._parse_target(target)
+        return permissions.allows(target, target_perm)
+
+    @instrumentation.instrument('has_perm')
+    def has_realm_perm(self, realm, perm, obj=None):
+        """
+        Return True if `realm` has `perm`.
 
-        for permission in permissions:
-            perm_type, perm, perm_target = permission.split(".", 2)
-            if perm_type == Permission.TYPE_DISALLOW:
-                continue
+        The permissions loaded for `realm` are cached on the instance, so
+        repeated checks against the same realm (e.g. `request.realm`) only
+        hit the database once.
+        """
+        if not realm.user.is_active:
+            return False
+        if obj is not None:
+            return self.has_realm_perm_bulk(realm, perm, [obj])[0]
+        permissions = self.get_permission_index(realm)
+        return self.perm_valid(permissions, perm)
 
-            if target_perm == Permission.EDIT and perm_type == Permission.VIEW:
-                continue
+    @instrumentation.instrument('has_perm_bulk')
+    def has_realm_perm_bulk(self, realm, perm, objs):
+        """
+        Return whether `realm` has `perm` for each of `objs`.
 
-            if perm_target[-1] == '*':
-                if target.startswith(perm_target[:-1]):
-                    return True
-            else:
-                if perm_target == target:
-                    return True
+        The context of each object is built by the `ObjectCondition`
+        classes registered for its model, a permission applies to the
+        object if all its conditions are in the context. Permissions
+        of the realm are loaded once, and objects sharing a context
+        are decided together. Targets that can't be parsed are
+        not allowed.
+        """
+        objs = list(objs)
+        if not realm.user.is_active:
+            return [False] * len(objs)
+        kind, target = self._parse_target(perm)
+        if not self._is_valid_target(target):
+            return [False] * len(objs)
+        kinds = [kind] if kind else [choice for choice, _ in Permission.PERMISSION_CHOICES]
+        contexts = object_conditions.get_contexts(objs)
+        allowed = [False] * len(objs)
+        for kind in kinds:
+            for i, targets in enumerate(self._get_object_allowed_targets(realm, [target], kind, contexts)):
+                allowed[i] = allowed[i] or target in targets
+        return allowed
 
-        return False
+    @instrumentation.instrument('filter_allowed_targets')
+    def filter_allowed_targets(self, realm, targets, kind, obj=None):
+        """
+        Return the subset of `targets` that `realm` has `kind`
+        permission to, checking all targets in a single pass.
+        """
+        if not realm.user.is_active:
+            return []
+        if obj is not None:
+            targets = [target for target in targets if self._is_valid_target(target)]
+            allowed = self._get_object_allowed_targets(
+                realm,
+                targets,
+                kind,
+                object_conditions.get_contexts([obj]),
+            )[0]
+            return [target for target in targets if target in allowed]
+        permissions = self.get_permission_index(realm)
+        return permissions.filter_allowed(targets, kind)
+
+    def has_perm_bulk(self, user, perm, objs):
+        if not user.is_active:
+            return [False] * len(list(objs))
+        return self.has_realm_perm_bulk(self._get_realm(user), perm, objs)
 
     def has_perm(self, user, perm, obj=None):
         if not user.is_active:
             return False
-        permissions = self.get_all_permissions(self._get_realm(user), obj)
-        return self.perm_valid(permissions, perm)
+        return self.has_realm_perm(self._get_realm(user), perm, obj)
+
+    def _is_loaded(self, realm):
+        """Check if permissions of `realm` can be used without I/O"""
+        if hasattr(realm, '_perm_index'):
+            return True
+        return cache.get_cache() is None and (
+            hasattr(realm, '_perm_cache') or (
+                hasattr(realm, '_realm_perm_cache') and
+                hasattr(realm, '_group_perm_cache')
+            )
+        )
+
+    def _has_permission_strings(self, realm):
+        """
+        Check if the permission strings of `realm` are loaded, the
+        index can be loaded from the shared cache without them.
+        """
+        return hasattr(realm, '_perm_cache') or (
+            hasattr(realm, '_realm_perm_cache') and
+            hasattr(realm, '_group_perm_cache')
+        )
+
+    async def aget_realm(self, user):
+        return await run_in_thread(self._get_realm)(user)
+
+    async def aget_all_permissions(self, realm, obj=None):
+        if obj is None and self._has_permission_strings(realm):
+            return self.get_all_permissions(realm)
+        return await run_in_thread(self.get_all_permissions)(realm, obj)
+
+    async def ahas_realm_perm(self, realm, perm, obj=None):
+        """
+        Async version of `has_realm_perm`, permissions are only loaded
+        in a thread when they are not already on the realm.
+        """
+        if obj is None and self._is_loaded(realm):
+            return self.has_realm_perm(realm, perm)
+        return await run_in_thread(self.has_realm_perm)(realm, perm, obj)
+
+    async def ahas_perm(self, user, perm, obj=None):
+        if not user.is_active:
+            return False
+        realm = await self.aget_realm(user)
+        return await self.ahas_realm_perm(realm, perm, obj)
 
     # def has_module_perms(self, realm_obj, app_label):
     #     """
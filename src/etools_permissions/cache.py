@@ -0,0 +1,169 @@
+import hashlib
+import json
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+from etools_permissions.conditions import normalize_context
+
+KEY_PREFIX = 'etools_permissions'
+# change when the cached `PermissionIndex` changes shape
+INDEX_FORMAT = 4
+
+
+def get_cache():
+    """Return the cache used for permissions, None if caching is disabled
+
+    Enable by setting `AUTH_PERMISSION_CACHE` to a cache alias.
+    """
+    alias = getattr(settings, 'AUTH_PERMISSION_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_version_key(realm_pk=None):
+    if realm_pk is None:
+        return '{}:version'.format(KEY_PREFIX)
+    return '{}:version:realm:{}'.format(KEY_PREFIX, realm_pk)
+
+
+def _get_versions(cache, keys):
+    """Return versions for `keys`, initialising any that are missing
+
+    Versions are random tokens rather than counters, so a version key
+    that has been evicted can never be recreated with a value that
+    matches stale entries.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(realm_pk=None):
+    """Invalidate cached permissions
+
+    If `realm_pk` is provided only that realm is invalidated,
+    otherwise the permissions of all realms are.
+
+    The version is bumped straight away, so the transaction making
+    the change sees it, and again when the transaction commits, so
+    entries cached by other processes from the uncommitted state
+    are invalidated too.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    key = get_version_key(realm_pk)
+    cache.set(key, uuid4().hex, None)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
+
+
+def get_realm_key(cache, realm):
+    global_version, realm_version = _get_versions(
+        cache,
+        [get_version_key(), get_version_key(realm.pk)],
+    )
+    return '{}:realm:{}:{}:{}:{}:{}'.format(
+        KEY_PREFIX,
+        INDEX_FORMAT,
+        realm.pk,
+        int(realm.user.is_superuser),
+        global_version,
+        realm_version,
+    )
+
+
+def _is_cacheable(realm):
+    return realm.pk is not None and realm.user.is_active
+
+
+def get_permission_index(realm):
+    """Return the cached `PermissionIndex` for `realm`, if any"""
+    cache = get_cache()
+    if cache is None or not _is_cacheable(realm):
+        return None
+    return cache.get(get_realm_key(cache, realm))
+
+
+def set_permission_index(realm, index):
+    cache = get_cache()
+    if cache is None or not _is_cacheable(realm):
+        return
+    cache.set(
+        get_realm_key(cache, realm),
+        index,
+        getattr(settings, 'AUTH_PERMISSION_CACHE_TIMEOUT', DEFAULT_TIMEOUT),
+    )
+
+
+def get_object_permissions(realm):
+    """Return the cached permission records of `realm`, if any
+
+    Records keep the conditions of the permissions, and are
+    invalidated with the permission index of the realm.
+    """
+    cache = get_cache()
+    if cache is None or not _is_cacheable(realm):
+        return None
+    return cache.get('{}:objects'.format(get_realm_key(cache, realm)))
+
+
+def set_object_permissions(realm, records):
+    cache = get_cache()
+    if cache is None or not _is_cacheable(realm):
+        return
+    cache.set(
+        '{}:objects'.format(get_realm_key(cache, realm)),
+        records,
+        getattr(settings, 'AUTH_PERMISSION_CACHE_TIMEOUT', DEFAULT_TIMEOUT),
+    )
+
+
+def get_context_key(cache, context, targets, kind, realm=None):
+    """Return the key of the targets allowed in a context
+
+    The key hashes the normalized context and the sorted targets,
+    so the same context gives the same key whatever the order the
+    conditions are listed in.
+    """
+    keys = [get_version_key()]
+    if realm is not None:
+        keys.append(get_version_key(realm.pk))
+    digest = hashlib.sha1(json.dumps([
+        normalize_context(context).key,
+        sorted(set(targets)),
+        kind,
+    ]).encode('utf-8')).hexdigest()
+    return '{}:context:{}:{}:{}'.format(
+        KEY_PREFIX,
+        '' if realm is None else realm.pk,
+        ':'.join(_get_versions(cache, keys)),
+        digest,
+    )
+
+
+def get_allowed_targets(context, targets, kind, realm=None):
+    """Return the cached targets allowed in `context`, if any"""
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(get_context_key(cache, context, targets, kind, realm))
+
+
+def set_allowed_targets(context, targets, kind, realm, allowed):
+    cache = get_cache()
+    if cache is None:
+        return
+    cache.set(
+        get_context_key(cache, context, targets, kind, realm),
+        allowed,
+        getattr(settings, 'AUTH_PERMISSION_CACHE_TIMEOUT', DEFAULT_TIMEOUT),
+    )
@@ -1,6 +1,222 @@
+import hashlib
+import sys
+
+from django.core.exceptions import ImproperlyConfigured
+
+
 class BaseCondition(object):
+    # compact key given when the class is registered
+    key = None
+
+    @classmethod
+    def make_value(cls, *parts):
+        """Return the interned `key.part...` value of the condition
+
+        Used by registered conditions to build their internal value,
+        so values are prefixed with the key they are registered with.
+        """
+        if cls.key is None:
+            raise ImproperlyConfigured(
+                '{} is not registered with condition_registry'.format(cls.__name__)
+            )
+        return sys.intern('.'.join([cls.key] + [str(part) for part in parts]))
+
     def to_internal_value(self):
         raise NotImplementedError
 
     def __str__(self):
         return self.to_internal_value()
+
+
+def flatten_context(context):
+    """Return `context` as a flat list of condition values
+
+    Conditions are converted to their internal value,
+    nested lists and tuples are flattened.
+    """
+    values = []
+    stack = list(reversed(list(context)))
+    while stack:
+        item = stack.pop()
+        if isinstance(item, BaseCondition):
+            item = item.to_internal_value()
+        if isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+        else:
+            values.append(item)
+    return values
+
+
+class Context(frozenset):
+    """Normalized condition context, a frozen set of interned values
+
+    Hashable, so it can be used as a dict key, with `key` a digest
+    of the values to use in cache keys. Build with `normalize_context`.
+    """
+    __slots__ = ('_key', )
+
+    @property
+    def key(self):
+        if not hasattr(self, '_key'):
+            self._key = hashlib.sha1(
+                '\0'.join(sorted(self)).encode('utf-8')
+            ).hexdigest()
+        return self._key
+
+
+def normalize_context(context):
+    """Return `context` as a `Context`, in time linear to its size
+
+    Values are converted to strings, as conditions are stored.
+    """
+    if isinstance(context, Context):
+        return context
+    return Context(sys.intern(str(value)) for value in flatten_context(context))
+
+
+class ConditionRegistry(object):
+    """Condition classes, declared once with a compact key
+
+    Keys are interned, and unique, so the class of a condition
+    can be looked up by key. Registered classes build their values
+    with `make_value`, so the key prefixes them.
+
+        @condition_registry.register('status')
+        class StatusCondition(ObjectCondition):
+            def to_internal_value(self):
+                return self.make_value(self.obj.status)
+    """
+    def __init__(self):
+        self._classes = {}
+
+    def register(self, key, condition_class=None):
+        if condition_class is None:
+            return lambda cls: self.register(key, cls)
+        key = sys.intern(key)
+        registered = self._classes.get(key)
+        if registered is not None and registered is not condition_class:
+            raise ImproperlyConfigured(
+                'Condition key {} is already used by {}'.format(key, registered.__name__)
+            )
+        if condition_class.key not in (None, key) and self._classes.get(condition_class.key) is condition_class:
+            raise ImproperlyConfigured(
+                '{} is already registered as {}'.format(condition_class.__name__, condition_class.key)
+            )
+        self._classes[key] = condition_class
+        condition_class.key = key
+        return condition_class
+
+    def unregister(self, key):
+        condition_class = self._classes.pop(key, None)
+        if condition_class is not None:
+            condition_class.key = None
+
+    def get(self, key):
+        return self._classes.get(key)
+
+    def keys(self):
+        return list(self._classes)
+
+
+condition_registry = ConditionRegistry()
+
+
+class RowConditionRegistry(object):
+    """Predicates selecting the rows of a model a condition holds for
+
+    A predicate is registered for a condition internal value, and is
+    called with a model to return a `Q`, or None if the condition
+    does not apply to that model.
+
+        @row_conditions.register('status.draft')
+        def draft(model):
+            return Q(status='draft')
+    """
+    def __init__(self):
+        self._predicates = {}
+
+    def register(self, value, predicate=None):
+        if predicate is None:
+            return lambda func: self.register(value, func)
+        self._predicates[value] = predicate
+        return predicate
+
+    def unregister(self, value):
+        self._predicates.pop(value, None)
+
+    def get_q(self, value, model):
+        """Return the `Q` of rows of `model` `value` holds for, if any"""
+        predicate = self._predicates.get(value)
+        if predicate is None:
+            return None
+        return predicate(model)
+
+
+row_conditions = RowConditionRegistry()
+
+
+class ObjectCondition(BaseCondition):
+    """Condition of an object, for object-level permission checks
+
+    Subclasses are registered for a model with `object_conditions`,
+    and build their internal value from `self.obj`, it may be a list
+    of values or empty. Override `for_objects` to load what the
+    conditions of many objects need at once.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+
+    @classmethod
+    def for_objects(cls, objs):
+        """Return the conditions of each of `objs`"""
+        return [cls(obj) for obj in objs]
+
+
+class ObjectConditionRegistry(object):
+    """Condition classes building the context of objects of a model
+
+    Conditions registered for a model also apply to its child models.
+    """
+    def __init__(self):
+        self._conditions = {}
+
+    def register(self, model, condition_class=None):
+        if condition_class is None:
+            return lambda cls: self.register(model, cls)
+        self._conditions.setdefault(model, []).append(condition_class)
+        return condition_class
+
+    def unregister(self, model, condition_class):
+        if condition_class in self._conditions.get(model, []):
+            self._conditions[model].remove(condition_class)
+
+    def get_condition_classes(self, model):
+        classes = []
+        for m in [model] + model._meta.get_parent_list():
+            classes.extend(self._conditions.get(m, []))
+        return classes
+
+    def get_contexts(self, objs):
+        """Return the `Context` of each of `objs`
+
+        Objects are grouped by model so each condition class
+        resolves the conditions of all its objects at once.
+        """
+        objs = list(objs)
+        by_model = {}
+        for i, obj in enumerate(objs):
+            by_model.setdefault(type(obj), []).append(i)
+
+        contexts = [[] for _ in objs]
+        for model, indexes in by_model.items():
+            for condition_class in self.get_condition_classes(model):
+                conditions = condition_class.for_objects([objs[i] for i in indexes])
+                for i, condition in zip(indexes, conditions):
+                    contexts[i].append(condition)
+        return [normalize_context(context) for context in contexts]
+
+    def get_context(self, obj):
+        return self.get_contexts([obj])[0]
+
+
+object_conditions = ObjectConditionRegistry()
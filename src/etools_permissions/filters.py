@@ -0,0 +1,145 @@
+from django.db.models import Q
+
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.permissions import SAFE_METHODS
+
+from etools_permissions.conditions import normalize_context, row_conditions
+from etools_permissions.models import Permission
+from etools_permissions.targets import WILDCARD
+
+
+def _model_levels(model):
+    """Map the wildcard targets of `model` and its parents to their level
+
+    Parents are one level further for each inheritance step, as in
+    `Permission.apply_permissions`. The `app.*` wildcards of their apps
+    come after the models, and `*` last, as they are less specific.
+    """
+    levels = {}
+    level = 0
+    app_labels = []
+    models = [model]
+    while models:
+        for m in models:
+            levels.setdefault(Permission.get_target(m, WILDCARD), level)
+            if m._meta.app_label not in app_labels:
+                app_labels.append(m._meta.app_label)
+        models = [parent for m in models for parent in m._meta.parents]
+        level += 1
+    for app_label in app_labels:
+        levels['{}.{}'.format(app_label, WILDCARD)] = level
+    levels[WILDCARD] = level + 1
+    return levels
+
+
+def _row_predicate(perm, model, context):
+    """Return the `Q` of rows `perm` applies to
+
+    True if it applies to all rows, None if it applies to none.
+    Conditions in `context` hold for all rows, other conditions
+    hold for the rows selected by their registered predicate.
+    """
+    predicate = True
+    for condition in perm.condition:
+        if condition in context:
+            continue
+        q = row_conditions.get_q(condition, model)
+        if q is None:
+            return None
+        predicate = q if predicate is True else predicate & q
+    return predicate
+
+
+def get_row_filter(model, realm, context=(), kind=Permission.VIEW):
+    """Return the `Q` of rows of `model` `realm` has `kind` permission to
+
+    True if `realm` has permission to all rows, None if to none.
+
+    Rows are decided by the wildcard (`app.model.*`, `app.*` and `*`)
+    permissions of the realm, in the same precedence as
+    `Permission.apply_permissions`, the first permission whose
+    conditions hold for a row decides it. Field permissions don't
+    make rows visible.
+    """
+    levels = _model_levels(model)
+    permissions = Permission.objects.filter(
+        Q(realm=realm) | Q(group__realm=realm),
+        target__in=list(levels),
+    ).distinct().records()
+    for perm in permissions:
+        perm.image_level = levels[perm.target]
+    permissions.sort(key=Permission.precedence)
+
+    context = normalize_context(context)
+    visible = None
+    # from the least specific permission, so each permission
+    # overrides the decision of those after it
+    for perm in reversed(permissions):
+        if not Permission.applies_to(perm, kind):
+            continue
+        predicate = _row_predicate(perm, model, context)
+        if predicate is None:
+            continue
+        if perm.permission_type == Permission.TYPE_ALLOW:
+            if predicate is True or visible is True:
+                visible = True
+            elif visible is None:
+                visible = predicate
+            else:
+                visible = predicate | visible
+        elif predicate is True:
+            visible = None
+        elif visible is True:
+            visible = ~predicate
+        elif visible is not None:
+            visible = ~predicate & visible
+    return visible
+
+
+def filter_visible(queryset, realm, context=(), kind=Permission.VIEW):
+    """Return the rows of `queryset` `realm` has `kind` permission to"""
+    if not realm or not realm.user.is_active:
+        return queryset.none()
+    if realm.user.is_superuser:
+        return queryset
+
+    visible = get_row_filter(queryset.model, realm, context, kind)
+    if visible is None:
+        return queryset.none()
+    if visible is True:
+        return queryset
+    return queryset.filter(visible)
+
+
+class VisibleQuerySetMixin(object):
+    """Add `visible_to` to a queryset
+
+        class ExampleQuerySet(VisibleQuerySetMixin, models.QuerySet):
+            pass
+    """
+    def visible_to(self, realm, context=(), kind=Permission.VIEW):
+        """Limit to the rows `realm` has `kind` permission to in `context`"""
+        return filter_visible(self, realm, context, kind)
+
+
+class RealmFilterBackend(BaseFilterBackend):
+    """Limit the queryset to the rows `request.realm` has permission to
+
+    Safe methods need view permission, others edit permission. Views
+    can provide the conditions that hold with `get_permission_context`.
+    """
+    def get_permission_type(self, request):
+        return Permission.VIEW if request.method in SAFE_METHODS else Permission.EDIT
+
+    def get_context(self, request, view):
+        if hasattr(view, 'get_permission_context'):
+            return view.get_permission_context()
+        return ()
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_visible(
+            queryset,
+            getattr(request, 'realm', None),
+            self.get_context(request, view),
+            self.get_permission_type(request),
+        )
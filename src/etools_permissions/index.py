@@ -0,0 +1,174 @@
+from etools_permissions.models import Permission
+from etools_permissions.targets import WILDCARD, wildcard_prefix
+from etools_permissions.utils import inheritance
+
+# permission kinds that satisfy a check for the given kind,
+# if you can edit a field you can view it too.
+GRANTED_BY = {
+    Permission.VIEW: frozenset([Permission.VIEW, Permission.EDIT]),
+    Permission.EDIT: frozenset([Permission.EDIT]),
+    Permission.ACTION: frozenset([Permission.ACTION]),
+}
+
+
+def target_prefixes(target):
+    """Yield the dotted prefixes of `target`, longest first
+
+    `app.model.field` yields `app.model`, `app` and the empty string,
+    which are the keys wildcard permissions are indexed on.
+    """
+    end = target.rfind('.')
+    while end != -1:
+        yield target[:end]
+        end = target.rfind('.', 0, end)
+    yield ''
+
+
+def _inherited_targets(target):
+    """Yield `target` and the same target of child models, with their level
+
+    As `Permission.apply_permissions`, permissions of a model apply to its
+    child models, one level further for each inheritance step.
+    """
+    try:
+        model, field_name = Permission.parse_target(target)
+    except (LookupError, ValueError):
+        model = None
+    yield target, 0
+    if model is None:
+        return
+    models = [(model, 0)]
+    while models:
+        model, level = models.pop()
+        for child in inheritance.get_children(model):
+            yield Permission.get_target(child, field_name), level + 1
+            models.append((child, level + 1))
+
+
+class PermissionIndex(object):
+    """Compiled form of a set of `type.perm.target` permission strings
+
+    Permissions are indexed on their target, exact targets in one hash
+    table and wildcard targets in another keyed on the wildcard prefix,
+    each entry holding the allowed and disallowed permission kinds for
+    each inheritance level the permission applies at.
+
+    A target is decided in the same precedence as `Permission.precedence`
+    by the most specific entry relevant to the kind checked. For each
+    level, exact targets first and then wildcards of the model, after
+    them the `app.*` and `*` wildcards. Within an entry disallow beats
+    allow. So a lookup costs the same regardless of how many
+    permissions the set holds, and decisions are memoized.
+    """
+    def __init__(self, permissions=()):
+        self.permissions = frozenset(permissions)
+        self._exact = {}
+        self._wildcards = {}
+        self._decisions = {}
+        for permission in self.permissions:
+            perm_type, perm, target = permission.split(".", 2)
+            for inherited, level in _inherited_targets(target):
+                if inherited[-1] == WILDCARD:
+                    table = self._wildcards
+                    key = wildcard_prefix(inherited)
+                else:
+                    table = self._exact
+                    key = inherited
+                entry = table.setdefault(key, {}).setdefault(level, (set(), set()))
+                allowed, disallowed = entry
+                if perm_type == Permission.TYPE_DISALLOW:
+                    disallowed.add(perm)
+                else:
+                    allowed.add(perm)
+
+    def __len__(self):
+        return len(self.permissions)
+
+    def __contains__(self, permission):
+        return permission in self.permissions
+
+    def __iter__(self):
+        return iter(self.permissions)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_decisions'] = {}
+        return state
+
+    @staticmethod
+    def _decide(entry, kind):
+        """Return the decision of `entry` for `kind`, None if undecided
+
+        If `kind` is None, then any kind of permission is accepted.
+        """
+        if entry is None:
+            return None
+        allowed, disallowed = entry
+        if disallowed and (kind is None or kind in disallowed):
+            return False
+        if allowed and (
+                kind is None or
+                not allowed.isdisjoint(GRANTED_BY.get(kind, (kind, )))
+        ):
+            return True
+        return None
+
+    def _lookup(self, target, kind, exact):
+        """Return whether `target` is allowed, `exact` are its exact entries"""
+        model_entries = []
+        entries = []
+        if self._wildcards:
+            for prefix in target_prefixes(target):
+                entry = self._wildcards.get(prefix)
+                if entry is not None:
+                    # `app` and `` are the `app.*` and `*` wildcards
+                    (model_entries if '.' in prefix else entries).append(entry)
+        levels = set(exact or ())
+        for entry in model_entries:
+            levels.update(entry)
+        for level in sorted(levels):
+            if exact:
+                decision = self._decide(exact.get(level), kind)
+                if decision is not None:
+                    return decision
+            for entry in model_entries:
+                decision = self._decide(entry.get(level), kind)
+                if decision is not None:
+                    return decision
+        for entry in entries:
+            decision = self._decide(entry.get(0), kind)
+            if decision is not None:
+                return decision
+        return False
+
+    def allows(self, target, kind=None):
+        """Check if `target` is allowed for `kind` of permission
+
+        If `kind` is None, then any kind of permission is accepted.
+        """
+        key = (target, kind)
+        if key not in self._decisions:
+            self._decisions[key] = self._lookup(target, kind, self._exact.get(target))
+        return self._decisions[key]
+
+    def filter_allowed(self, targets, kind=None):
+        """Return the targets allowed for `kind` of permission
+
+        Targets without exact permissions are decided by wildcards
+        alone, which are resolved once per model rather than once
+        per target.
+        """
+        allowed = []
+        covered = {}
+        for target in targets:
+            exact = self._exact.get(target)
+            if exact:
+                decision = self._lookup(target, kind, exact)
+            else:
+                parent = target[:max(target.rfind('.'), 0)]
+                if parent not in covered:
+                    covered[parent] = self._lookup(target, kind, None)
+                decision = covered[parent]
+            if decision:
+                allowed.append(target)
+        return allowed
@@ -0,0 +1,151 @@
+"""Opt-in measurement of the time and queries spent checking permissions
+
+Enable by setting `AUTH_PERMISSION_INSTRUMENTATION = True`, then
+`RealmAuthMiddleware` collects `PermissionStats` for each request.
+The stats are available as `request.permission_stats`, and are sent
+with the `permission_stats_collected` signal once the response is
+ready, the signal provides the `request` and its `stats` arguments.
+
+If `AUTH_PERMISSION_STATS_HEADER` is set the stats are added to the
+response in a header of that name, if `AUTH_PERMISSION_STATS_LOG` is
+True they are logged to the `etools_permissions` logger.
+"""
+import logging
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+
+from etools_permissions import cache
+
+try:
+    # follows the request across sync_to_async
+    from asgiref.local import Local
+except ImportError:  # pragma: no cover
+    from threading import local as Local
+
+logger = logging.getLogger('etools_permissions')
+
+permission_stats_collected = Signal()
+
+_local = Local()
+
+
+def is_enabled():
+    return getattr(settings, 'AUTH_PERMISSION_INSTRUMENTATION', False)
+
+
+class PermissionStats(object):
+    """Permission evaluation counters for a single request
+
+    `calls` counts the instrumented calls by name, `time` and `queries`
+    only include the outermost call, so nested calls are not counted
+    twice.
+    """
+    def __init__(self):
+        self.calls = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.queries = 0
+        self.time = 0.0
+        self._depth = 0
+
+    @property
+    def has_perm_calls(self):
+        return self.calls['has_perm']
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def measure(self, name, func, *args, **kwargs):
+        """Call `func`, counting it as a call of `name`"""
+        self.calls[name] += 1
+        if self._depth:
+            return func(*args, **kwargs)
+
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            # query counting needs Django 2.0 or later
+            if hasattr(connection, 'execute_wrapper'):
+                with connection.execute_wrapper(self._count_query):
+                    return func(*args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            self.time += time.perf_counter() - start
+            self._depth -= 1
+
+    def as_dict(self):
+        return {
+            'calls': dict(self.calls),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'queries': self.queries,
+            'time': self.time,
+        }
+
+    def __str__(self):
+        return 'has_perm={} cache_hits={} cache_misses={} queries={} time={:.2f}ms'.format(
+            self.has_perm_calls,
+            self.cache_hits,
+            self.cache_misses,
+            self.queries,
+            self.time * 1000,
+        )
+
+
+def start():
+    """Start collecting stats for the current request"""
+    _local.stats = PermissionStats()
+    return _local.stats
+
+
+def get_stats():
+    """Return the stats being collected, None if not collecting"""
+    return getattr(_local, 'stats', None)
+
+
+def finish(request, response):
+    """Stop collecting stats and report those of `request`"""
+    _local.stats = None
+    stats = request.permission_stats
+
+    permission_stats_collected.send(
+        sender=stats.__class__,
+        request=request,
+        stats=stats,
+    )
+    header = getattr(settings, 'AUTH_PERMISSION_STATS_HEADER', None)
+    if header:
+        response[header] = str(stats)
+    if getattr(settings, 'AUTH_PERMISSION_STATS_LOG', False):
+        logger.info('Permission stats for %s: %s', request.path, stats)
+    return response
+
+
+def record_cache(hit):
+    """Count a lookup of the permission cache, if caching is enabled"""
+    stats = get_stats()
+    if stats is None or cache.get_cache() is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+def instrument(name):
+    """Measure calls of the decorated function as `name`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = get_stats()
+            if stats is None:
+                return func(*args, **kwargs)
+            return stats.measure(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,9 +1,15 @@
-from collections import defaultdict
+import json
+import os
+from collections import OrderedDict
 
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group as GroupDjango, Permission as PermissionDjango
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
-from etools_permissions.models import Group, Permission, Realm
+from etools_permissions import cache
+from etools_permissions.models import effective_permissions_enabled, EffectivePermission, Group, Permission, Realm
+from etools_permissions.utils import bulk_link
 
 
 def get_permission(codename):
@@ -15,71 +21,426 @@ def get_permission(codename):
     return permission
 
 
-def get_permission_group_map():
-    permission_map = defaultdict(list)
-    for group in GroupDjango.objects.all():
-        for perm in group.permissions.all():
-            permission_map[perm.pk].append(group)
-    return permission_map
+def get_target(app_label, model_name):
+    return "{app_label}.{model_name}.*".format(
+        app_label=app_label,
+        model_name=model_name,
+    )
 
 
-def migrate_permissions():
-    """Migrate all django permissions to etools permissions
+class PermissionMigration(object):
+    """Migrate django permissions and groups to etools permissions
+
+    The source tables are read in chunks of `batch_size` rows, ordered
+    by primary key. For each chunk the missing rows are worked out in
+    memory and written with `bulk_create`, in a transaction of its own,
+    so the number of queries and the memory used don't depend on the
+    number of permissions, groups or users.
 
-    For each permisssion convert `add`/`change`/`delete` to `edit`,
-    rest are considered `view`
+    If `checkpoint` is the path of a file, the position reached is
+    saved there once the transaction of each chunk is committed, and a
+    migration that was interrupted resumes from it. The file is removed
+    once the migration completes.
 
-    Set relation to relevant group.
+    With `dry_run` nothing is written, only the rows that would be
+    created are counted. Rows that would be created get a placeholder
+    instead of a primary key, so later chunks and steps don't count
+    them again. Placeholders of links are dropped at the end of their
+    step, so only one per group, permission and user is kept.
     """
-    permission_map = get_permission_group_map()
-    for perm_django in PermissionDjango.objects.all():
-        app_label = perm_django.content_type.app_label
-        model_name = perm_django.content_type.model
-        permission = get_permission(perm_django.codename)
-        target = "{app_label}.{model_name}.*".format(
-            app_label=app_label,
-            model_name=model_name,
+    STEPS = (
+        'groups',
+        'permissions',
+        'group_permissions',
+        'user_permissions',
+        'user_groups',
+    )
+
+    def __init__(self, batch_size=1000, log=None, checkpoint=None, dry_run=False):
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+        self.created = OrderedDict()
+        self._position = self._load_checkpoint()
+        self._permission_map = None
+        self._group_map = None
+        # placeholders of the groups, permissions and realms a dry run
+        # would create, needed by later steps, and of the links, only
+        # needed until the end of their step
+        self._planned = set()
+        self._planned_links = set()
+
+    def _load_checkpoint(self):
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as f:
+            position = json.load(f)
+        self.log('Resuming from {} after {}'.format(
+            position['step'],
+            position['last_pk'],
+        ))
+        return position['step'], position['last_pk']
+
+    def _save_checkpoint(self, step, last_pk):
+        self._position = (step, last_pk)
+        if self.checkpoint is None or self.dry_run:
+            return
+        # replaced in one step, so an interrupted write can't corrupt it
+        path = '{}.tmp'.format(self.checkpoint)
+        with open(path, 'w') as f:
+            json.dump({'step': step, 'last_pk': last_pk}, f)
+        os.replace(path, self.checkpoint)
+
+    def _start(self, step):
+        """Return the pk to start `step` after, None if already done"""
+        if self._position is None:
+            return 0
+        position_step, last_pk = self._position
+        if self.STEPS.index(step) < self.STEPS.index(position_step):
+            return None
+        if step == position_step:
+            return last_pk
+        return 0
+
+    def _migrate(self, step, queryset, fields, process):
+        """Call `process` with rows of `queryset` in chunks of `batch_size`
+
+        Rows are `fields` values, each chunk is processed in a
+        transaction of its own and checkpointed once it is committed.
+        """
+        last_pk = self._start(step)
+        if last_pk is None:
+            return
+        queryset = queryset.order_by('pk').values_list('pk', *fields)
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:self.batch_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            with transaction.atomic():
+                process([row[1:] for row in chunk])
+            self._save_checkpoint(step, last_pk)
+            self.log('{}: migrated up to {}'.format(step, last_pk))
+        self._planned_links.clear()
+
+    def _count(self, model, count):
+        name = model._meta.verbose_name_plural
+        self.created[name] = self.created.get(name, 0) + count
+
+    def _create(self, model, objs):
+        """Create `objs`, in a dry run only count them"""
+        self._count(model, len(objs))
+        if self.dry_run:
+            return objs
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _plan(self, *placeholder):
+        """Remember a row a dry run would create, return its placeholder"""
+        self._planned.add(placeholder)
+        return placeholder
+
+    def _link(self, through, from_field, to_field, pairs):
+        """Create the `through` rows for `pairs` that do not exist yet"""
+        if not self.dry_run:
+            self._count(through, bulk_link(through, from_field, to_field, pairs, self.batch_size))
+            return
+        pairs = set(pairs)
+        saved = [
+            pair for pair in pairs
+            if not isinstance(pair[0], tuple) and not isinstance(pair[1], tuple)
+        ]
+        existing = set()
+        if saved:
+            existing = set(through.objects.filter(**{
+                '{}__in'.format(from_field): {from_id for from_id, _ in saved},
+                '{}__in'.format(to_field): {to_id for _, to_id in saved},
+            }).values_list(from_field, to_field))
+        missing = pairs - existing - self._planned_links
+        self._planned_links.update(missing)
+        self._count(through, len(missing))
+
+    def _get_permissions(self, keys):
+        """Return a map of (permission, target) to permission pk
+
+        Create the permissions that do not exist yet
+        """
+        permissions = {}
+        for pk, permission, target in Permission.objects.filter(
+                permission_type=Permission.TYPE_ALLOW,
+                target__in={target for _, target in keys},
+                condition=[],
+        ).order_by('-pk').values_list('pk', 'permission', 'target'):
+            permissions[(permission, target)] = pk
+        for permission, target in keys:
+            placeholder = ('permission', permission, target)
+            if placeholder in self._planned:
+                permissions.setdefault((permission, target), placeholder)
+
+        created = self._create(Permission, [
+            Permission(
+                permission=permission,
+                permission_type=Permission.TYPE_ALLOW,
+                target=target,
+                condition=[],
+            )
+            for permission, target in sorted(keys)
+            if (permission, target) not in permissions
+        ])
+        for perm in created:
+            if self.dry_run:
+                permissions[(perm.permission, perm.target)] = self._plan('permission', perm.permission, perm.target)
+            else:
+                permissions[(perm.permission, perm.target)] = perm.pk
+        return permissions
+
+    def _get_realms(self, user_ids):
+        """Return a map of user pk to realm pk
+
+        Create realms, without workspace or organization,
+        for users that do not have one yet
+        """
+        realms = {}
+        for pk, user_id in Realm.objects.filter(
+                user_id__in=user_ids,
+        ).order_by('-pk').values_list('pk', 'user_id'):
+            realms[user_id] = pk
+        for user_id in user_ids:
+            if ('realm', user_id) in self._planned:
+                realms.setdefault(user_id, ('realm', user_id))
+
+        new_realms = [
+            Realm(user_id=user_id, workspace=None, organization=None)
+            for user_id in sorted(user_ids)
+            if user_id not in realms
+        ]
+        for realm in new_realms:
+            realm.check_required()
+        for realm in self._create(Realm, new_realms):
+            if self.dry_run:
+                realms[realm.user_id] = self._plan('realm', realm.user_id)
+            else:
+                realms[realm.user_id] = realm.pk
+        return realms
+
+    @property
+    def permission_map(self):
+        """Map of django permission pk to permission pk
+
+        There are only a few django permissions per model,
+        so the map is kept in memory. In a dry run, permissions
+        that would be created map to their placeholder.
+        """
+        if self._permission_map is None:
+            keys = {
+                pk: (get_permission(codename), get_target(app_label, model_name))
+                for pk, codename, app_label, model_name in PermissionDjango.objects.values_list(
+                    'pk',
+                    'codename',
+                    'content_type__app_label',
+                    'content_type__model',
+                )
+            }
+            permissions = dict(
+                ((permission, target), pk)
+                for pk, permission, target in Permission.objects.filter(
+                    permission_type=Permission.TYPE_ALLOW,
+                    target__in={target for _, target in keys.values()},
+                    condition=[],
+                ).order_by('-pk').values_list('pk', 'permission', 'target')
+            )
+            for key in keys.values():
+                if ('permission',) + key in self._planned:
+                    permissions.setdefault(key, ('permission',) + key)
+            self._permission_map = {
+                pk: permissions[key] for pk, key in keys.items()
+                if key in permissions
+            }
+        return self._permission_map
+
+    @property
+    def group_map(self):
+        """Map of django group pk to group pk, for groups having permissions
+
+        Only users of groups having permissions get a realm
+        """
+        if self._group_map is None:
+            group_names = dict(GroupDjango.objects.filter(
+                pk__in=GroupDjango.permissions.through.objects.values('group_id'),
+            ).values_list('pk', 'name'))
+            groups = dict(Group.objects.filter(
+                name__in=group_names.values(),
+            ).values_list('name', 'pk'))
+            for name in group_names.values():
+                if ('group', name) in self._planned:
+                    groups.setdefault(name, ('group', name))
+            self._group_map = {
+                pk: groups[name] for pk, name in group_names.items()
+                if name in groups
+            }
+        return self._group_map
+
+    def _lookup(self, mapping, pk, name):
+        """Return `mapping[pk]`, raise CommandError if it was not migrated"""
+        try:
+            return mapping[pk]
+        except KeyError:
+            raise CommandError(
+                'Django {} {} has not been migrated, run the migration '
+                'again without the checkpoint'.format(name, pk)
+            )
+
+    def _create_groups(self, chunk):
+        names = [name for name, in chunk]
+        existing = set(Group.objects.filter(
+            name__in=names,
+        ).values_list('name', flat=True))
+        existing.update(
+            name for name in names if ('group', name) in self._planned
+        )
+        created = self._create(Group, [
+            Group(name=name) for name in names if name not in existing
+        ])
+        if self.dry_run:
+            for group in created:
+                self._plan('group', group.name)
+
+    def _create_permissions(self, chunk):
+        self._get_permissions({
+            (get_permission(codename), get_target(app_label, model_name))
+            for codename, app_label, model_name in chunk
+        })
+
+    def _link_group_permissions(self, chunk):
+        self._link(
+            Group.permissions.through,
+            'group_id',
+            'permission_id',
+            [(self._lookup(self.group_map, group_id, 'group'),
+              self._lookup(self.permission_map, permission_id, 'permission'))
+             for group_id, permission_id in chunk],
+        )
+
+    def _link_user_permissions(self, chunk):
+        realms = self._get_realms({user_id for user_id, _ in chunk})
+        self._link(
+            Realm.permissions.through,
+            'realm_id',
+            'permission_id',
+            [(realms[user_id], self._lookup(self.permission_map, permission_id, 'permission'))
+             for user_id, permission_id in chunk],
         )
-        perm, _ = Permission.objects.get_or_create(
-            permission=permission,
-            permission_type=Permission.TYPE_ALLOW,
-            target=target,
-            condition=[],
+
+    def _link_user_groups(self, chunk):
+        realms = self._get_realms({user_id for user_id, _ in chunk})
+        self._link(
+            Realm.groups.through,
+            'realm_id',
+            'group_id',
+            [(realms[user_id], self._lookup(self.group_map, group_id, 'group'))
+             for user_id, group_id in chunk],
         )
 
+    def migrate_groups(self):
+        """Migrate all groups from django groups to etools permission groups"""
+        self._migrate('groups', GroupDjango.objects.all(), ['name'], self._create_groups)
+
+    def migrate_permissions(self):
+        """Migrate all django permissions to etools permissions
+
+        For each permisssion convert `add`/`change`/`delete` to `edit`,
+        rest are considered `view`
+
+        Set relation to relevant group.
+        """
+        self._migrate(
+            'permissions',
+            PermissionDjango.objects.all(),
+            ['codename', 'content_type__app_label', 'content_type__model'],
+            self._create_permissions,
+        )
+        self._migrate(
+            'group_permissions',
+            GroupDjango.permissions.through.objects.all(),
+            ['group_id', 'permission_id'],
+            self._link_group_permissions,
+        )
         # users permissions
         # ignore workspace and organization
         # as there is no consideration of that in
         # default django permission/group setup
-        for user in perm_django.user_set.all():
-            realm, _ = Realm.objects.get_or_create(
-                user=user,
-                defaults={
-                    "workspace": None,
-                    "organization": None,
-                }
-            )
-            realm.permissions.add(perm)
+        self._migrate(
+            'user_permissions',
+            get_user_model().user_permissions.through.objects.all(),
+            ['user_id', 'permission_id'],
+            self._link_user_permissions,
+        )
+        self._migrate(
+            'user_groups',
+            get_user_model().groups.through.objects.filter(
+                group_id__in=GroupDjango.permissions.through.objects.values('group_id'),
+            ),
+            ['user_id', 'group_id'],
+            self._link_user_groups,
+        )
+
+    def run(self):
+        self.migrate_groups()
+        self.migrate_permissions()
 
-        for group_django in permission_map[perm_django.pk]:
-            group = Group.objects.get(name=group_django.name)
-            group.permissions.add(perm)
+        for name, count in self.created.items():
+            self.log('{} {} {}'.format(
+                'Would create' if self.dry_run else 'Created',
+                count,
+                name,
+            ))
 
-            # group
-            for user in group_django.user_set.all():
-                realm, _ = Realm.objects.get_or_create(user=user)
-                realm.groups.add(group)
+        if not self.dry_run:
+            if self.checkpoint is not None and os.path.exists(self.checkpoint):
+                os.remove(self.checkpoint)
+            # through rows created in bulk don't send m2m_changed
+            cache.bump_version()
+            if effective_permissions_enabled():
+                EffectivePermission.objects.refresh()
 
 
 def migrate_groups():
     """Migrate all groups from django groups to etools permission groups"""
-    for group_django in GroupDjango.objects.all():
-        Group.objects.get_or_create(name=group_django.name)
+    PermissionMigration().migrate_groups()
+
+
+def migrate_permissions():
+    """Migrate all django permissions to etools permissions"""
+    PermissionMigration().migrate_permissions()
 
 
 class Command(BaseCommand):
     help = 'Migrate from permissions2 to etools_permissions'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows to process at a time',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File to save progress in, used to resume an interrupted run',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the rows that would be created, without writing them',
+        )
+
     def handle(self, *args, **options):
-        migrate_groups()
-        migrate_permissions()
+        log = None
+        if options['verbosity'] > 0:
+            log = self.stdout.write
+        PermissionMigration(
+            options['batch_size'],
+            log,
+            checkpoint=options['checkpoint'],
+            dry_run=options['dry_run'],
+        ).run()
@@ -0,0 +1,142 @@
+import csv
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from etools_permissions.models import Group, Permission, Realm
+from etools_permissions.utils import chunked
+
+FIELDS = ('user', 'workspace', 'organization', 'groups', 'permissions')
+
+
+def _int(value, field, line):
+    try:
+        return int(value)
+    except ValueError:
+        raise CommandError('Line {}: invalid {} {!r}'.format(line, field, value))
+
+
+def _user(value, line):
+    if not value:
+        raise CommandError('Line {}: missing user'.format(line))
+    return value
+
+
+def read_csv(lines):
+    """Read records from CSV having a header row of `FIELDS`
+
+    Groups and permissions are separated by spaces.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        line = reader.line_num
+        yield {
+            'user': _user(row.get('user'), line),
+            'workspace': _int(row['workspace'], 'workspace', line) if row.get('workspace') else None,
+            'organization': _int(row['organization'], 'organization', line) if row.get('organization') else None,
+            'groups': (row.get('groups') or '').split(),
+            'permissions': [_int(pk, 'permission', line) for pk in (row.get('permissions') or '').split()],
+        }
+
+
+def read_jsonl(lines):
+    """Read records from JSON lines, one object of `FIELDS` per line"""
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise CommandError('Line {}: {}'.format(number, e))
+            if not isinstance(record, dict):
+                raise CommandError('Line {}: expected an object'.format(number))
+            _user(record.get('user'), number)
+            yield record
+
+
+def resolve(records, batch_size):
+    """Replace usernames and group names of `records` with primary keys
+
+    Each batch of records is resolved with a query per model, raise
+    CommandError for users, workspaces, organizations, groups or
+    permissions not found.
+    """
+    User = get_user_model()
+    Workspace = Realm._meta.get_field('workspace').related_model
+    Organization = Realm._meta.get_field('organization').related_model
+    for chunk in chunked(records, batch_size):
+        users = dict(User.objects.filter(**{
+            '{}__in'.format(User.USERNAME_FIELD): {record['user'] for record in chunk},
+        }).values_list(User.USERNAME_FIELD, 'pk'))
+        groups = dict(Group.objects.filter(
+            name__in={name for record in chunk for name in record.get('groups') or ()},
+        ).values_list('name', 'pk'))
+        workspace_ids = {record['workspace'] for record in chunk if record.get('workspace')}
+        workspaces = set(Workspace.objects.filter(
+            pk__in=workspace_ids,
+        ).values_list('pk', flat=True))
+        organization_ids = {record['organization'] for record in chunk if record.get('organization')}
+        organizations = set(Organization.objects.filter(
+            pk__in=organization_ids,
+        ).values_list('pk', flat=True))
+        permission_ids = {pk for record in chunk for pk in record.get('permissions') or ()}
+        permissions = set(Permission.objects.filter(
+            pk__in=permission_ids,
+        ).values_list('pk', flat=True))
+
+        missing = []
+        for record in chunk:
+            if record['user'] not in users:
+                missing.append('user {}'.format(record['user']))
+            missing.extend(
+                'group {}'.format(name) for name in record.get('groups') or ()
+                if name not in groups
+            )
+        missing.extend('workspace {}'.format(pk) for pk in workspace_ids - workspaces)
+        missing.extend('organization {}'.format(pk) for pk in organization_ids - organizations)
+        missing.extend('permission {}'.format(pk) for pk in sorted(permission_ids - permissions))
+        if missing:
+            raise CommandError('Not found: {}'.format(', '.join(sorted(set(missing)))))
+
+        for record in chunk:
+            yield dict(
+                record,
+                user=users[record['user']],
+                groups=[groups[name] for name in record.get('groups') or ()],
+            )
+
+
+class Command(BaseCommand):
+    help = 'Create realms, with their groups and permissions, from a CSV or JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File of records having {} fields'.format(', '.join(FIELDS)),
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Format of the file, guessed from its extension by default',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of records to save at a time',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format']
+        if file_format is None:
+            file_format = 'csv' if options['path'].endswith('.csv') else 'jsonl'
+        read = read_csv if file_format == 'csv' else read_jsonl
+
+        with open(options['path'], newline='') as f:
+            created = Realm.objects.bulk_provision(
+                resolve(read(f), options['batch_size']),
+                batch_size=options['batch_size'],
+            )
+        if options['verbosity'] > 0:
+            for name, count in created.items():
+                self.stdout.write('Created {} {}'.format(count, name))
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from etools_permissions.models import EffectivePermission, Realm
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the effective permissions of realms'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'realms',
+            nargs='*',
+            type=int,
+            help='Primary keys of the realms to rebuild, all realms by default',
+        )
+
+    def handle(self, *args, **options):
+        realms = options['realms'] or None
+        EffectivePermission.objects.refresh(realms)
+        if options['verbosity'] > 0:
+            self.stdout.write('Rebuilt effective permissions of {} realms'.format(
+                len(realms) if realms else Realm.objects.count(),
+            ))
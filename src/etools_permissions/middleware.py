@@ -1,7 +1,12 @@
+from functools import partial
+
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject
 
+from etools_permissions import instrumentation
+from etools_permissions.utils import end_realm_scope, iscoroutinefunction, markcoroutinefunction, start_realm_scope
+
 
 def get_realm(request):
     from etools_permissions.utils import get_realm
@@ -10,7 +15,41 @@ def get_realm(request):
     return request._cached_realm
 
 
+async def aget_realm(request):
+    from etools_permissions.utils import aget_realm
+    if not hasattr(request, '_cached_realm'):
+        request._cached_realm = await aget_realm(request)
+    return request._cached_realm
+
+
 class RealmAuthMiddleware(MiddlewareMixin):
+    """
+    Set a lazy `request.realm`, and `request.arealm()` to be awaited
+    in async views instead.
+
+    The middleware does no I/O itself, so under ASGI it is run in the
+    event loop rather than in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super(RealmAuthMiddleware, self).__init__(get_response)
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            # Let the handler know to await this middleware
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        return super(RealmAuthMiddleware, self).__call__(request)
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
     def process_request(self, request):
         assert hasattr(request, 'user'), (
             "The Realm Auth middleware requires Django Authentication "
@@ -19,3 +58,13 @@ class RealmAuthMiddleware(MiddlewareMixin):
             "before 'auth.middleware.RealmAuthMiddleware'."
         ) % ("_CLASSES" if settings.MIDDLEWARE is None else "")
         request.realm = SimpleLazyObject(lambda: get_realm(request))
+        request.arealm = partial(aget_realm, request)
+        start_realm_scope()
+        if instrumentation.is_enabled():
+            request.permission_stats = instrumentation.start()
+
+    def process_response(self, request, response):
+        end_realm_scope()
+        if hasattr(request, 'permission_stats'):
+            return instrumentation.finish(request, response)
+        return response
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres import indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etools_permissions', '0001_initial'),
+    ]
+
+    operations = [
+        # btree index for `target__in`, on PostgreSQL a `varchar_pattern_ops`
+        # index is created alongside it for prefix lookups
+        migrations.AlterField(
+            model_name='permission',
+            name='target',
+            field=models.CharField(
+                db_index=True,
+                max_length=100,
+                verbose_name='target'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=indexes.GinIndex(
+                fields=['condition'],
+                name='etools_perm_condition_gin'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=models.Index(
+                fields=['permission', 'permission_type'],
+                name='etools_perm_type_idx'
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etools_permissions', '0002_permission_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePermission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(
+                    choices=[('view', 'View'), ('edit', 'Edit'), ('action', 'Action')],
+                    max_length=10,
+                )),
+                ('permission_type', models.CharField(
+                    choices=[('allow', 'Allow'), ('disallow', 'Disallow')],
+                    max_length=10,
+                )),
+                ('target', models.CharField(max_length=100)),
+                ('condition', django.contrib.postgres.fields.ArrayField(
+                    base_field=models.CharField(max_length=100),
+                    blank=True,
+                    default=[],
+                    size=None,
+                )),
+                ('realm', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='effective_permissions',
+                    to='etools_permissions.Realm',
+                )),
+                ('source', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='+',
+                    to='etools_permissions.Permission',
+                )),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='effectivepermission',
+            unique_together={('realm', 'source')},
+        ),
+    ]
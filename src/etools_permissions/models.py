@@ -1,55 +1,174 @@
-from django.apps import apps
+from collections import OrderedDict
+
 from django.conf import settings
 from django.contrib.auth import get_backends
 from django.contrib.postgres.fields import ArrayField
-from django.core.exceptions import PermissionDenied
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.core.exceptions import EmptyResultSet, PermissionDenied
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.query import ModelIterable
 from django.db.utils import IntegrityError
 from django.utils.translation import ugettext as _
 
-from etools_permissions.conditions import BaseCondition
-from etools_permissions.utils import collect_child_models, collect_parent_models
+from etools_permissions import cache, instrumentation
+from etools_permissions.conditions import normalize_context
+from etools_permissions.targets import target_registry, target_scope, TargetTrie, WILDCARD, wildcard_targets
+from etools_permissions.utils import bulk_link, chunked, get_inheritance_table, inheritance
 
 
 class PermissionQuerySet(models.QuerySet):
     def filter_by_context(self, context):
-        context = list(context)
-        i = 0
-        while i < len(context):
-            if isinstance(context[i], BaseCondition):
-                context[i] = context[i].to_internal_value()
+        return self.filter(condition__contained_by=list(normalize_context(context)))
 
-            if isinstance(context[i], (list, tuple)):
-                context.extend(context[i])
-                context.pop(i)
-            else:
-                i += 1
+    def filter_by_targets(self, targets):
+        return self.filter(target__in=Permission.expand_targets(targets))
+
+    def records(self):
+        """Return the permissions as `PermissionRecord`, without model instances"""
+        return [
+            PermissionRecord(*row)
+            for row in self.values_list(
+                'permission',
+                'permission_type',
+                'target',
+                'condition',
+            )
+        ]
 
-        return self.filter(condition__contained_by=context)
+    def allowed_targets(self, targets, kind):
+        """Apply permissions to targets inside the database
 
-    def filter_by_targets(self, targets):
-        targets = list(targets)
+        Give the same result as `Permission.apply_permissions`, but
+        precedence is resolved by a single query and only the allowed
+        targets are returned. Permissions are applied to child models
+        through the precomputed inheritance table.
+        """
+        targets = list(set(targets))
+        if not targets:
+            return []
+
+        try:
+            permissions_sql, params = self.values_list(
+                'permission',
+                'permission_type',
+                'target',
+                'condition',
+            ).query.sql_with_params()
+        except EmptyResultSet:
+            # the queryset can't match any permission, e.g. `none()`
+            return []
+        params = list(params)
+
+        inheritance = get_inheritance_table()
+        if inheritance:
+            inheritance_sql = ' UNION ALL '.join(
+                ['SELECT %s::text, %s::text, %s::integer'] * len(inheritance)
+            )
+            for row in inheritance:
+                params.extend(row)
+        else:
+            inheritance_sql = 'SELECT NULL::text, NULL::text, NULL::integer WHERE FALSE'
 
-        i = 0
-        parent_map = dict()
-        while i < len(targets):
-            target = targets[i]
+        params.append(targets)
 
-            model, field_name = Permission.parse_target(target)
-            if model in parent_map:
-                parents = parent_map[model]
-            else:
-                parents = collect_parent_models(model, levels=1)
-                parent_map[model] = parents
+        if kind == Permission.VIEW:
+            # If you can edit field you can view it too.
+            kind_sql = "e.permission = %s OR (e.permission_type = %s AND e.permission = %s)"
+            params.extend([Permission.VIEW, Permission.TYPE_ALLOW, Permission.EDIT])
+        else:
+            kind_sql = "e.permission = %s"
+            params.append(kind)
+
+        # disallow first when permissions are equally specific
+        params.append(Permission.TYPE_ALLOW)
+        params.append(Permission.TYPE_ALLOW)
+
+        sql = """
+            WITH perms (permission, permission_type, target, condition) AS (
+                {permissions}
+            ), inheritance (parent, child, level) AS (
+                {inheritance}
+            ), expanded AS (
+                SELECT p.permission, p.permission_type, p.target, 0 AS level,
+                    cardinality(p.condition) AS conditions
+                FROM perms p
+                UNION ALL
+                SELECT p.permission, p.permission_type,
+                    i.child || substr(p.target, length(i.parent) + 1),
+                    i.level, cardinality(p.condition)
+                FROM perms p JOIN inheritance i
+                    ON left(p.target, length(i.parent) + 1) = i.parent || '.'
+            ), winners AS (
+                SELECT DISTINCT ON (t.target) t.target, e.permission_type,
+                    -- as `target_scope`
+                    CASE WHEN e.target = '*' THEN 2 WHEN e.target LIKE '%%.%%.%%' THEN 0 ELSE 1 END AS scope,
+                    e.level, e.conditions, e.target LIKE '%%*' AS wildcard
+                FROM unnest(%s::text[]) AS t (target)
+                JOIN expanded e ON (
+                    t.target = e.target OR (
+                        -- wildcards cover the targets under whole segments
+                        -- of their prefix, as `TargetTrie`
+                        e.target LIKE '%%*' AND (
+                            e.target = '*' OR
+                            left(t.target, length(e.target) - 1) = left(e.target, -1)
+                        )
+                    )
+                )
+                WHERE {kind}
+                ORDER BY t.target, scope, e.level, e.conditions DESC, wildcard, e.permission_type = %s
+            )
+            SELECT target FROM winners
+            WHERE permission_type = %s
+            ORDER BY scope, level, conditions DESC, wildcard, target
+        """.format(
+            permissions=permissions_sql,
+            inheritance=inheritance_sql,
+            kind=kind_sql,
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
 
-            targets.extend([Permission.get_target(parent, field_name) for parent in parents])
 
-            i += 1
+class PermissionRecord(object):
+    """Lightweight permission used while applying permissions
+
+    `image_level` is the number of inheritance steps between the
+    model the permission was defined for and the model it applies to.
+    """
+    __slots__ = ('permission', 'permission_type', 'target', 'condition', 'image_level')
 
-        wildcards = list(set([t.rsplit('.', 1)[0] + '.*' for t in targets]))
-        targets = targets + wildcards
+    def __init__(self, permission, permission_type, target, condition, image_level=0):
+        self.permission = permission
+        self.permission_type = permission_type
+        self.target = target
+        self.condition = condition
+        self.image_level = image_level
 
-        return self.filter(target__in=targets)
+    @classmethod
+    def from_permission(cls, perm):
+        if isinstance(perm, cls):
+            return perm
+        return cls(perm.permission, perm.permission_type, perm.target, perm.condition)
+
+    def to_permission(self):
+        """Return an unsaved `Permission` of the record"""
+        return Permission(
+            permission=self.permission,
+            permission_type=self.permission_type,
+            target=self.target,
+            condition=self.condition,
+        )
+
+    def __repr__(self):
+        return '<PermissionRecord: {}.{}.{} {} level {}>'.format(
+            self.permission_type,
+            self.permission,
+            self.target,
+            self.condition,
+            self.image_level,
+        )
 
 
 class Permission(models.Model):
@@ -93,6 +212,7 @@ class Permission(models.Model):
     target = models.CharField(
         max_length=100,
         verbose_name=_('target'),
+        db_index=True,
     )
     condition = ArrayField(
         models.CharField(max_length=100),
@@ -103,6 +223,15 @@ class Permission(models.Model):
 
     objects = PermissionQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['condition'], name='etools_perm_condition_gin'),
+            models.Index(
+                fields=['permission', 'permission_type'],
+                name='etools_perm_type_idx',
+            ),
+        ]
+
     def __str__(self):
         return '{} permission to {} {} at {}'.format(
             self.permission_type.title(),
@@ -118,75 +247,106 @@ class Permission(models.Model):
         elif hasattr(field, 'field_name'):
             field = field.field_name
 
-        return '.'.join([model._meta.app_label, model._meta.model_name, field])
+        return target_registry.get_target(model, field)
 
     @staticmethod
     def parse_target(target):
-        app_label, model_name, field = target.split('.')
-        model = apps.get_model(app_label, model_name)
-        return model, field
+        return target_registry.parse_target(target)
+
+    @staticmethod
+    def expand_targets(targets):
+        """Return the targets of permissions that can apply to `targets`
+
+        Those are the targets, the same fields of parent models,
+        and the wildcards covering them, `app.model.*`, `app.*` and `*`.
+        """
+        targets = list(targets)
+
+        i = 0
+        while i < len(targets):
+            target = targets[i]
+
+            model, field_name = Permission.parse_target(target)
+            if model is not None:
+                parents = inheritance.get_parents(model)
+                targets.extend([Permission.get_target(parent, field_name) for parent in parents])
+
+            i += 1
+
+        wildcards = list(set(
+            wildcard for t in targets for wildcard in wildcard_targets(t)
+        ) - set(targets))
+        return targets + wildcards
+
+    @staticmethod
+    def precedence(perm):
+        """Sort key ordering permissions from the most to the least specific
+
+        Order permissions in dependency from their scope, level
+        and complexity of condition, `app.*` and `*` permissions
+        come after those of models. Of equally specific permissions
+        disallow comes first, so it wins whatever the input order.
+        """
+        return (
+            target_scope(perm.target),
+            perm.image_level,
+            -len(perm.condition),
+            WILDCARD in perm.target,
+            perm.permission_type != Permission.TYPE_DISALLOW,
+        )
+
+    @classmethod
+    def applies_to(cls, perm, kind):
+        """Check if `perm` decides `kind` of permission"""
+        if kind == cls.VIEW and perm.permission_type == cls.TYPE_ALLOW:
+            # If you can edit field you can view it too.
+            return perm.permission in [cls.VIEW, cls.EDIT]
+        return perm.permission == kind
 
     @classmethod
     def apply_permissions(cls, permissions, targets, kind):
         """apply permissions to targets"""
-        permissions = list(permissions)
+        if isinstance(permissions, PermissionQuerySet) and permissions._result_cache is None:
+            permissions = permissions.records()
+        else:
+            permissions = [PermissionRecord.from_permission(perm) for perm in permissions]
 
         i = 0
-        children_map = dict()
         while i < len(permissions):
             perm = permissions[i]
 
             model, field_name = Permission.parse_target(perm.target)
-            if model in children_map:
-                children = children_map[model]
-            else:
-                children = collect_child_models(model, levels=1)
-                children_map[model] = children
-
-            # apply permissions to childs, in case of inheritance
-            imaginary_permissions = [
-                Permission(
-                    permission=perm.permission,
-                    permission_type=perm.permission_type,
-                    condition=perm.condition,
-                    target=Permission.get_target(child, field_name)
-                )
-                for child in children
-            ]
 
+            # apply permissions to childs, in case of inheritance.
             # permissions can be defined both for children and parent,
             # so we need to priority children permissions from automatically
             # generated parent-based permissions.
-            perm.image_level = getattr(perm, 'image_level', 0)
-            for imaginary_perm in imaginary_permissions:
-                imaginary_perm.image_level = perm.image_level + 1
-
-            permissions.extend(imaginary_permissions)
+            if model is not None:
+                permissions.extend(
+                    PermissionRecord(
+                        perm.permission,
+                        perm.permission_type,
+                        Permission.get_target(child, field_name),
+                        perm.condition,
+                        perm.image_level + 1,
+                    )
+                    for child in inheritance.get_children(model)
+                )
 
             i += 1
 
-        # order permissions in dependency from their level
-        # and complexity of condition
-        permissions.sort(
-            key=lambda perm: (
-                perm.image_level, -len(perm.condition), '*' in perm.target
-            )
-        )
+        permissions.sort(key=cls.precedence)
 
         allowed_targets = []
         targets = set(targets)
+        trie = TargetTrie(targets)
         for perm in permissions:
-            if kind == cls.VIEW and perm.permission_type == cls.TYPE_ALLOW:
-                # If you can edit field you can view it too.
-                if perm.permission not in [cls.VIEW, cls.EDIT]:
-                    continue
-            elif perm.permission != kind:
+            if not cls.applies_to(perm, kind):
                 continue
 
-            if perm.target[-1] == '*':
-                affected_targets = set(
-                    [t for t in targets if t.startswith(perm.target[:-1])]
-                )
+            if perm.target[-1] == WILDCARD:
+                # covers model-level targets too, as checked by `RealmPermission`
+                affected_targets = trie.covered(perm.target) & targets
             else:
                 affected_targets = {perm.target}
 
@@ -200,6 +360,28 @@ class Permission(models.Model):
 
         return allowed_targets
 
+    @classmethod
+    def get_allowed_targets(cls, context, targets, kind, realm=None):
+        """Return the `targets` allowed for `kind` in `context`
+
+        Permissions are filtered by `context` and `targets` and applied,
+        limited to those of `realm` if provided. The result is cached
+        on the normalized context, see `cache.get_context_key`.
+        """
+        context = normalize_context(context)
+        targets = list(targets)
+        allowed = cache.get_allowed_targets(context, targets, kind, realm)
+        instrumentation.record_cache(hit=allowed is not None)
+        if allowed is None:
+            permissions = cls.objects.filter_by_context(context).filter_by_targets(targets)
+            if realm is not None:
+                permissions = permissions.filter(
+                    models.Q(realm=realm) | models.Q(group__realm=realm),
+                ).distinct()
+            allowed = cls.apply_permissions(permissions, targets, kind)
+            cache.set_allowed_targets(context, targets, kind, realm, allowed)
+        return allowed
+
 
 class GroupManager(models.Manager):
     use_in_migrations = True
@@ -229,6 +411,180 @@ class Group(models.Model):
         return (self.name,)
 
 
+class RealmPermissionsIterable(ModelIterable):
+    """Fill the backend permission caches from annotated permissions"""
+    def __iter__(self):
+        for realm in super(RealmPermissionsIterable, self).__iter__():
+            realm_perms = realm.__dict__.pop('realm_perms', None)
+            group_perms = realm.__dict__.pop('group_perms', None)
+            effective_perms = realm.__dict__.pop('effective_perms', None)
+            if realm.user.is_superuser:
+                # superusers get every permission,
+                # leave loading those to the backend
+                pass
+            elif effective_perms is not None:
+                realm._perm_cache = set(effective_perms)
+            elif realm_perms is not None:
+                realm._realm_perm_cache = set(realm_perms)
+                realm._group_perm_cache = set(group_perms)
+            yield realm
+
+
+def _pk(value):
+    return getattr(value, 'pk', value)
+
+
+class RealmQuerySet(models.QuerySet):
+    def with_permissions(self):
+        """Load the realm permissions and group permissions in the same query
+
+        Permissions are loaded as `type.perm.target` strings and stored
+        on each realm in the caches used by `RealmBackend`, so checking
+        permissions of a realm loaded this way needs no more queries.
+        If `AUTH_PERMISSION_EFFECTIVE_TABLE` is set, the permissions are
+        read from `EffectivePermission` instead.
+        """
+        realm_permissions = Realm._meta.get_field('permissions')
+        realm_groups = Realm._meta.get_field('groups')
+        group_permissions = Group._meta.get_field('permissions')
+        permission_sql = (
+            "ARRAY(SELECT DISTINCT p.permission_type || '.' || p.permission "
+            "|| '.' || p.target FROM {permission} p {joins} "
+            "WHERE {realm_column} = {realm}.{pk} "
+            # as `RealmBackend`, leave out disallows with conditions
+            "AND NOT (p.permission_type = %s AND cardinality(p.condition) > 0))"
+        )
+        realm_sql = permission_sql.format(
+            permission=Permission._meta.db_table,
+            joins='JOIN {table} rp ON rp.{perm_column} = p.{pk}'.format(
+                table=realm_permissions.m2m_db_table(),
+                perm_column=realm_permissions.m2m_reverse_name(),
+                pk=Permission._meta.pk.column,
+            ),
+            realm_column='rp.{}'.format(realm_permissions.m2m_column_name()),
+            realm=Realm._meta.db_table,
+            pk=Realm._meta.pk.column,
+        )
+        group_sql = permission_sql.format(
+            permission=Permission._meta.db_table,
+            joins=(
+                'JOIN {table} gp ON gp.{perm_column} = p.{pk} '
+                'JOIN {groups_table} rg ON rg.{group_column} = gp.{group}'
+            ).format(
+                table=group_permissions.m2m_db_table(),
+                perm_column=group_permissions.m2m_reverse_name(),
+                pk=Permission._meta.pk.column,
+                groups_table=realm_groups.m2m_db_table(),
+                group_column=realm_groups.m2m_reverse_name(),
+                group=group_permissions.m2m_column_name(),
+            ),
+            realm_column='rg.{}'.format(realm_groups.m2m_column_name()),
+            realm=Realm._meta.db_table,
+            pk=Realm._meta.pk.column,
+        )
+        if effective_permissions_enabled():
+            qs = self.select_related('user').annotate(
+                effective_perms=RawSQL(
+                    "ARRAY(SELECT e.permission_type || '.' || e.permission "
+                    "|| '.' || e.target FROM {} e WHERE e.realm_id = {}.{} "
+                    "AND NOT (e.permission_type = %s AND cardinality(e.condition) > 0))".format(
+                        EffectivePermission._meta.db_table,
+                        Realm._meta.db_table,
+                        Realm._meta.pk.column,
+                    ),
+                    (Permission.TYPE_DISALLOW,),
+                ),
+            )
+        else:
+            qs = self.select_related('user').annotate(
+                realm_perms=RawSQL(realm_sql, (Permission.TYPE_DISALLOW,)),
+                group_perms=RawSQL(group_sql, (Permission.TYPE_DISALLOW,)),
+            )
+        qs._iterable_class = RealmPermissionsIterable
+        return qs
+
+    def _get_or_create_realms(self, keys, batch_size):
+        """Return a map of (user, workspace, organization) pks to realm pk
+
+        Create the realms that do not exist yet, checking each is valid.
+        """
+        realms = {}
+        for pk, user_id, workspace_id, organization_id in self.filter(
+                user_id__in={user_id for user_id, _, _ in keys},
+        ).order_by('-pk').values_list('pk', 'user_id', 'workspace_id', 'organization_id'):
+            realms[(user_id, workspace_id, organization_id)] = pk
+
+        new_realms = [
+            self.model(user_id=user_id, workspace_id=workspace_id, organization_id=organization_id)
+            for user_id, workspace_id, organization_id in OrderedDict.fromkeys(keys)
+            if (user_id, workspace_id, organization_id) not in realms
+        ]
+        for realm in new_realms:
+            realm.check_required()
+        for realm in self.bulk_create(new_realms, batch_size=batch_size):
+            realms[(realm.user_id, realm.workspace_id, realm.organization_id)] = realm.pk
+        return realms, len(new_realms)
+
+    def bulk_provision(self, records, batch_size=1000):
+        """Create realms, with their groups and permissions, in batches
+
+        `records` is an iterable of dicts having a `user` and optionally
+        a `workspace`, `organization`, `groups` and `permissions`, given
+        as instances or primary keys. Records are read `batch_size` at a
+        time, so they can be streamed, and each batch is saved with
+        a few bulk inserts in a transaction of its own.
+
+        Existing realms of the same user, workspace and organization
+        are reused and only missing groups and permissions are added,
+        so provisioning the same records again creates nothing.
+
+        Return the number of realms, realm groups and realm permissions
+        created.
+        """
+        created = OrderedDict([
+            ('realms', 0),
+            ('realm groups', 0),
+            ('realm permissions', 0),
+        ])
+        for chunk in chunked(records, batch_size):
+            keys = [
+                (_pk(record['user']), _pk(record.get('workspace')), _pk(record.get('organization')))
+                for record in chunk
+            ]
+            with transaction.atomic():
+                realms, count = self._get_or_create_realms(keys, batch_size)
+                created['realms'] += count
+                groups = set()
+                permissions = set()
+                for key, record in zip(keys, chunk):
+                    groups.update((realms[key], _pk(group)) for group in record.get('groups') or ())
+                    permissions.update((realms[key], _pk(perm)) for perm in record.get('permissions') or ())
+                linked_groups = bulk_link(
+                    self.model.groups.through,
+                    'realm_id',
+                    'group_id',
+                    groups,
+                    batch_size,
+                )
+                linked_permissions = bulk_link(
+                    self.model.permissions.through,
+                    'realm_id',
+                    'permission_id',
+                    permissions,
+                    batch_size,
+                )
+                if linked_groups or linked_permissions:
+                    # through rows created in bulk don't send m2m_changed
+                    linked_realms = {realm_pk for realm_pk, _ in groups | permissions}
+                    for realm_pk in linked_realms:
+                        cache.bump_version(realm_pk)
+                    if effective_permissions_enabled():
+                        EffectivePermission.objects.refresh(linked_realms)
+            created['realm groups'] += linked_groups
+            created['realm permissions'] += linked_permissions
+        return created
+
+
 class Realm(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -264,17 +620,23 @@ class Realm(models.Model):
         related_query_name="realm",
     )
 
+    objects = RealmQuerySet.as_manager()
+
     def __str__(self):
         return " ".join([
             str(x) for x in [self.user, self.workspace, self.organization]
             if x is not None
         ])
 
-    def save(self, *args, **kwargs):
-        if settings.AUTH_REQUIRES_WORKSPACE and not self.workspace:
+    def check_required(self):
+        """Raise IntegrityError if a required workspace or organization is missing"""
+        if settings.AUTH_REQUIRES_WORKSPACE and not self.workspace_id:
             raise IntegrityError(_('Workspace value is required'))
-        if settings.AUTH_REQUIRES_ORGANIZATION and not self.organization:
+        if settings.AUTH_REQUIRES_ORGANIZATION and not self.organization_id:
             raise IntegrityError(_('Organization value is required'))
+
+    def save(self, *args, **kwargs):
+        self.check_required()
         return super(Realm, self).save(*args, **kwargs)
 
     def get_group_permissions(self, obj=None):
@@ -309,18 +671,90 @@ class Realm(models.Model):
             return True
 
         # Otherwise we need to check the backends.
+        # Prefer backends that accept the realm itself, so the permissions
+        # already loaded on this instance are reused between calls.
         for backend in get_backends():
-            if not hasattr(backend, 'has_perm'):
-                continue
             try:
-                if backend.has_perm(self.user, perm, obj):
-                    return True
+                if hasattr(backend, 'has_realm_perm'):
+                    if backend.has_realm_perm(self, perm, obj):
+                        return True
+                elif hasattr(backend, 'has_perm'):
+                    if backend.has_perm(self.user, perm, obj):
+                        return True
             # A backend can raise `PermissionDenied` to short-circuit
             # permission checking.
             except PermissionDenied:
                 return False
         return False
 
+    def has_perm_bulk(self, perm, objs):
+        """
+        Return a list of whether the realm has the specified permission
+        for each of `objs`. Backends providing `has_realm_perm_bulk`
+        check all objects at once, for others each object is checked
+        with `has_perm`.
+        """
+        objs = list(objs)
+
+        # Active superusers have all permissions.
+        if self.user.is_active and self.user.is_superuser:
+            return [True] * len(objs)
+
+        allowed = [False] * len(objs)
+        for backend in get_backends():
+            try:
+                if hasattr(backend, 'has_realm_perm_bulk'):
+                    allowed = [
+                        a or b for a, b in zip(allowed, backend.has_realm_perm_bulk(self, perm, objs))
+                    ]
+                elif hasattr(backend, 'has_perm'):
+                    allowed = [
+                        a or backend.has_perm(self.user, perm, obj)
+                        for a, obj in zip(allowed, objs)
+                    ]
+            # A backend can raise `PermissionDenied` to short-circuit
+            # permission checking.
+            except PermissionDenied:
+                break
+        return allowed
+
+    def filter_allowed_targets(self, targets, kind, obj=None):
+        """
+        Return the list of `targets` the realm has `kind` permission to.
+        Backends providing `filter_allowed_targets` evaluate all targets
+        at once, for others each target is checked with `has_perm`.
+        """
+        targets = list(targets)
+
+        # Active superusers have all permissions.
+        if self.user.is_active and self.user.is_superuser:
+            return targets
+
+        allowed = set()
+        for backend in get_backends():
+            try:
+                if hasattr(backend, 'filter_allowed_targets'):
+                    allowed.update(backend.filter_allowed_targets(
+                        self,
+                        [t for t in targets if t not in allowed],
+                        kind,
+                        obj,
+                    ))
+                elif hasattr(backend, 'has_perm'):
+                    allowed.update(
+                        t for t in targets if t not in allowed
+                        and backend.has_perm(
+                            self.user,
+                            '{}.{}'.format(kind, t),
+                            obj,
+                        )
+                    )
+            # A backend can raise `PermissionDenied` to short-circuit
+            # permission checking.
+            except PermissionDenied:
+                break
+        return [t for t in targets if t in allowed]
+
     def has_perms(self, perm_list, obj=None, field_limited=False):
         """
         Return True if the realm has each of the specified permissions. If
@@ -335,3 +769,126 @@ class Realm(models.Model):
             return any(self.has_perm(perm, obj) for perm in perm_list)
         else:
             return all(self.has_perm(perm, obj) for perm in perm_list)
+
+
+def effective_permissions_enabled():
+    return getattr(settings, 'AUTH_PERMISSION_EFFECTIVE_TABLE', False)
+
+
+class EffectivePermissionQuerySet(models.QuerySet):
+    def refresh(self, realm_ids=None):
+        """Recompute the effective permissions of `realm_ids`
+
+        If `realm_ids` is None, then the whole table is rebuilt.
+        Rows are computed by a single INSERT ... SELECT, so nothing
+        is loaded in python.
+
+        The realms are locked while they are refreshed, so concurrent
+        refreshes of the same realm run one after the other, and rows
+        already inserted by another refresh are skipped.
+        """
+        if realm_ids is not None:
+            realm_ids = list(realm_ids)
+            if not realm_ids:
+                return
+        realm_permissions = Realm._meta.get_field('permissions')
+        realm_groups = Realm._meta.get_field('groups')
+        group_permissions = Group._meta.get_field('permissions')
+
+        params = []
+        realm_filter = ''
+        if realm_ids is not None:
+            realm_filter = 'WHERE {} = ANY(%s)'
+            params = [realm_ids, realm_ids]
+
+        sql = """
+            INSERT INTO {table} (realm_id, source_id, permission, permission_type, target, condition)
+            SELECT s.realm_id, p.{permission_pk}, p.permission, p.permission_type, p.target, p.condition
+            FROM (
+                SELECT rp.{rp_realm} AS realm_id, rp.{rp_permission} AS permission_id
+                FROM {rp_table} rp {rp_filter}
+                UNION
+                SELECT rg.{rg_realm}, gp.{gp_permission}
+                FROM {rg_table} rg JOIN {gp_table} gp ON gp.{gp_group} = rg.{rg_group}
+                {rg_filter}
+            ) s JOIN {permission_table} p ON p.{permission_pk} = s.permission_id
+            ON CONFLICT (realm_id, source_id) DO NOTHING
+        """.format(
+            table=self.model._meta.db_table,
+            permission_table=Permission._meta.db_table,
+            permission_pk=Permission._meta.pk.column,
+            rp_table=realm_permissions.m2m_db_table(),
+            rp_realm=realm_permissions.m2m_column_name(),
+            rp_permission=realm_permissions.m2m_reverse_name(),
+            rp_filter=realm_filter.format(
+                'rp.{}'.format(realm_permissions.m2m_column_name()),
+            ),
+            rg_table=realm_groups.m2m_db_table(),
+            rg_realm=realm_groups.m2m_column_name(),
+            rg_group=realm_groups.m2m_reverse_name(),
+            rg_filter=realm_filter.format(
+                'rg.{}'.format(realm_groups.m2m_column_name()),
+            ),
+            gp_table=group_permissions.m2m_db_table(),
+            gp_group=group_permissions.m2m_column_name(),
+            gp_permission=group_permissions.m2m_reverse_name(),
+        )
+        with transaction.atomic(using=self.db):
+            if realm_ids is None:
+                self.all().delete()
+            else:
+                # in a consistent order, so concurrent refreshes can't deadlock
+                list(Realm.objects.using(self.db).filter(
+                    pk__in=realm_ids,
+                ).order_by('pk').select_for_update().values_list('pk', flat=True))
+                self.filter(realm_id__in=realm_ids).delete()
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql, params)
+
+
+class EffectivePermission(models.Model):
+    """Flattened permissions of a realm, from the realm and its groups
+
+    Enable with `AUTH_PERMISSION_EFFECTIVE_TABLE`, the table is then
+    maintained from signals, so the permissions of a realm can be read
+    with a single indexed lookup. Rebuild the table with the
+    `rebuild_effective_permissions` management command.
+    """
+    realm = models.ForeignKey(
+        Realm,
+        on_delete=models.CASCADE,
+        related_name='effective_permissions',
+    )
+    # the permission the row is copied from
+    source = models.ForeignKey(
+        Permission,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    permission = models.CharField(
+        max_length=10,
+        choices=Permission.PERMISSION_CHOICES,
+    )
+    permission_type = models.CharField(
+        max_length=10,
+        choices=Permission.TYPE_CHOICES,
+    )
+    target = models.CharField(max_length=100)
+    condition = ArrayField(
+        models.CharField(max_length=100),
+        default=[],
+        blank=True,
+    )
+
+    objects = EffectivePermissionQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('realm', 'source')
+
+    def __str__(self):
+        return '{}: {}.{}.{}'.format(
+            self.realm_id,
+            self.permission_type,
+            self.permission,
+            self.target,
+        )
@@ -1,7 +1,58 @@
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
 from rest_framework import exceptions, serializers
 from rest_framework.permissions import BasePermission
 
+from etools_permissions import instrumentation
 from etools_permissions.models import Permission
+from etools_permissions.targets import DEFAULT_CACHE_SIZE
+
+
+class SerializerTargets(object):
+    """Bounded memo of the targets collected per serializer class and method
+
+    Serializers can be built dynamically, so the least recently used
+    entries are dropped once it holds `AUTH_PERMISSION_TARGET_CACHE_SIZE`.
+    """
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = getattr(
+                settings,
+                'AUTH_PERMISSION_TARGET_CACHE_SIZE',
+                DEFAULT_CACHE_SIZE,
+            )
+        self.maxsize = maxsize
+        self._targets = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        return key in self._targets
+
+    def __iter__(self):
+        return iter(list(self._targets))
+
+    def __len__(self):
+        return len(self._targets)
+
+    def get(self, key, collect):
+        """Return the targets of `key`, calling `collect` if not memoized"""
+        with self._lock:
+            if key in self._targets:
+                self._targets.move_to_end(key)
+                return self._targets[key]
+        value = collect()
+        with self._lock:
+            self._targets[key] = value
+            while len(self._targets) > self.maxsize:
+                self._targets.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._targets.clear()
 
 
 class RealmPermission(BasePermission):
@@ -20,6 +71,9 @@ class RealmPermission(BasePermission):
         )],
     }
 
+    # targets collected per permission class, serializer class and method
+    _serializer_targets = SerializerTargets()
+
     def _queryset(self, view):
         assert hasattr(view, 'get_queryset') \
             or getattr(view, 'queryset', None) is not None, (
@@ -88,16 +142,31 @@ class RealmPermission(BasePermission):
 
         Collect permissions targets based on serializer's model and
         field name from full serializers tree.
+
+        The serializer tree is static, so targets are only collected
+        once per serializer class and method.
         """
-        serializer = serializer_cls()
-        targets = self.get_target_fields(method, serializer)
+        def collect():
+            serializer = serializer_cls()
+            targets = self.get_target_fields(method, serializer)
+
+            field_limited = getattr(
+                serializer,
+                "_limit_fields_by_permission",
+                False
+            )
+            return tuple(targets), bool(field_limited)
 
-        field_limited = getattr(
-            serializer,
-            "_limit_fields_by_permission",
-            False
+        targets, field_limited = self._serializer_targets.get(
+            (type(self), serializer_cls, method),
+            collect,
         )
-        return targets, field_limited
+        return list(targets), field_limited
+
+    def preload_serializer(self, serializer_cls, methods=None):
+        """Collect targets of `serializer_cls` ahead of the first request"""
+        for method in methods or self.perms_map.keys():
+            self._permissions_by_serializer(method, serializer_cls)
 
     def get_required_permissions(self, request, view):
         """
@@ -120,6 +189,7 @@ class RealmPermission(BasePermission):
 
         return self._permissions_by_queryset(request.method, view)
 
+    @instrumentation.instrument('has_permission')
     def has_permission(self, request, view):
         if getattr(view, '_ignore_permissions', False):
             return True
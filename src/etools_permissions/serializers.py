@@ -1,26 +1,53 @@
+from django.utils.functional import cached_property
+
+from etools_permissions import instrumentation
 from etools_permissions.models import Permission
 
 
 class RealmSerializerMixin:
     """Limit fields shown based on which fields user is allowed to view/edit"""
+    @instrumentation.instrument('serializer_fields')
     def _limit_fields_by_permission(self, fields, permission_type):
-        valid_fields = list()
-        for field in fields:
-            field_target = "{}.{}".format(
-                permission_type,
-                Permission.get_target(self.Meta.model, field)
-            )
-            if hasattr(self.context["request"], "realm"):
-                if self.context["request"].realm.has_perm(field_target):
-                    valid_fields.append(field)
-        return valid_fields
+        realm = getattr(self.context["request"], "realm", None)
+        if not realm:
+            return []
+
+        field_targets = [
+            (field, Permission.get_target(self.Meta.model, field))
+            for field in fields
+        ]
+        allowed = set(realm.filter_allowed_targets(
+            [target for field, target in field_targets],
+            permission_type,
+        ))
+        return [field for field, target in field_targets if target in allowed]
+
+    @cached_property
+    def _permitted_fields(self):
+        """Limited fields per permission type
+
+        DRF may ask for the fields several times while serializing,
+        and a nested serializer instance is reused for every row,
+        so limit the fields only once per serializer instance.
+        """
+        return {}
 
     @property
     def _writable_fields(self):
-        fields = super()._writable_fields
-        return self._limit_fields_by_permission(fields, Permission.EDIT)
+        permitted = self._permitted_fields
+        if Permission.EDIT not in permitted:
+            permitted[Permission.EDIT] = self._limit_fields_by_permission(
+                super()._writable_fields,
+                Permission.EDIT,
+            )
+        return permitted[Permission.EDIT]
 
     @property
     def _readable_fields(self):
-        fields = super()._readable_fields
-        return self._limit_fields_by_permission(fields, Permission.VIEW)
+        permitted = self._permitted_fields
+        if Permission.VIEW not in permitted:
+            permitted[Permission.VIEW] = self._limit_fields_by_permission(
+                super()._readable_fields,
+                Permission.VIEW,
+            )
+        return permitted[Permission.VIEW]
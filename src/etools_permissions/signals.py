@@ -1,7 +1,101 @@
-from etools_permissions.models import Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from etools_permissions import cache
+from etools_permissions.models import effective_permissions_enabled, EffectivePermission, Group, Permission, Realm
 
 
 def prepare_permission_choices(models):
     for model in models:
         if isinstance(model, Permission):
             model._meta.get_field('user_type').choices = model.USER_TYPES
+
+
+@receiver(m2m_changed, sender=Realm.permissions.through)
+@receiver(m2m_changed, sender=Realm.groups.through)
+def invalidate_realm_permissions(sender, instance, action, reverse, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse:
+        # changed from the permission or group side,
+        # so any number of realms may be affected
+        cache.bump_version()
+    else:
+        cache.bump_version(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        cache.bump_version()
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_delete, sender=Group)
+def invalidate_permissions(sender, **kwargs):
+    cache.bump_version()
+
+
+@receiver(m2m_changed, sender=Realm.permissions.through)
+@receiver(m2m_changed, sender=Realm.groups.through)
+def update_realm_effective_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not effective_permissions_enabled():
+        return
+    if not reverse:
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            EffectivePermission.objects.refresh([instance.pk])
+    elif action == 'pre_clear':
+        instance._effective_realms = list(
+            instance.realm_set.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        EffectivePermission.objects.refresh(instance._effective_realms)
+    elif action in ['post_add', 'post_remove']:
+        EffectivePermission.objects.refresh(pk_set)
+
+
+def _group_realms(groups):
+    return list(Realm.objects.filter(
+        groups__in=groups,
+    ).values_list('pk', flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def update_group_effective_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not effective_permissions_enabled():
+        return
+    if not reverse:
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            EffectivePermission.objects.refresh(_group_realms([instance.pk]))
+    elif action == 'pre_clear':
+        instance._effective_realms = _group_realms(instance.group_set.all())
+    elif action == 'post_clear':
+        EffectivePermission.objects.refresh(instance._effective_realms)
+    elif action in ['post_add', 'post_remove']:
+        EffectivePermission.objects.refresh(_group_realms(pk_set))
+
+
+@receiver(post_save, sender=Permission)
+def update_effective_permission(sender, instance, created, **kwargs):
+    if effective_permissions_enabled() and not created:
+        EffectivePermission.objects.filter(source=instance).update(
+            permission=instance.permission,
+            permission_type=instance.permission_type,
+            target=instance.target,
+            condition=instance.condition,
+        )
+
+
+@receiver(pre_delete, sender=Group)
+def collect_group_realms(sender, instance, **kwargs):
+    if effective_permissions_enabled():
+        instance._effective_realms = _group_realms([instance.pk])
+
+
+@receiver(post_delete, sender=Group)
+def update_group_realms_effective_permissions(sender, instance, **kwargs):
+    if effective_permissions_enabled():
+        EffectivePermission.objects.refresh(
+            getattr(instance, '_effective_realms', []),
+        )
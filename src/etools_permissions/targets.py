@@ -0,0 +1,140 @@
+import sys
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+
+from etools_permissions.utils import inheritance
+
+DEFAULT_CACHE_SIZE = 4096
+WILDCARD = '*'
+
+
+def wildcard_prefix(target):
+    """Return the prefix covered by wildcard `target`
+
+    `app.model.*` covers the `app.model` prefix, `app.*` the `app`
+    prefix and `*` covers everything, so has an empty prefix.
+    """
+    return target[:-1].rstrip('.')
+
+
+def wildcard_targets(target):
+    """Return the wildcard targets covering `target`, most specific first
+
+    `app.model.field` is covered by `app.model.*`, `app.*` and `*`.
+    """
+    segments = target.split('.')[:-1]
+    return [
+        '.'.join(segments[:end] + [WILDCARD])
+        for end in range(len(segments), -1, -1)
+    ]
+
+
+def target_scope(target):
+    """Return 0 for targets of a model, 1 for `app.*` and 2 for `*`
+
+    Permissions of a wider scope are less specific than any permission
+    of a model, including those inherited from parent models.
+    """
+    if target == WILDCARD:
+        return 2
+    return 0 if target.count('.') > 1 else 1
+
+
+class _Node(object):
+    __slots__ = ('children', 'beneath')
+
+    def __init__(self):
+        self.children = {}
+        self.beneath = set()
+
+
+class TargetTrie(object):
+    """Targets keyed segment by segment, `app` -> `model` -> `field`
+
+    Answer which of the targets a wildcard covers in time proportional
+    to the number of segments, rather than comparing every target with
+    every wildcard.
+    """
+    def __init__(self, targets=()):
+        self._root = _Node()
+        for target in targets:
+            self.add(target)
+
+    def add(self, target):
+        if target[-1] == WILDCARD:
+            # wildcards are covered by themselves and wider wildcards
+            prefix = wildcard_prefix(target)
+            segments = prefix.split('.') if prefix else []
+        else:
+            segments = target.split('.')[:-1]
+        node = self._root
+        node.beneath.add(target)
+        for segment in segments:
+            node = node.children.setdefault(segment, _Node())
+            node.beneath.add(target)
+
+    def covered(self, wildcard):
+        """Return the set of targets covered by `wildcard`
+
+        The set is shared with the trie, so must not be modified.
+        """
+        node = self._root
+        prefix = wildcard_prefix(wildcard)
+        for segment in prefix.split('.') if prefix else []:
+            node = node.children.get(segment)
+            if node is None:
+                return set()
+        return node.beneath
+
+
+class TargetRegistry(object):
+    """Bounded caches mapping between models/fields and targets
+
+    Targets are built and parsed for every field on every request,
+    so both directions are cached, and built targets are interned.
+    The size of each cache is set by `AUTH_PERMISSION_TARGET_CACHE_SIZE`.
+    """
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = getattr(
+                settings,
+                'AUTH_PERMISSION_TARGET_CACHE_SIZE',
+                DEFAULT_CACHE_SIZE,
+            )
+        self._get_target = lru_cache(maxsize=maxsize)(self._build_target)
+        self._parse_target = lru_cache(maxsize=maxsize)(self._split_target)
+
+    @staticmethod
+    def _build_target(model, field_name):
+        return sys.intern(
+            '{}.{}'.format(inheritance.get_prefix(model), field_name)
+        )
+
+    @staticmethod
+    def _split_target(target):
+        if target == WILDCARD or target.count('.') == 1 and target[-1] == WILDCARD:
+            # `*` and `app.*` are not targets of a model
+            return None, WILDCARD
+        app_label, model_name, field = target.split('.')
+        model = apps.get_model(app_label, model_name)
+        return model, field
+
+    def get_target(self, model, field_name):
+        """Return the `app_label.model_name.field` target"""
+        return self._get_target(model, field_name)
+
+    def parse_target(self, target):
+        """Return the `(model, field)` of `target`
+
+        The model is None for the `app.*` and `*` wildcards.
+        """
+        return self._parse_target(target)
+
+    def clear(self):
+        self._get_target.cache_clear()
+        self._parse_target.cache_clear()
+
+
+target_registry = TargetRegistry()
@@ -1,9 +1,36 @@
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models import OneToOneField
 from django.utils.crypto import constant_time_compare
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # pragma: no cover
+    sync_to_async = None
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # pragma: no cover
+    from asyncio import coroutines, iscoroutinefunction  # noqa
+
+    def markcoroutinefunction(func):
+        """Mark `func` as a coroutine function, for asgiref before 3.6"""
+        func._is_coroutine = getattr(coroutines, '_is_coroutine', None)
+        return func
+
+try:
+    # follows the request across sync_to_async
+    from asgiref.local import Local
+except ImportError:  # pragma: no cover
+    from threading import local as Local
+
 SESSION_KEY = '_auth_realm_id'
 HASH_SESSION_KEY = '_auth_realm_hash'
 
+_scope = Local()
+
 
 def _get_realm_session_key(request):
     from etools_permissions.models import Realm
@@ -13,33 +40,121 @@ def _get_realm_session_key(request):
     return Realm._meta.pk.to_python(request.session[SESSION_KEY])
 
 
+def get_current_workspace():
+    """
+    Return the workspace in use, which is the tenant set on the database
+    connection if it is a workspace, otherwise None
+    """
+    from django.apps import apps
+    from django.conf import settings
+    from django.db import connection
+
+    tenant = getattr(connection, 'tenant', None)
+    if isinstance(tenant, apps.get_model(settings.WORKSPACE_MODEL)):
+        return tenant
+    return None
+
+
+def start_realm_scope():
+    """Start caching the realms looked up by `get_user_realm`
+
+    `RealmAuthMiddleware` starts a scope for each request, so the
+    realm of a user is looked up once per request.
+    """
+    _scope.realms = {}
+
+
+def end_realm_scope():
+    _scope.realms = None
+
+
+@contextmanager
+def realm_scope():
+    """Cache the realms looked up by `get_user_realm` within the block"""
+    start_realm_scope()
+    try:
+        yield
+    finally:
+        end_realm_scope()
+
+
+def get_user_realm(user, workspace=None, organization=None):
+    """
+    Return the realm of `user` in `workspace` and `organization`, None
+    if there is none, or if there is more than one. Workspace and
+    organization are only filtered on if provided.
+
+    Realms are loaded with their permissions. Within a realm scope,
+    such as a request, they are cached keyed on user, workspace and
+    organization, so the realm of a user is looked up once however
+    many times permissions are checked.
+    """
+    from etools_permissions.models import Realm
+
+    if user is None or user.pk is None:
+        return None
+
+    key = (
+        user.pk,
+        getattr(workspace, 'pk', workspace),
+        getattr(organization, 'pk', organization),
+    )
+    realms = getattr(_scope, 'realms', None)
+    if realms is not None and key in realms:
+        return realms[key]
+
+    filters = {'user__pk': user.pk}
+    if workspace is not None:
+        filters['workspace'] = workspace
+    if organization is not None:
+        filters['organization'] = organization
+    try:
+        realm = Realm.objects.with_permissions().get(**filters)
+    except (Realm.DoesNotExist, Realm.MultipleObjectsReturned):
+        realm = None
+
+    if realms is not None:
+        realms[key] = realm
+    return realm
+
+
 def get_realm(request):
     """
     Currently not setting realm in session, so using user to get realm
     Expect tenant attribute to be set on request in Workspace in use,
     if user not set or user is superuser, then no tenant
-    """
-    from etools_permissions.models import Realm
 
+    The realm permissions are loaded in the same query.
+    """
     realm = None
     if request.user is not None and not request.user.is_superuser:
-        if hasattr(request, "tenant"):
-            try:
-                realm = Realm.objects.get(
-                    user__pk=request.user.pk,
-                    workspace=request.tenant,
-                )
-            except Realm.DoesNotExist:
-                pass
-        else:
-            try:
-                realm = Realm.objects.get(user__pk=request.user.pk)
-            except Realm.DoesNotExist:
-                pass
-
+        realm = get_user_realm(
+            request.user,
+            workspace=getattr(request, 'tenant', None),
+        )
     return realm
 
 
+def run_in_thread(func):
+    """
+    Wrap blocking `func` so it can be awaited, the call runs in the
+    thread used for the database connection of the current request.
+    """
+    if sync_to_async is None:  # pragma: no cover
+        raise ImproperlyConfigured(
+            'Async permission checks require the asgiref package'
+        )
+    return sync_to_async(func)
+
+
+async def aget_realm(request):
+    """
+    Async version of `get_realm`, the realm and its permissions are
+    loaded with a single query so this costs one thread hop.
+    """
+    return await run_in_thread(get_realm)(request)
+
+
 def set_realm(request, realm):
     """
     Persist a realm id in the request. This way a realm doesn't
@@ -72,6 +187,34 @@ def set_realm(request, realm):
         request.realm = realm
 
 
+def chunked(iterable, size):
+    """Yield lists of up to `size` items of `iterable`"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_link(through, from_field, to_field, pairs, batch_size):
+    """Create the `through` rows for `pairs` that do not exist yet
+
+    Return the number of rows created.
+    """
+    if not pairs:
+        return 0
+    existing = set(through.objects.filter(**{
+        '{}__in'.format(from_field): {from_id for from_id, _ in pairs},
+    }).values_list(from_field, to_field))
+    missing = sorted(set(pairs) - existing)
+    through.objects.bulk_create([
+        through(**{from_field: from_id, to_field: to_id})
+        for from_id, to_id in missing
+    ], batch_size=batch_size)
+    return len(missing)
+
+
 def collect_parent_models(model, levels=None):
     """Recursively collect a list of parent models."""
     result = []
@@ -119,3 +262,106 @@ def collect_child_models(model, levels=None):
             result.extend(collect_child_models(rel.field.model, levels))
 
     return result
+
+
+class InheritanceRegistry(object):
+    """Parents, children and target prefixes of every model
+
+    Introspecting model metadata is comparatively slow, and the app
+    registry does not change at runtime, so the inheritance of all
+    models is collected once and reused for the life of the process.
+    """
+    def __init__(self):
+        self._parents = None
+        self._children = None
+        self._prefixes = None
+        self._table = None
+
+    @property
+    def ready(self):
+        return self._parents is not None
+
+    def clear(self):
+        self._parents = None
+        self._children = None
+        self._prefixes = None
+        self._table = None
+
+    def build(self):
+        from django.apps import apps
+
+        parents = {}
+        children = {}
+        prefixes = {}
+        for model in apps.get_models():
+            parents[model] = tuple(collect_parent_models(model, levels=1))
+            children[model] = tuple(collect_child_models(model, levels=1))
+            prefixes[model] = '{}.{}'.format(
+                model._meta.app_label,
+                model._meta.model_name,
+            )
+
+        table = []
+        for model, model_children in children.items():
+            queue = [(child, 1) for child in model_children]
+            while queue:
+                child, level = queue.pop(0)
+                table.append((prefixes[model], prefixes[child], level))
+                queue.extend(
+                    (grandchild, level + 1)
+                    for grandchild in children.get(child, ())
+                )
+
+        self._parents = parents
+        self._children = children
+        self._prefixes = prefixes
+        self._table = table
+
+    def _lookup(self, mapping_name, model, collect):
+        if not self.ready:
+            self.build()
+        mapping = getattr(self, mapping_name)
+        if model not in mapping:
+            # not known to the app registry when it was built
+            mapping[model] = collect(model)
+        return mapping[model]
+
+    def get_parents(self, model):
+        """Return all parent models of `model`"""
+        return self._lookup(
+            '_parents',
+            model,
+            lambda m: tuple(collect_parent_models(m, levels=1)),
+        )
+
+    def get_children(self, model):
+        """Return direct child models of `model`"""
+        return self._lookup(
+            '_children',
+            model,
+            lambda m: tuple(collect_child_models(m, levels=1)),
+        )
+
+    def get_prefix(self, model):
+        """Return the `app_label.model_name` target prefix of `model`"""
+        return self._lookup(
+            '_prefixes',
+            model,
+            lambda m: '{}.{}'.format(m._meta.app_label, m._meta.model_name),
+        )
+
+    def get_table(self):
+        """List of `(parent, child, level)` target prefixes for every
+        model inheriting from another model, where `level` is the depth
+        of the child below the parent.
+        """
+        if not self.ready:
+            self.build()
+        return self._table
+
+
+inheritance = InheritanceRegistry()
+
+
+def get_inheritance_table():
+    return inheritance.get_table()
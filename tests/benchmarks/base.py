@@ -0,0 +1,98 @@
+"""Helpers for running benchmarks against the demo project
+
+Benchmarks are standalone scripts rather than tests, they create a
+throw-away test database using the demo project settings.
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+def setup():
+    for path in [
+            ROOT,
+            os.path.join(ROOT, 'tests', 'demoproject'),
+            os.path.join(ROOT, 'src'),
+    ]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'demo.settings')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(verbosity=0):
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    # keep clear of the database reused by the test suite
+    connection.settings_dict['TEST']['NAME'] = 'benchmark_{}'.format(old_name)
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def synthetic_targets(count, models=500, fields=20):
+    """Yield `count` targets spread over synthetic apps and models"""
+    for i in range(count):
+        model = i % models
+        yield 'app{}.model{}.{}'.format(
+            model % 50,
+            model,
+            'field{}'.format(i % fields) if i % fields else '*',
+        )
+
+
+def model_targets(count, fields=20):
+    """Yield `count` targets on the installed models, with synthetic
+    field names, so they can be parsed back to a model.
+    """
+    from django.apps import apps
+
+    models = [
+        '{}.{}'.format(model._meta.app_label, model._meta.model_name)
+        for model in apps.get_models()
+    ]
+    for i in range(count):
+        yield '{}.{}'.format(
+            models[i % len(models)],
+            'field{}'.format(i % fields) if i % fields else '*',
+        )
+
+
+def create_permissions(count, conditions=50, batch_size=5000, targets=None):
+    """Create `count` synthetic permissions, with a mix of permission
+    kinds, types and conditions.
+
+    Targets are taken from `targets`, `synthetic_targets` by default.
+    """
+    from etools_permissions.models import Permission
+
+    kinds = [Permission.VIEW, Permission.EDIT, Permission.ACTION]
+    permissions = [
+        Permission(
+            permission=kinds[i % len(kinds)],
+            permission_type=(
+                Permission.TYPE_DISALLOW if i % 7 == 0
+                else Permission.TYPE_ALLOW
+            ),
+            target=target,
+            condition=[
+                'condition{}'.format(c % conditions)
+                for c in range(i, i + i % 3)
+            ],
+        )
+        for i, target in enumerate((targets or synthetic_targets)(count))
+    ]
+    return Permission.objects.bulk_create(permissions, batch_size=batch_size)
@@ -0,0 +1,68 @@
+"""Show query plans of the permission lookups on a large permission table
+
+    $ python tests/benchmarks/query_plans.py --rows 100000
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tests.benchmarks import base  # noqa isort:skip
+
+
+def explain(connection, queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    base.setup()
+
+    from etools_permissions.models import Permission
+
+    with base.test_database() as connection:
+        base.create_permissions(args.rows)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE {}'.format(Permission._meta.db_table))
+
+        queries = [
+            (
+                'filter_by_context',
+                Permission.objects.filter_by_context(
+                    ['condition1', 'condition2'],
+                ),
+            ),
+            (
+                'filter_by_targets',
+                Permission.objects.filter_by_targets([
+                    'organization.organization.id',
+                    'organization.organization.name',
+                    'sample.childrensbook.name',
+                ]),
+            ),
+            (
+                'filter_by_context + filter_by_targets',
+                Permission.objects.filter_by_context(
+                    ['condition1'],
+                ).filter_by_targets(['organization.organization.name']),
+            ),
+            (
+                'target prefix',
+                Permission.objects.filter(target__startswith='app1.model1.'),
+            ),
+        ]
+        for title, queryset in queries:
+            print('{} ({} rows)'.format(title, args.rows))
+            print(explain(connection, queryset))
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Benchmark permission checks on realms with a growing number of permissions
+
+    $ python tests/benchmarks/run.py --sizes 10 1000 100000
+    $ python tests/benchmarks/run.py --output before.json
+    $ python tests/benchmarks/run.py --compare before.json
+
+Each benchmark reports the time and the number of queries per call.
+With `--compare` the run fails if a benchmark got slower than the
+saved results by more than `--tolerance`, or issues more queries.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tests.benchmarks import base  # noqa isort:skip
+
+TARGETS = [
+    'organization.organization.id',
+    'organization.organization.name',
+    'sample.book.name',
+    'sample.book.field7',
+    'sample.childrensbook.max_age',
+    'sample.stats.field3',
+]
+CONTEXT = ['condition1', 'condition2']
+
+
+def measure(func, repeat, number):
+    """Return the median seconds and the queries per call of `func`"""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    func()  # warm up
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - start) / number)
+    # django-tenant-schemas sets the search path ahead of queries
+    count = len([
+        query for query in queries.captured_queries
+        if not query['sql'].startswith('SET search_path')
+    ])
+    return median(timings), count / float(repeat * number)
+
+
+def create_realm(size):
+    """Create a realm having `size` synthetic permissions"""
+    from django.contrib.auth import get_user_model
+
+    from etools_permissions.models import Permission, Realm
+
+    permissions = base.create_permissions(size, targets=base.model_targets)
+    permissions.extend(Permission.objects.bulk_create([
+        Permission(permission=Permission.VIEW, target='organization.organization.*'),
+        Permission(permission=Permission.EDIT, target='organization.organization.name'),
+    ]))
+    user = get_user_model().objects.create(username='benchmark{}'.format(size))
+    realm = Realm.objects.create(user=user)
+    Realm.permissions.through.objects.bulk_create([
+        Realm.permissions.through(realm_id=realm.pk, permission_id=perm.pk)
+        for perm in permissions
+    ], batch_size=5000)
+    return realm, permissions
+
+
+def get_benchmarks(realm, permissions):
+    """Return (name, callable, calls per repeat) for each benchmark"""
+    from demo.organization.models import Organization
+    from demo.organization.serializers import OrganizationFieldLimitSerializer
+    from demo.organization.views import OrganizationDetailAPIView
+    from rest_framework.test import APIRequestFactory
+
+    from etools_permissions.backends import RealmBackend
+    from etools_permissions.models import Permission, Realm
+    from etools_permissions.permissions import RealmPermission
+
+    backend = RealmBackend()
+    user = realm.user
+    loaded = Realm.objects.with_permissions().get(pk=realm.pk)
+    index = backend.get_permission_index(loaded)
+    perm = 'edit.organization.organization.name'
+
+    Organization.objects.bulk_create(
+        [Organization(name='organization{}'.format(i)) for i in range(50)]
+    )
+    organizations = list(Organization.objects.all()[:50])
+    request = APIRequestFactory().get('/')
+    request.user = user
+    request.realm = loaded
+    view = OrganizationDetailAPIView()
+    permission = RealmPermission()
+
+    def serialize():
+        return OrganizationFieldLimitSerializer(
+            organizations,
+            many=True,
+            context={'request': request},
+        ).data
+
+    return [
+        ('backend.has_perm (cold)', lambda: backend.has_perm(user, perm), 1),
+        ('backend.has_realm_perm (warm)', lambda: backend.has_realm_perm(loaded, perm), 1000),
+        ('backend.perm_valid', lambda: backend.perm_valid(index, perm), 1000),
+        (
+            'Permission.apply_permissions',
+            lambda: Permission.apply_permissions(permissions, TARGETS, Permission.VIEW),
+            1,
+        ),
+        (
+            'PermissionQuerySet.filter_by_targets',
+            lambda: list(Permission.objects.filter_by_targets(TARGETS)),
+            1,
+        ),
+        (
+            'PermissionQuerySet.filter_by_context',
+            lambda: list(Permission.objects.filter_by_context(CONTEXT)),
+            1,
+        ),
+        ('RealmPermission.has_permission', lambda: permission.has_permission(request, view), 100),
+        ('RealmSerializerMixin (50 objects)', serialize, 10),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of `results` against `baseline`"""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]
+        if result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append('{}: {:.1f}us, was {:.1f}us'.format(
+                key,
+                result['seconds'] * 1e6,
+                before['seconds'] * 1e6,
+            ))
+        if result['queries'] > before['queries']:
+            regressions.append('{}: {:g} queries, was {:g}'.format(
+                key,
+                result['queries'],
+                before['queries'],
+            ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', help='only run benchmarks containing this text')
+    parser.add_argument('--output', help='save results as json')
+    parser.add_argument('--compare', help='compare to results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    base.setup()
+
+    from django.db import transaction
+
+    results = {}
+    with base.test_database():
+        print('{:<40} {:>8} {:>12} {:>8}'.format('benchmark', 'perms', 'us/call', 'queries'))
+        for size in args.sizes:
+            with transaction.atomic():
+                realm, permissions = create_realm(size)
+                for name, func, number in get_benchmarks(realm, permissions):
+                    if args.filter and args.filter not in name:
+                        continue
+                    seconds, queries = measure(func, args.repeat, number)
+                    results['{}[{}]'.format(name, size)] = {
+                        'seconds': seconds,
+                        'queries': queries,
+                    }
+                    print('{:<40} {:>8} {:>12.1f} {:>8g}'.format(
+                        name,
+                        size,
+                        seconds * 1e6,
+                        queries,
+                    ))
+                transaction.set_rollback(True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            print('\n'.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,11 @@ urlpatterns = [
         views.OrganizationOpenListAPIView.as_view(),
         name='organization-api-list-open'
     ),
+    url(
+        r'^api/organization/filtered/$',
+        views.OrganizationFilteredListAPIView.as_view(),
+        name='organization-api-list-filtered'
+    ),
     url(
         r'^api/organization/queryset/$',
         views.OrganizationQuerysetAPIView.as_view(),
@@ -7,6 +7,7 @@ from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from etools_permissions.filters import RealmFilterBackend
 from etools_permissions.permissions import RealmPermission
 
 
@@ -25,6 +26,13 @@ class OrganizationOpenListAPIView(OrganizationListAPIView):
     _ignore_permissions = True
 
 
+class OrganizationFilteredListAPIView(OrganizationListAPIView):
+    filter_backends = (RealmFilterBackend, )
+
+    def get_permission_context(self):
+        return ['authenticated']
+
+
 class OrganizationQuerysetAPIView(APIView):
     queryset = Organization.objects.all()
     authentication_classes = (SessionAuthentication, )
@@ -1,10 +1,22 @@
+from unittest import skipIf
+
+from django.core.cache import caches
 from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import override_settings, RequestFactory
+from django.test.utils import CaptureQueriesContext
 
+from demo.sample.models import Book, ChildrensBook
 from tests.base import BaseTestCase
-from tests.factories import GroupFactory, PermissionFactory, RealmFactory, UserFactory
+from tests.factories import ChildrensBookFactory, GroupFactory, PermissionFactory, RealmFactory, UserFactory
 
 from etools_permissions.backends import RealmBackend
-from etools_permissions.models import Permission
+from etools_permissions.conditions import object_conditions, ObjectCondition
+from etools_permissions.models import EffectivePermission, Permission, Realm
+from etools_permissions.utils import get_realm, realm_scope, sync_to_async
+
+if sync_to_async is not None:
+    from asgiref.sync import async_to_sync
 
 
 class TestRealmBackend(BaseTestCase):
@@ -29,6 +41,39 @@ class TestRealmBackend(BaseTestCase):
         realm = RealmFactory(user=user, workspace=self.tenant)
         self.assertEqual(self.backend._get_realm(user), realm)
 
+    def test_get_realm_workspace(self):
+        user = UserFactory()
+        RealmFactory(user=user, workspace=self.tenant_other)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        with realm_scope():
+            self.assertEqual(self.backend._get_realm(user), realm)
+            with self.assertNumQueries(0):
+                self.assertIs(self.backend._get_realm(user), self.backend._get_realm(user))
+
+    def test_get_realm_other_workspace(self):
+        user = UserFactory()
+        RealmFactory(user=user, workspace=self.tenant_other)
+        with self.assertRaises(PermissionDenied):
+            self.backend._get_realm(user)
+
+    def test_get_realm_request_realm(self):
+        user = UserFactory()
+        RealmFactory(user=user, workspace=self.tenant)
+        request = RequestFactory().get("/")
+        request.user = user
+        request.tenant = self.tenant
+        with realm_scope():
+            realm = get_realm(request)
+            with self.assertNumQueries(0):
+                self.assertIs(self.backend._get_realm(user), realm)
+
+    def test_get_realm_not_unique(self):
+        user = UserFactory()
+        RealmFactory(user=user, workspace=self.tenant)
+        RealmFactory(user=user, workspace=self.tenant)
+        with self.assertRaises(PermissionDenied):
+            self.backend._get_realm(user)
+
     def test_internal_get_realm_permissions_empty(self):
         realm = RealmFactory(workspace=self.tenant)
         self.assertEqual(len(self.backend._get_realm_permissions(realm)), 0)
@@ -138,6 +183,13 @@ class TestRealmBackend(BaseTestCase):
         perms = self.backend.get_all_permissions(realm, realm)
         self.assertEqual(len(perms), 0)
 
+    def test_get_all_permissions_obj_not_cached(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertEqual(self.backend.get_all_permissions(realm, realm), set())
+        self.assertEqual(self.backend.get_all_permissions(realm), {self.permission_label})
+        self.assertIn(self.permission_label, self.backend.get_permission_index(realm))
+
     def test_get_all_permissions(self):
         group = GroupFactory()
         group.permissions.add(self.permission)
@@ -148,6 +200,24 @@ class TestRealmBackend(BaseTestCase):
         self.assertEqual(len(perms), 1)
         self.assertIn(self.permission_label, perms)
 
+    def test_get_permission_index(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        index = self.backend.get_permission_index(realm)
+        self.assertIn(self.permission_label, index)
+        with self.assertNumQueries(0):
+            self.assertIs(self.backend.get_permission_index(realm), index)
+
+    def test_perm_valid(self):
+        permissions = {"allow.view.app.model.*"}
+        self.assertTrue(
+            self.backend.perm_valid(permissions, "view.app.model.field")
+        )
+        self.assertFalse(
+            self.backend.perm_valid(permissions, "edit.app.model.field")
+        )
+        self.assertTrue(self.backend.perm_valid(permissions, "app.model.field"))
+
     def test_has_perm_user_not_active(self):
         user = UserFactory(is_active=False)
         RealmFactory(user=user, workspace=self.tenant)
@@ -168,6 +238,109 @@ class TestRealmBackend(BaseTestCase):
         realm.permissions.add(self.permission)
         self.assertTrue(self.backend.has_perm(user, self.permission.target))
 
+    def test_has_perm_disallow(self):
+        user = UserFactory()
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+        ))
+        group = GroupFactory()
+        group.permissions.add(PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_DISALLOW,
+            target="organization.organization.name",
+        ))
+        realm.groups.add(group)
+        self.assertTrue(self.backend.has_perm(
+            user,
+            "edit.organization.organization.id",
+        ))
+        self.assertFalse(self.backend.has_perm(
+            user,
+            "edit.organization.organization.name",
+        ))
+        self.assertTrue(self.backend.has_perm(
+            user,
+            "view.organization.organization.name",
+        ))
+
+    def test_has_perm_conditional_disallow(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+        ))
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_DISALLOW,
+            target="organization.organization.name",
+            condition=["status.draft"],
+        ))
+        # without an object the condition is not known to hold
+        self.assertTrue(self.backend.has_realm_perm(
+            realm,
+            "edit.organization.organization.name",
+        ))
+        self.assertEqual(self.backend.filter_allowed_targets(
+            realm,
+            ["organization.organization.name"],
+            Permission.EDIT,
+        ), ["organization.organization.name"])
+        with override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=True):
+            EffectivePermission.objects.refresh([realm.pk])
+            realm = Realm.objects.get(pk=realm.pk)
+            self.assertTrue(self.backend.has_realm_perm(
+                realm,
+                "edit.organization.organization.name",
+            ))
+
+    def test_has_realm_perm_user_not_active(self):
+        user = UserFactory(is_active=False)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertFalse(
+            self.backend.has_realm_perm(realm, self.permission.target)
+        )
+
+    def test_has_realm_perm(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertTrue(
+            self.backend.has_realm_perm(realm, self.permission.target)
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                self.backend.has_realm_perm(realm, self.permission.target)
+            )
+
+    def test_filter_allowed_targets_user_not_active(self):
+        user = UserFactory(is_active=False)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertEqual(
+            self.backend.filter_allowed_targets(
+                realm,
+                ["etools_permissions.permission.target"],
+                Permission.EDIT,
+            ),
+            [],
+        )
+
+    def test_filter_allowed_targets(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        targets = [
+            "etools_permissions.permission.target",
+            "etools_permissions.group.name",
+        ]
+        self.assertEqual(
+            self.backend.filter_allowed_targets(realm, targets, Permission.EDIT),
+            ["etools_permissions.permission.target"],
+        )
+
     # def test_has_module_perms_user_not_active(self):
     #     user = UserFactory(is_active=False)
     #     realm = RealmFactory(user=user, workspace=self.tenant)
@@ -190,3 +363,275 @@ class TestRealmBackend(BaseTestCase):
     #     realm.permissions.add(self.permission)
     #     perm = self.backend.has_module_perms(realm, self.permission_app_label)
     #     self.assertTrue(perm)
+
+
+class AgeCondition(ObjectCondition):
+    calls = 0
+
+    @classmethod
+    def for_objects(cls, objs):
+        cls.calls += 1
+        return super().for_objects(objs)
+
+    def to_internal_value(self):
+        return "young" if self.obj.max_age < 8 else []
+
+
+class NamedCondition(ObjectCondition):
+    def to_internal_value(self):
+        return "named.{}".format(self.obj.name)
+
+
+class TestRealmBackendObject(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = RealmBackend()
+        self.realm = RealmFactory(user=self.user, workspace=self.tenant)
+        self.young = ChildrensBookFactory(name="young", max_age=5)
+        self.old = ChildrensBookFactory(name="old", max_age=12)
+        for model, condition_class in [(ChildrensBook, AgeCondition), (Book, NamedCondition)]:
+            object_conditions.register(model, condition_class)
+            self.addCleanup(object_conditions.unregister, model, condition_class)
+        AgeCondition.calls = 0
+
+    def _add(self, target, permission_type=Permission.TYPE_ALLOW, permission=Permission.EDIT, condition=None):
+        self.realm.permissions.add(PermissionFactory(
+            permission=permission,
+            permission_type=permission_type,
+            target=target,
+            condition=condition or [],
+        ))
+
+    def test_context(self):
+        self.assertEqual(
+            object_conditions.get_contexts([self.young, self.old, self.young.book_ptr]),
+            [
+                frozenset(["young", "named.young"]),
+                frozenset(["named.old"]),
+                frozenset(["named.young"]),
+            ],
+        )
+
+    def test_has_perm(self):
+        self._add("sample.childrensbook.*", condition=["young"])
+        self.assertTrue(self.backend.has_realm_perm(self.realm, "edit.sample.childrensbook.name", self.young))
+        self.assertFalse(self.backend.has_realm_perm(self.realm, "edit.sample.childrensbook.name", self.old))
+        self.assertTrue(self.backend.has_realm_perm(self.realm, "view.sample.childrensbook.*", self.young))
+        self.assertTrue(self.backend.has_realm_perm(self.realm, "sample.childrensbook.name", self.young))
+        self.assertTrue(self.realm.has_perm("edit.sample.childrensbook.name", self.young))
+
+    def test_has_perm_inactive(self):
+        self._add("sample.childrensbook.*")
+        self.user.is_active = False
+        self.assertFalse(self.backend.has_realm_perm(self.realm, "edit.sample.childrensbook.name", self.young))
+        self.assertEqual(self.backend.has_perm_bulk(self.user, "edit.sample.childrensbook.name", [self.young]), [False])
+
+    def test_has_perm_parent(self):
+        group = GroupFactory()
+        group.permissions.add(PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target="sample.book.*",
+            condition=["named.old"],
+        ))
+        self.realm.groups.add(group)
+        self._add("sample.childrensbook.*", permission_type=Permission.TYPE_DISALLOW, condition=["young"])
+        self.assertEqual(
+            self.realm.has_perm_bulk("edit.sample.childrensbook.name", [self.young, self.old]),
+            [False, True],
+        )
+
+    def test_has_perm_bulk(self):
+        self._add("sample.childrensbook.*", condition=["young"])
+        self._add("sample.childrensbook.name", permission_type=Permission.TYPE_DISALLOW, condition=["named.young"])
+        books = [self.young, self.old] + [ChildrensBookFactory(name="other", max_age=1) for _ in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            allowed = self.backend.has_realm_perm_bulk(self.realm, "edit.sample.childrensbook.name", books)
+        self.assertEqual(allowed, [False, False] + [True] * 10)
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if not q["sql"].startswith("SET search_path")
+        ]), 1)
+        self.assertEqual(AgeCondition.calls, 1)
+        self.assertEqual(
+            self.backend.has_perm_bulk(self.user, "edit.sample.childrensbook.max_age", books[:2]),
+            [True, False],
+        )
+
+    def test_has_perm_bulk_superuser(self):
+        self.user.is_superuser = True
+        self.assertEqual(self.realm.has_perm_bulk("edit.sample.book.name", [self.young]), [True])
+
+    def test_has_perm_action(self):
+        self._add("sample.childrensbook.*", permission=Permission.ACTION, condition=["young"])
+        self.assertTrue(self.realm.has_perm("action.sample.childrensbook.name", self.young))
+        self.assertFalse(self.realm.has_perm("action.sample.childrensbook.name", self.old))
+        self.assertFalse(self.realm.has_perm("edit.sample.childrensbook.name", self.young))
+        self.assertTrue(self.realm.has_perm("action.sample.childrensbook.name"))
+
+    def test_has_perm_invalid_target(self):
+        self._add("sample.childrensbook.*")
+        self.assertFalse(self.realm.has_perm("edit.sample.childrensbook", self.young))
+        self.assertFalse(self.realm.has_perm("edit.sample.unknown.name", self.young))
+        self.assertEqual(
+            self.realm.filter_allowed_targets(
+                ["sample.childrensbook.name", "sample.unknown.name"],
+                Permission.EDIT,
+                self.young,
+            ),
+            ["sample.childrensbook.name"],
+        )
+
+    def test_has_perm_app_wildcards(self):
+        self._add("sample.*", condition=["young"])
+        self.assertEqual(
+            self.backend.has_realm_perm_bulk(self.realm, "edit.sample.childrensbook.name", [self.young, self.old]),
+            [True, False],
+        )
+        self.assertEqual(
+            self.realm.filter_allowed_targets(["sample.childrensbook.name"], Permission.EDIT, self.young),
+            ["sample.childrensbook.name"],
+        )
+        self._add("*")
+        realm = Realm.objects.get(pk=self.realm.pk)
+        self.assertEqual(
+            self.backend.has_realm_perm_bulk(realm, "edit.sample.childrensbook.name", [self.young, self.old]),
+            [True, True],
+        )
+        self._add("sample.book.*", permission_type=Permission.TYPE_DISALLOW, condition=["named.old"])
+        realm = Realm.objects.get(pk=self.realm.pk)
+        self.assertEqual(
+            self.backend.has_realm_perm_bulk(realm, "edit.sample.childrensbook.name", [self.young, self.old]),
+            [True, False],
+        )
+
+    def test_has_perm_effective_table(self):
+        self._add("sample.childrensbook.*", condition=["young"])
+        with override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=True):
+            EffectivePermission.objects.refresh([self.realm.pk])
+            with CaptureQueriesContext(connection) as queries:
+                allowed = self.backend.has_realm_perm_bulk(
+                    self.realm,
+                    "edit.sample.childrensbook.name",
+                    [self.young, self.old],
+                )
+        self.assertEqual(allowed, [True, False])
+        self.assertTrue(any(
+            EffectivePermission._meta.db_table in q["sql"]
+            for q in queries.captured_queries
+        ))
+
+    def test_filter_allowed_targets(self):
+        self._add("sample.childrensbook.*", condition=["young"])
+        self._add(
+            "sample.childrensbook.name",
+            permission_type=Permission.TYPE_DISALLOW,
+            permission=Permission.VIEW,
+            condition=["young"],
+        )
+        targets = ["sample.childrensbook.max_age", "sample.childrensbook.name"]
+        self.assertEqual(
+            self.realm.filter_allowed_targets(targets, Permission.VIEW, self.young),
+            ["sample.childrensbook.max_age"],
+        )
+        self.assertEqual(self.realm.filter_allowed_targets(targets, Permission.VIEW, self.old), [])
+
+
+@skipIf(sync_to_async is None, "asgiref is not installed")
+class TestRealmBackendAsync(BaseTestCase):
+    def setUp(self):
+        self.permission = PermissionFactory(
+            permission_type=Permission.TYPE_ALLOW,
+            permission=Permission.EDIT,
+        )
+        self.permission_label = "{}.{}.{}".format(
+            self.permission.permission_type,
+            self.permission.permission,
+            self.permission.target,
+        )
+        self.backend = RealmBackend()
+
+    def test_aget_realm(self):
+        realm = RealmFactory(workspace=self.tenant)
+        self.assertEqual(
+            async_to_sync(self.backend.aget_realm)(realm.user),
+            realm,
+        )
+
+    def test_aget_realm_exception(self):
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(self.backend.aget_realm)(None)
+
+    def test_aget_all_permissions(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertEqual(
+            async_to_sync(self.backend.aget_all_permissions)(realm),
+            {self.permission_label},
+        )
+
+    def test_aget_all_permissions_obj(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertEqual(
+            async_to_sync(self.backend.aget_all_permissions)(realm, realm),
+            set(),
+        )
+        self.assertEqual(
+            async_to_sync(self.backend.aget_all_permissions)(realm),
+            {self.permission_label},
+        )
+
+    def test_aget_all_permissions_loaded(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        realm = Realm.objects.with_permissions().get(pk=realm.pk)
+        with CaptureQueriesContext(connection) as queries:
+            perms = async_to_sync(self.backend.aget_all_permissions)(realm)
+        self.assertEqual(perms, {self.permission_label})
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(AUTH_PERMISSION_CACHE="default")
+    def test_aget_all_permissions_cached_index(self):
+        caches["default"].clear()
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.backend.get_permission_index(Realm.objects.get(pk=realm.pk))
+        realm = Realm.objects.get(pk=realm.pk)
+        self.backend.get_permission_index(realm)
+        self.assertFalse(hasattr(realm, "_perm_cache"))
+        self.assertEqual(
+            async_to_sync(self.backend.aget_all_permissions)(realm),
+            {self.permission_label},
+        )
+
+    def test_ahas_perm_user_not_active(self):
+        user = UserFactory(is_active=False)
+        RealmFactory(user=user, workspace=self.tenant)
+        self.assertFalse(async_to_sync(self.backend.ahas_perm)(
+            user,
+            self.permission.target,
+        ))
+
+    def test_ahas_perm(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        self.assertTrue(async_to_sync(self.backend.ahas_perm)(
+            realm.user,
+            self.permission.target,
+        ))
+
+    def test_ahas_realm_perm_loaded(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        realm = Realm.objects.with_permissions().get(pk=realm.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(async_to_sync(self.backend.ahas_realm_perm)(
+                realm,
+                self.permission.target,
+            ))
+            self.assertFalse(async_to_sync(self.backend.ahas_realm_perm)(
+                realm,
+                "view.wrong.target",
+            ))
+        self.assertEqual(len(queries), 0)
@@ -0,0 +1,202 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from tests.base import BaseTestCase
+from tests.factories import GroupFactory, PermissionFactory, RealmFactory, UserFactory
+
+from etools_permissions import cache
+from etools_permissions.backends import RealmBackend
+from etools_permissions.models import Permission, Realm
+
+
+class TestPermissionCache(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(AUTH_PERMISSION_CACHE="default")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches["default"].clear()
+        self.backend = RealmBackend()
+        self.permission = PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+        )
+        self.permission_label = "allow.view.organization.organization.*"
+        self.realm = RealmFactory(workspace=self.tenant)
+
+    def _index(self):
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        return self.backend.get_permission_index(realm)
+
+    def test_disabled(self):
+        with self.settings(AUTH_PERMISSION_CACHE=None):
+            self.assertIsNone(cache.get_cache())
+            self.assertIsNone(cache.get_permission_index(self.realm))
+            cache.bump_version()
+
+    def test_bump_version_on_commit(self):
+        version = caches["default"].get(cache.get_version_key(self.realm.pk))
+        with mock.patch.object(transaction, "on_commit") as on_commit:
+            cache.bump_version(self.realm.pk)
+        bumped = caches["default"].get(cache.get_version_key(self.realm.pk))
+        self.assertNotEqual(bumped, version)
+        # bumped again once the transaction is committed
+        on_commit.call_args[0][0]()
+        self.assertNotEqual(caches["default"].get(cache.get_version_key(self.realm.pk)), bumped)
+
+    def test_cached(self):
+        self.realm.permissions.add(self.permission)
+        self.assertIn(self.permission_label, self._index())
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        with self.assertNumQueries(0):
+            index = self.backend.get_permission_index(realm)
+        self.assertIn(self.permission_label, index)
+
+    def test_user_not_active(self):
+        user = UserFactory(is_active=False)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        cache.set_permission_index(realm, "index")
+        self.assertIsNone(cache.get_permission_index(realm))
+
+    def test_realm_permissions_changed(self):
+        self.assertNotIn(self.permission_label, self._index())
+        self.realm.permissions.add(self.permission)
+        self.assertIn(self.permission_label, self._index())
+        self.realm.permissions.remove(self.permission)
+        self.assertNotIn(self.permission_label, self._index())
+
+    def test_realm_permissions_changed_reverse(self):
+        self.assertNotIn(self.permission_label, self._index())
+        self.permission.realm_set.add(self.realm)
+        self.assertIn(self.permission_label, self._index())
+
+    def test_realm_groups_changed(self):
+        group = GroupFactory()
+        group.permissions.add(self.permission)
+        self.assertNotIn(self.permission_label, self._index())
+        self.realm.groups.add(group)
+        self.assertIn(self.permission_label, self._index())
+        self.realm.groups.clear()
+        self.assertNotIn(self.permission_label, self._index())
+
+    def test_group_permissions_changed(self):
+        group = GroupFactory()
+        self.realm.groups.add(group)
+        self.assertNotIn(self.permission_label, self._index())
+        group.permissions.add(self.permission)
+        self.assertIn(self.permission_label, self._index())
+
+    def test_group_deleted(self):
+        group = GroupFactory()
+        group.permissions.add(self.permission)
+        self.realm.groups.add(group)
+        self.assertIn(self.permission_label, self._index())
+        group.delete()
+        self.assertNotIn(self.permission_label, self._index())
+
+    def test_permission_changed(self):
+        self.realm.permissions.add(self.permission)
+        self.assertIn(self.permission_label, self._index())
+        self.permission.permission = Permission.EDIT
+        self.permission.save()
+        self.assertIn(
+            "allow.edit.organization.organization.*",
+            self._index(),
+        )
+        self.permission.delete()
+        self.assertEqual(len(self._index()), 0)
+
+    def test_version_evicted(self):
+        self.realm.permissions.add(self.permission)
+        self.assertIn(self.permission_label, self._index())
+        caches["default"].delete(cache.get_version_key())
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        with CaptureQueriesContext(connection) as queries:
+            index = self.backend.get_permission_index(realm)
+        self.assertTrue(queries.captured_queries)
+        self.assertIn(self.permission_label, index)
+
+    def test_object_permissions(self):
+        self.permission.condition = ["condition1"]
+        self.permission.save()
+        self.realm.permissions.add(self.permission)
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        records = self.backend._get_object_permissions(realm)
+        self.assertEqual([perm.condition for perm in records], [["condition1"]])
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        with self.assertNumQueries(0):
+            self.backend._get_object_permissions(realm)
+        self.realm.permissions.remove(self.permission)
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        self.assertEqual(self.backend._get_object_permissions(realm), [])
+
+
+class TestContextCache(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(AUTH_PERMISSION_CACHE="default")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches["default"].clear()
+        self.permission = PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+            condition=["condition1"],
+        )
+        self.targets = ["organization.organization.name"]
+
+    def _allowed(self, context, realm=None):
+        return Permission.get_allowed_targets(
+            context,
+            self.targets,
+            Permission.VIEW,
+            realm,
+        )
+
+    def test_disabled(self):
+        with self.settings(AUTH_PERMISSION_CACHE=None):
+            self.assertIsNone(
+                cache.get_allowed_targets([], self.targets, Permission.VIEW),
+            )
+            cache.set_allowed_targets([], self.targets, Permission.VIEW, None, [])
+
+    def test_key_normalized(self):
+        default = caches["default"]
+        self.assertEqual(
+            cache.get_context_key(default, ["b", "a", "a"], ["t"], "view"),
+            cache.get_context_key(default, ["a", "b"], ["t"], "view"),
+        )
+        self.assertNotEqual(
+            cache.get_context_key(default, ["a"], ["t"], "view"),
+            cache.get_context_key(default, ["a"], ["t"], "edit"),
+        )
+
+    def test_cached(self):
+        self.assertEqual(self._allowed(["condition1", "condition2"]), self.targets)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self._allowed([["condition2"], "condition1"]),
+                self.targets,
+            )
+
+    def test_permission_changed(self):
+        self.assertEqual(self._allowed(["condition1"]), self.targets)
+        self.permission.permission_type = Permission.TYPE_DISALLOW
+        self.permission.save()
+        self.assertEqual(self._allowed(["condition1"]), [])
+
+    def test_realm_permissions_changed(self):
+        realm = RealmFactory(workspace=self.tenant)
+        other = RealmFactory(workspace=self.tenant)
+        self.assertEqual(self._allowed(["condition1"], realm), [])
+        self.assertEqual(self._allowed(["condition1"], other), [])
+        realm.permissions.add(self.permission)
+        self.assertEqual(self._allowed(["condition1"], realm), self.targets)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._allowed(["condition1"], other), [])
@@ -1,10 +1,22 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth.models import Group as DjangoGroup, Permission as DjangoPermission
-from django.core.management import call_command
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.db.utils import IntegrityError
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from tests.base import BaseTestCase
-from tests.factories import UserFactory
+from tests.factories import GroupFactory, PermissionFactory, RealmFactory, UserFactory
 
-from etools_permissions.models import Group, Permission, Realm
+from etools_permissions.management.commands.migrate_permissions import PermissionMigration
+from etools_permissions.models import EffectivePermission, Group, Permission, Realm
 
 
 class TestMigratePermissions(BaseTestCase):
@@ -87,3 +99,375 @@ class TestMigratePermissions(BaseTestCase):
         realm = realm_qs.first()
         self.assertEqual(realm.permissions.count(), 0)
         self.assertEqual(realm.groups.count(), 1)
+
+    def test_command_existing(self):
+        perm = DjangoPermission.objects.first()
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(perm)
+        user = UserFactory()
+        user.groups.add(group)
+        user.user_permissions.add(perm)
+        realm = RealmFactory(user=user)
+
+        call_command("migrate_permissions")
+        perm_count = Permission.objects.count()
+        call_command("migrate_permissions")
+        self.assertEqual(Permission.objects.count(), perm_count)
+        self.assertEqual(Group.objects.count(), 1)
+        self.assertEqual(Realm.objects.filter(user=user).count(), 1)
+        self.assertEqual(realm.permissions.count(), 1)
+        self.assertEqual(realm.groups.count(), 1)
+        self.assertEqual(Group.objects.first().permissions.count(), 1)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command("migrate_permissions", verbosity=0)
+        return len(queries)
+
+    def test_command_queries(self):
+        perm = DjangoPermission.objects.first()
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(perm)
+        user = UserFactory()
+        user.groups.add(group)
+        user.user_permissions.add(perm)
+        queries = self._count_queries()
+
+        Realm.objects.all().delete()
+        Permission.objects.all().delete()
+        Group.objects.all().delete()
+        for perm in DjangoPermission.objects.all()[:10]:
+            group = DjangoGroup.objects.create(name=perm.codename)
+            group.permissions.add(perm)
+            for _ in range(3):
+                user = UserFactory()
+                user.groups.add(group)
+                user.user_permissions.add(perm)
+        self.assertEqual(self._count_queries(), queries)
+        self.assertEqual(Realm.objects.count(), 31)
+
+    def test_command_progress(self):
+        user = UserFactory()
+        user.user_permissions.add(DjangoPermission.objects.first())
+        out = StringIO()
+        call_command("migrate_permissions", stdout=out)
+        self.assertIn("Created 1 realms", out.getvalue())
+
+    def test_command_workspace_required(self):
+        user = UserFactory()
+        user.user_permissions.add(DjangoPermission.objects.first())
+        with override_settings(AUTH_REQUIRES_WORKSPACE=True):
+            with self.assertRaisesRegex(IntegrityError, "Workspace value"):
+                call_command("migrate_permissions")
+        self.assertFalse(Realm.objects.exists())
+
+    def test_command_effective_permissions(self):
+        user = UserFactory()
+        user.user_permissions.add(DjangoPermission.objects.first())
+        with override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=True):
+            call_command("migrate_permissions", verbosity=0)
+        realm = Realm.objects.get(user=user)
+        self.assertEqual(
+            list(realm.effective_permissions.values_list("source", flat=True)),
+            list(realm.permissions.values_list("pk", flat=True)),
+        )
+
+    def test_command_dry_run(self):
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(DjangoPermission.objects.first())
+        user = UserFactory()
+        user.groups.add(group)
+        out = StringIO()
+        call_command("migrate_permissions", "--dry-run", stdout=out)
+        self.assertIn("Would create 1 realms", out.getvalue())
+        self.assertIn("Would create 1 groups", out.getvalue())
+        self.assertFalse(Permission.objects.exists())
+        self.assertFalse(Group.objects.exists())
+        self.assertFalse(Realm.objects.exists())
+
+    def test_command_dry_run_no_writes(self):
+        perms = DjangoPermission.objects.filter(content_type__app_label="auth", content_type__model="group")
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(*perms)
+        users = [UserFactory() for _ in range(3)]
+        for user in users:
+            user.groups.add(group)
+            user.user_permissions.add(*perms)
+        migration = PermissionMigration(batch_size=1, dry_run=True)
+        with CaptureQueriesContext(connection) as context:
+            migration.run()
+        self.assertFalse([
+            query for query in context.captured_queries
+            if not query["sql"].startswith(("SELECT", "SET search_path", "SAVEPOINT", "RELEASE SAVEPOINT"))
+        ])
+        # add, change and delete share the edit permission
+        # and are only counted once across chunks
+        self.assertEqual(dict(migration.created), {
+            "groups": 1,
+            "permissions": DjangoPermission.objects.values_list("content_type").distinct().count() * 2,
+            "group-permission relationships": 2,
+            "realms": 3,
+            "realm-permission relationships": 6,
+            "realm-group relationships": 3,
+        })
+        # only the placeholders of groups, permissions and realms are kept
+        self.assertFalse(migration._planned_links)
+        self.assertEqual(
+            {placeholder[0] for placeholder in migration._planned},
+            {"group", "permission", "realm"},
+        )
+
+        real = PermissionMigration(batch_size=1)
+        real.run()
+        self.assertEqual(real.created, migration.created)
+
+    def test_command_dry_run_existing(self):
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(DjangoPermission.objects.first())
+        UserFactory().groups.add(group)
+        PermissionMigration().run()
+        UserFactory().groups.add(group)
+        migration = PermissionMigration(dry_run=True)
+        migration.run()
+        self.assertEqual(dict(migration.created), {
+            "groups": 0,
+            "permissions": 0,
+            "group-permission relationships": 0,
+            "realms": 1,
+            "realm-group relationships": 1,
+        })
+
+    def test_command_batch_size(self):
+        users = [UserFactory() for _ in range(5)]
+        for user in users:
+            user.user_permissions.add(DjangoPermission.objects.first())
+        call_command("migrate_permissions", "--batch-size=2", verbosity=0)
+        self.assertEqual(Realm.objects.count(), 5)
+        for user in users:
+            self.assertEqual(
+                Realm.objects.get(user=user).permissions.count(),
+                1,
+            )
+
+    def test_command_resume(self):
+        perm = DjangoPermission.objects.first()
+        users = [UserFactory() for _ in range(3)]
+        for user in users:
+            user.user_permissions.add(perm)
+        through = DjangoPermission.user_set.through.objects
+        first_pk = through.order_by("pk").first().pk
+        checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(checkpoint))
+
+        get_realms = PermissionMigration._get_realms
+        calls = []
+
+        def interrupted(migration, user_ids):
+            calls.append(user_ids)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            return get_realms(migration, user_ids)
+
+        migration = PermissionMigration(batch_size=1, checkpoint=checkpoint)
+        with mock.patch.object(PermissionMigration, "_get_realms", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                migration.run()
+        self.assertEqual(Realm.objects.count(), 1)
+        with open(checkpoint) as f:
+            self.assertEqual(
+                json.load(f),
+                {"step": "user_permissions", "last_pk": first_pk},
+            )
+
+        migration = PermissionMigration(batch_size=1, checkpoint=checkpoint)
+        migration.run()
+        # earlier steps are skipped
+        self.assertEqual(
+            list(migration.created),
+            ["realms", "realm-permission relationships"],
+        )
+        self.assertEqual(Realm.objects.count(), 3)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def _checkpoint(self, step, last_pk):
+        checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(checkpoint))
+        with open(checkpoint, "w") as f:
+            json.dump({"step": step, "last_pk": last_pk}, f)
+        return checkpoint
+
+    def test_command_resume_not_migrated(self):
+        group = DjangoGroup.objects.create(name="Test Group")
+        group.permissions.add(DjangoPermission.objects.first())
+        UserFactory().groups.add(group)
+        checkpoint = self._checkpoint("user_groups", 0)
+        with self.assertRaisesRegex(CommandError, "Django group {} has not been migrated".format(group.pk)):
+            PermissionMigration(checkpoint=checkpoint).run()
+
+    def test_command_checkpoint_failed(self):
+        user = UserFactory()
+        user.user_permissions.add(DjangoPermission.objects.first())
+        save_checkpoint = PermissionMigration._save_checkpoint
+
+        def failed(migration, step, last_pk):
+            if step == "user_permissions":
+                raise OSError
+            save_checkpoint(migration, step, last_pk)
+
+        with mock.patch.object(PermissionMigration, "_save_checkpoint", failed):
+            with self.assertRaises(OSError):
+                PermissionMigration().run()
+        self.assertTrue(Permission.objects.exists())
+        # the checkpoint is saved once the chunk is committed
+        self.assertTrue(Realm.objects.exists())
+
+    def test_command_checkpoint_after_commit(self):
+        user = UserFactory()
+        user.user_permissions.add(DjangoPermission.objects.first())
+        depth = len(connection.savepoint_ids)
+        depths = []
+        save_checkpoint = PermissionMigration._save_checkpoint
+
+        def saved(migration, step, last_pk):
+            depths.append(len(connection.savepoint_ids))
+            save_checkpoint(migration, step, last_pk)
+
+        with mock.patch.object(PermissionMigration, "_save_checkpoint", saved):
+            PermissionMigration().run()
+        self.assertEqual(set(depths), {depth})
+
+
+class TestRebuildEffectivePermissions(BaseTestCase):
+    def test_command(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(PermissionFactory())
+        other = RealmFactory(workspace=self.tenant)
+        other.permissions.add(PermissionFactory())
+        self.assertFalse(EffectivePermission.objects.exists())
+
+        out = StringIO()
+        call_command("rebuild_effective_permissions", str(realm.pk), stdout=out)
+        self.assertEqual(out.getvalue(), "Rebuilt effective permissions of 1 realms\n")
+        self.assertEqual(
+            list(EffectivePermission.objects.values_list("realm_id", flat=True)),
+            [realm.pk],
+        )
+
+        call_command("rebuild_effective_permissions", verbosity=0)
+        self.assertEqual(EffectivePermission.objects.count(), 2)
+
+
+class TestProvisionRealms(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = GroupFactory(name="Partners")
+        self.permission = PermissionFactory()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_csv(self):
+        path = self._write("realms.csv", "\n".join([
+            "user,workspace,organization,groups,permissions",
+            "{},{},,{},{}".format(
+                self.user.username,
+                self.tenant.pk,
+                self.group.name,
+                self.permission.pk,
+            ),
+        ]))
+        out = StringIO()
+        call_command("provision_realms", path, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "Created 1 realms",
+            "Created 1 realm groups",
+            "Created 1 realm permissions",
+        ])
+        realm = Realm.objects.get(user=self.user)
+        self.assertEqual(realm.workspace, self.tenant)
+        self.assertIsNone(realm.organization)
+        self.assertEqual(list(realm.groups.all()), [self.group])
+        self.assertEqual(list(realm.permissions.all()), [self.permission])
+
+    def test_jsonl(self):
+        other = UserFactory()
+        path = self._write("realms.txt", "\n".join([
+            json.dumps({"user": self.user.username, "groups": [self.group.name]}),
+            "",
+            json.dumps({"user": other.username, "permissions": [self.permission.pk]}),
+        ]))
+        call_command("provision_realms", path, "--format=jsonl", "--batch-size=1", verbosity=0)
+        self.assertEqual(Realm.objects.count(), 2)
+        self.assertEqual(list(self.group.realm_set.all()), [Realm.objects.get(user=self.user)])
+
+    def test_not_found(self):
+        path = self._write("realms.jsonl", json.dumps({
+            "user": "unknown",
+            "groups": ["unknown", self.group.name],
+            "permissions": [self.permission.pk + 1],
+        }))
+        with self.assertRaisesRegex(CommandError, "Not found: group unknown, permission {}, user unknown".format(
+            self.permission.pk + 1,
+        )):
+            call_command("provision_realms", path)
+        self.assertFalse(Realm.objects.exists())
+
+    def test_not_found_workspace_organization(self):
+        path = self._write("realms.jsonl", json.dumps({
+            "user": self.user.username,
+            "workspace": self.tenant.pk + 1,
+            "organization": 1,
+        }))
+        with self.assertRaisesRegex(CommandError, "Not found: organization 1, workspace {}".format(
+            self.tenant.pk + 1,
+        )):
+            call_command("provision_realms", path)
+        self.assertFalse(Realm.objects.exists())
+
+    def test_csv_missing_user(self):
+        path = self._write("realms.csv", "\n".join([
+            "user,workspace,organization,groups,permissions",
+            "{},{},,,".format(self.user.username, self.tenant.pk),
+            ",{},,,".format(self.tenant.pk),
+        ]))
+        with self.assertRaisesRegex(CommandError, "Line 3: missing user"):
+            call_command("provision_realms", path)
+        path = self._write("realms_no_user.csv", "\n".join([
+            "workspace,organization,groups,permissions",
+            "{},,,".format(self.tenant.pk),
+        ]))
+        with self.assertRaisesRegex(CommandError, "Line 2: missing user"):
+            call_command("provision_realms", path)
+        self.assertFalse(Realm.objects.exists())
+
+    def test_jsonl_missing_user(self):
+        path = self._write("realms.jsonl", "\n".join([
+            json.dumps({"user": self.user.username}),
+            json.dumps({"groups": [self.group.name]}),
+        ]))
+        with self.assertRaisesRegex(CommandError, "Line 2: missing user"):
+            call_command("provision_realms", path)
+        self.assertFalse(Realm.objects.exists())
+
+    def test_csv_invalid(self):
+        path = self._write("realms.csv", "\n".join([
+            "user,workspace,organization,groups,permissions",
+            "{},{},,,".format(self.user.username, self.tenant.pk),
+            "{},,,,{} x".format(self.user.username, self.permission.pk),
+        ]))
+        with self.assertRaisesRegex(CommandError, "Line 3: invalid permission 'x'"):
+            call_command("provision_realms", path)
+        self.assertFalse(Realm.objects.exists())
+
+    def test_jsonl_invalid(self):
+        path = self._write("realms.jsonl", "\n".join([
+            json.dumps({"user": self.user.username}),
+            "{",
+        ]))
+        with self.assertRaisesRegex(CommandError, "Line 2: "):
+            call_command("provision_realms", path)
@@ -0,0 +1,139 @@
+import sys
+
+from django.core.exceptions import ImproperlyConfigured
+
+from tests.base import BaseTestCase
+from tests.factories import PermissionFactory
+
+from etools_permissions.conditions import (
+    BaseCondition,
+    condition_registry,
+    ConditionRegistry,
+    Context,
+    normalize_context,
+)
+from etools_permissions.models import Permission
+
+
+class StatusCondition(BaseCondition):
+    def __init__(self, status):
+        self.status = status
+
+    def to_internal_value(self):
+        return "status.{}".format(self.status)
+
+
+class TestNormalizeContext(BaseTestCase):
+    def test_normalize(self):
+        context = normalize_context([
+            StatusCondition("draft"),
+            ["partner", ("staff", ["partner"])],
+        ])
+        self.assertIsInstance(context, Context)
+        self.assertEqual(context, {"status.draft", "partner", "staff"})
+        self.assertIs(normalize_context(context), context)
+
+    def test_normalize_not_string(self):
+        self.assertEqual(normalize_context(["a", 5]), {"a", "5"})
+
+    def test_interned(self):
+        value = "".join(["status.", "draft"])
+        self.assertIsNot(value, "status.draft")
+        context = normalize_context([value])
+        self.assertIs(next(iter(context)), sys.intern("status.draft"))
+
+    def test_hashable(self):
+        decisions = {normalize_context(["a", "b"]): True}
+        self.assertTrue(decisions[normalize_context([["b"], "a", "a"])])
+
+    def test_key(self):
+        self.assertEqual(
+            normalize_context(["b", "a"]).key,
+            normalize_context(["a", ["b"]]).key,
+        )
+        self.assertNotEqual(
+            normalize_context(["a"]).key,
+            normalize_context(["a", "b"]).key,
+        )
+
+    def test_filter_by_context(self):
+        permission = PermissionFactory(condition=["status.draft", "partner"])
+        PermissionFactory(condition=["staff"])
+        context = normalize_context([StatusCondition("draft"), "partner"])
+        self.assertSequenceEqual(
+            Permission.objects.filter_by_context(context),
+            [permission],
+        )
+
+
+    def test_filter_by_context_not_string(self):
+        permission = PermissionFactory(condition=["5"])
+        self.assertSequenceEqual(
+            Permission.objects.filter_by_context(["a", 5]),
+            [permission],
+        )
+
+
+class TestConditionRegistry(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = ConditionRegistry()
+
+    def test_register(self):
+        self.registry.register("st", StatusCondition)
+        self.addCleanup(setattr, StatusCondition, "key", None)
+        self.assertEqual(StatusCondition.key, "st")
+        self.assertIs(self.registry.get("st"), StatusCondition)
+        self.assertEqual(self.registry.keys(), ["st"])
+        # registering again is harmless
+        self.registry.register("st", StatusCondition)
+
+    def test_register_decorator(self):
+        @self.registry.register("other")
+        class OtherCondition(BaseCondition):
+            pass
+
+        self.assertEqual(OtherCondition.key, "other")
+        self.registry.unregister("other")
+        self.assertIsNone(OtherCondition.key)
+        self.assertIsNone(self.registry.get("other"))
+
+    def test_register_duplicate(self):
+        self.registry.register("st", StatusCondition)
+        self.addCleanup(setattr, StatusCondition, "key", None)
+        with self.assertRaises(ImproperlyConfigured):
+            self.registry.register("st", type("Other", (BaseCondition, ), {}))
+
+    def test_register_twice(self):
+        self.registry.register("st", StatusCondition)
+        self.addCleanup(setattr, StatusCondition, "key", None)
+        with self.assertRaises(ImproperlyConfigured):
+            self.registry.register("status", StatusCondition)
+        self.assertIsNone(self.registry.get("status"))
+
+    def test_make_value(self):
+        @self.registry.register("ks")
+        class KeyedCondition(BaseCondition):
+            def __init__(self, status):
+                self.status = status
+
+            def to_internal_value(self):
+                return self.make_value(self.status)
+
+        self.assertIs(KeyedCondition("draft").to_internal_value(), sys.intern("ks.draft"))
+        permission = PermissionFactory(condition=["ks.draft"])
+        self.assertSequenceEqual(
+            Permission.objects.filter_by_context([KeyedCondition("draft")]),
+            [permission],
+        )
+        self.assertEqual(
+            normalize_context([KeyedCondition("draft")]).key,
+            normalize_context(["ks.draft"]).key,
+        )
+
+    def test_make_value_not_registered(self):
+        with self.assertRaises(ImproperlyConfigured):
+            StatusCondition.make_value("draft")
+
+    def test_default_registry(self):
+        self.assertIsInstance(condition_registry, ConditionRegistry)
@@ -0,0 +1,199 @@
+from django.db import connection
+from django.db import models
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from django.urls import reverse
+
+from demo.organization.models import Organization
+from demo.sample.models import Book, ChildrensBook
+from rest_framework import status
+from tests.base import BaseTestCase
+from tests.factories import (
+    BookFactory,
+    ChildrensBookFactory,
+    GroupFactory,
+    OrganizationFactory,
+    PermissionFactory,
+    RealmFactory,
+    UserFactory,
+)
+
+from etools_permissions.conditions import row_conditions
+from etools_permissions.filters import _model_levels, filter_visible, get_row_filter, VisibleQuerySetMixin
+from etools_permissions.models import Permission
+
+
+class BookQuerySet(VisibleQuerySetMixin, type(Book.objects.all())):
+    pass
+
+
+class TestFilterVisible(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.realm = RealmFactory(user=self.user, workspace=self.tenant)
+        self.book = BookFactory(name="Book")
+        self.childrens_book = ChildrensBookFactory(name="Childrens", max_age=5)
+        row_conditions.register("young", lambda model: Q(childrensbook__max_age__lt=8))
+        self.addCleanup(row_conditions.unregister, "young")
+
+    def _add(self, target, permission_type=Permission.TYPE_ALLOW, permission=Permission.VIEW, condition=None):
+        self.realm.permissions.add(PermissionFactory(
+            permission=permission,
+            permission_type=permission_type,
+            target=target,
+            condition=condition or [],
+        ))
+
+    def _visible(self, model=Book, context=(), kind=Permission.VIEW):
+        return set(filter_visible(model.objects.all(), self.realm, context, kind))
+
+    def test_no_realm(self):
+        self.assertFalse(filter_visible(Book.objects.all(), None).exists())
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        self.assertEqual(self._visible(), {self.book, self.childrens_book.book_ptr})
+
+    def test_inactive(self):
+        self._add("sample.book.*")
+        self.user.is_active = False
+        self.assertEqual(self._visible(), set())
+
+    def test_no_permission(self):
+        self._add("sample.author.*")
+        self._add("sample.book.name")
+        self.assertEqual(self._visible(), set())
+
+    def test_model_permission(self):
+        self._add("sample.book.*")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._visible(), {self.book, self.childrens_book.book_ptr})
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if not q["sql"].startswith("SET search_path")
+        ]), 2)
+        self.assertEqual(self._visible(kind=Permission.EDIT), set())
+
+    def test_app_permission(self):
+        self._add("sample.*")
+        self.assertEqual(self._visible(), {self.book, self.childrens_book.book_ptr})
+        self._add("sample.book.*", permission_type=Permission.TYPE_DISALLOW)
+        self.assertEqual(self._visible(), set())
+
+    def test_all_permission(self):
+        self._add("*")
+        self.assertEqual(len(self._visible()), 2)
+        self._add("sample.*", permission_type=Permission.TYPE_DISALLOW, condition=["young"])
+        self.assertEqual(self._visible(), {self.book})
+
+    def test_edit_implies_view(self):
+        self._add("sample.book.*", permission=Permission.EDIT)
+        self.assertEqual(self._visible(), {self.book, self.childrens_book.book_ptr})
+
+    def test_group_permission(self):
+        group = GroupFactory()
+        group.permissions.add(PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="sample.book.*",
+        ))
+        self.realm.groups.add(group)
+        self.assertEqual(len(self._visible()), 2)
+
+    def test_parent_permission(self):
+        self._add("sample.book.*")
+        self._add("sample.childrensbook.*", permission_type=Permission.TYPE_DISALLOW)
+        self.assertEqual(self._visible(ChildrensBook), set())
+        self.assertEqual(len(self._visible()), 2)
+
+    @isolate_apps("demo.sample")
+    def test_grandparent_permission(self):
+        class Publication(models.Model):
+            pass
+
+        class Novel(Publication):
+            pass
+
+        class ShortNovel(Novel):
+            pass
+
+        self.assertEqual(_model_levels(ShortNovel), {
+            "sample.shortnovel.*": 0,
+            "sample.novel.*": 1,
+            "sample.publication.*": 2,
+            "sample.*": 3,
+            "*": 4,
+        })
+        # the parent is more specific than the grandparent
+        self._add("sample.publication.*", permission_type=Permission.TYPE_DISALLOW)
+        self._add("sample.novel.*")
+        self.assertIs(get_row_filter(ShortNovel, self.realm), True)
+
+    def test_context(self):
+        self._add("sample.book.*", condition=["partner"])
+        self.assertEqual(self._visible(), set())
+        self.assertEqual(len(self._visible(context=[["partner"]])), 2)
+
+    def test_row_condition(self):
+        self._add("sample.book.*", condition=["young"])
+        self.assertEqual(self._visible(), {self.childrens_book.book_ptr})
+
+    def test_row_condition_disallow(self):
+        self._add("sample.book.*")
+        self._add("sample.book.*", permission_type=Permission.TYPE_DISALLOW, condition=["young"])
+        self.assertEqual(self._visible(), {self.book})
+
+    def test_row_condition_allow_overrides(self):
+        self._add("sample.book.*", permission_type=Permission.TYPE_DISALLOW)
+        self._add("sample.book.*", condition=["young"])
+        self._add("sample.book.*", condition=["young", "unknown"])
+        self.assertEqual(self._visible(), {self.childrens_book.book_ptr})
+
+    def test_visible_to(self):
+        self._add("sample.book.*", condition=["young"])
+        queryset = BookQuerySet(Book).visible_to(self.realm)
+        self.assertEqual(list(queryset), [self.childrens_book.book_ptr])
+
+
+class TestRealmFilterBackend(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.organization = OrganizationFactory(name="Visible")
+        self.other = OrganizationFactory(name="Other")
+        self.realm = RealmFactory(
+            user=self.user,
+            organization=self.organization,
+            workspace=self.tenant,
+        )
+        self.realm.permissions.add(PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+            condition=["authenticated", "own"],
+        ))
+        row_conditions.register("own", self.own_organization)
+        self.addCleanup(row_conditions.unregister, "own")
+        self.client.force_login(self.user)
+
+    def own_organization(self, model):
+        if model is Organization:
+            return Q(name="Visible")
+        return None
+
+    def test_get(self):
+        response = self.client.get(reverse("organization:organization-api-list-filtered"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([o["id"] for o in response.data], [self.organization.pk])
+
+    def test_get_other_user(self):
+        user = UserFactory()
+        realm = RealmFactory(user=user, organization=self.organization, workspace=self.tenant)
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+        ))
+        self.client.force_login(user)
+        response = self.client.get(reverse("organization:organization-api-list-filtered"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
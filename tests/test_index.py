@@ -0,0 +1,234 @@
+import pickle
+
+from django.test import SimpleTestCase
+
+from tests.base import BaseTestCase
+
+from etools_permissions.index import PermissionIndex, target_prefixes
+from etools_permissions.models import Permission
+
+
+class TestTargetPrefixes(SimpleTestCase):
+    def test_prefixes(self):
+        self.assertEqual(
+            list(target_prefixes("app.model.field")),
+            ["app.model", "app", ""],
+        )
+
+    def test_no_dot(self):
+        self.assertEqual(list(target_prefixes("app")), [""])
+
+
+class TestPermissionIndex(SimpleTestCase):
+    def test_empty(self):
+        index = PermissionIndex()
+        self.assertEqual(len(index), 0)
+        self.assertFalse(index.allows("app.model.field"))
+
+    def test_permissions(self):
+        permission = "allow.view.app.model.field"
+        index = PermissionIndex([permission])
+        self.assertEqual(len(index), 1)
+        self.assertIn(permission, index)
+        self.assertEqual(list(index), [permission])
+
+    def test_allows_exact(self):
+        index = PermissionIndex(["allow.view.app.model.field"])
+        self.assertTrue(index.allows("app.model.field"))
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertFalse(index.allows("app.model.other"))
+
+    def test_allows_wildcard(self):
+        index = PermissionIndex(["allow.view.app.model.*"])
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertTrue(index.allows("app.model.*", Permission.VIEW))
+        self.assertFalse(index.allows("app.other.field", Permission.VIEW))
+
+    def test_allows_app_wildcard(self):
+        index = PermissionIndex(["allow.view.app.*"])
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertFalse(index.allows("other.model.field", Permission.VIEW))
+
+    def test_allows_edit_implies_view(self):
+        index = PermissionIndex(["allow.edit.app.model.field"])
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertTrue(index.allows("app.model.field", Permission.EDIT))
+
+    def test_allows_view_not_edit(self):
+        index = PermissionIndex(["allow.view.app.model.*"])
+        self.assertFalse(index.allows("app.model.field", Permission.EDIT))
+
+    def test_allows_action(self):
+        index = PermissionIndex(["allow.action.app.model.*"])
+        self.assertTrue(index.allows("app.model.field", Permission.ACTION))
+        self.assertFalse(index.allows("app.model.field", Permission.VIEW))
+
+    def test_allows_disallow_only(self):
+        index = PermissionIndex(["disallow.view.app.model.*"])
+        self.assertFalse(index.allows("app.model.field", Permission.VIEW))
+
+    def test_disallow_beats_allow(self):
+        index = PermissionIndex([
+            "allow.view.app.model.*",
+            "disallow.view.app.model.*",
+            "allow.edit.app.model.field",
+            "disallow.edit.app.model.field",
+        ])
+        self.assertFalse(index.allows("app.model.other", Permission.VIEW))
+        self.assertFalse(index.allows("app.model.field", Permission.EDIT))
+        self.assertFalse(index.allows("app.model.field"))
+
+    def test_specific_beats_wildcard(self):
+        index = PermissionIndex([
+            "disallow.view.app.model.*",
+            "allow.view.app.model.field",
+            "allow.view.app.*",
+            "disallow.view.app.other.field",
+        ])
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertFalse(index.allows("app.model.other", Permission.VIEW))
+        self.assertTrue(index.allows("app.other.name", Permission.VIEW))
+        self.assertFalse(index.allows("app.other.field", Permission.VIEW))
+
+    def test_disallow_other_kind(self):
+        index = PermissionIndex([
+            "allow.edit.app.model.*",
+            "disallow.edit.app.model.field",
+        ])
+        # disallowing edit does not stop the field being viewed
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        self.assertFalse(index.allows("app.model.field", Permission.EDIT))
+        self.assertTrue(index.allows("app.model.other", Permission.EDIT))
+
+    def test_decisions_not_pickled(self):
+        index = PermissionIndex(["allow.view.app.model.*"])
+        self.assertTrue(index.allows("app.model.field", Permission.VIEW))
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(copy._decisions, {})
+        self.assertTrue(copy.allows("app.model.field", Permission.VIEW))
+
+    def test_filter_allowed_precedence(self):
+        index = PermissionIndex([
+            "allow.view.app.model.*",
+            "disallow.view.app.model.secret",
+            "disallow.view.app.other.*",
+            "allow.view.app.other.name",
+        ])
+        targets = [
+            "app.model.field",
+            "app.model.secret",
+            "app.other.field",
+            "app.other.name",
+        ]
+        self.assertEqual(
+            index.filter_allowed(targets, Permission.VIEW),
+            ["app.model.field", "app.other.name"],
+        )
+
+    def test_filter_allowed(self):
+        index = PermissionIndex([
+            "allow.view.app.model.*",
+            "allow.edit.app.other.field",
+        ])
+        targets = [
+            "app.model.field",
+            "app.other.field",
+            "app.other.field_2",
+            "app.model.field_2",
+        ]
+        self.assertEqual(
+            index.filter_allowed(targets, Permission.VIEW),
+            ["app.model.field", "app.other.field", "app.model.field_2"],
+        )
+        self.assertEqual(
+            index.filter_allowed(targets, Permission.EDIT),
+            ["app.other.field"],
+        )
+
+    def test_filter_allowed_global_wildcard(self):
+        index = PermissionIndex(["allow.view.*"])
+        self.assertEqual(
+            index.filter_allowed(["app.model.field", "app"], Permission.VIEW),
+            ["app.model.field", "app"],
+        )
+
+
+class TestEvaluatorParity(BaseTestCase):
+    """`apply_permissions`, `allowed_targets` and `PermissionIndex` agree"""
+    targets = [
+        "sample.book.name",
+        "sample.book.author",
+        "sample.book.*",
+        "sample.childrensbook.name",
+        "sample.childrensbook.max_age",
+        "sample.childrensbook.*",
+        "sample.author.name",
+    ]
+    permission_sets = [
+        [
+            ("allow", "view", "sample.book.name"),
+            ("disallow", "view", "sample.book.name"),
+        ],
+        [
+            ("disallow", "view", "sample.book.name"),
+            ("allow", "view", "sample.book.name"),
+        ],
+        [
+            ("allow", "view", "sample.book.*"),
+            ("disallow", "view", "sample.childrensbook.name"),
+        ],
+        [
+            ("disallow", "view", "sample.childrensbook.*"),
+            ("allow", "view", "sample.book.name"),
+            ("allow", "edit", "sample.book.*"),
+        ],
+        [
+            ("allow", "edit", "sample.*"),
+            ("disallow", "edit", "sample.book.*"),
+            ("allow", "view", "sample.childrensbook.max_age"),
+            ("disallow", "view", "*"),
+        ],
+        [
+            ("allow", "edit", "sample.book.author"),
+            ("disallow", "view", "sample.book.*"),
+            ("allow", "view", "*"),
+        ],
+    ]
+
+    def _evaluate(self, permissions, kind):
+        for permission_type, permission, target in permissions:
+            Permission.objects.create(
+                permission=permission,
+                permission_type=permission_type,
+                target=target,
+                condition=[],
+            )
+        records = list(Permission.objects.order_by("pk"))
+        index = PermissionIndex(".".join(permission) for permission in permissions)
+        results = (
+            set(Permission.apply_permissions(records, self.targets, kind)),
+            set(Permission.objects.all().allowed_targets(self.targets, kind)),
+            set(index.filter_allowed(self.targets, kind)),
+            {target for target in self.targets if index.allows(target, kind)},
+        )
+        Permission.objects.all().delete()
+        return results
+
+    def test_parity(self):
+        for permissions in self.permission_sets:
+            for kind in [Permission.VIEW, Permission.EDIT]:
+                with self.subTest(permissions=permissions, kind=kind):
+                    applied, queried, filtered, allowed = self._evaluate(permissions, kind)
+                    self.assertEqual(queried, applied)
+                    self.assertEqual(filtered, applied)
+                    self.assertEqual(allowed, applied)
+
+    def test_disallow_wins_tie(self):
+        for permissions in self.permission_sets[:2]:
+            applied, queried, filtered, allowed = self._evaluate(permissions, Permission.VIEW)
+            self.assertNotIn("sample.book.name", applied)
+
+    def test_inheritance(self):
+        applied, queried, filtered, allowed = self._evaluate(self.permission_sets[2], Permission.VIEW)
+        self.assertIn("sample.childrensbook.max_age", filtered)
+        self.assertNotIn("sample.childrensbook.name", filtered)
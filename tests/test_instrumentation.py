@@ -0,0 +1,137 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from tests.base import BaseTestCase
+from tests.factories import OrganizationFactory, PermissionFactory, RealmFactory
+
+from etools_permissions import instrumentation
+from etools_permissions.models import Permission
+
+
+class TestPermissionStats(BaseTestCase):
+    def test_measure(self):
+        stats = instrumentation.PermissionStats()
+        self.assertEqual(stats.measure("has_perm", lambda x: x * 2, 2), 4)
+        self.assertEqual(stats.has_perm_calls, 1)
+        self.assertEqual(stats.queries, 0)
+        self.assertGreater(stats.time, 0)
+
+    def test_measure_nested(self):
+        stats = instrumentation.PermissionStats()
+
+        def outer():
+            PermissionFactory()
+            return stats.measure("has_perm", Permission.objects.count)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(stats.measure("has_permission", outer), 1)
+        self.assertEqual(
+            stats.as_dict()["calls"],
+            {"has_perm": 1, "has_permission": 1},
+        )
+        self.assertEqual(stats.queries, len(queries))
+
+    def test_instrument_disabled(self):
+        self.assertIsNone(instrumentation.get_stats())
+        realm = RealmFactory(workspace=self.tenant)
+        self.assertFalse(realm.has_perm("view.organization.organization.*"))
+
+    @override_settings(AUTH_PERMISSION_CACHE="default")
+    def test_instrument(self):
+        realm = RealmFactory(workspace=self.tenant)
+        stats = instrumentation.start()
+        self.addCleanup(setattr, instrumentation._local, "stats", None)
+        realm.has_perm("view.organization.organization.*")
+        realm.has_perm("view.organization.organization.name")
+        self.assertEqual(stats.has_perm_calls, 2)
+        self.assertEqual(stats.cache_misses, 1)
+        self.assertEqual(stats.cache_hits, 1)
+        self.assertEqual(str(stats).split()[:3], [
+            "has_perm=2",
+            "cache_hits=1",
+            "cache_misses=1",
+        ])
+
+    def test_instrument_cache_disabled(self):
+        realm = RealmFactory(workspace=self.tenant)
+        stats = instrumentation.start()
+        self.addCleanup(setattr, instrumentation._local, "stats", None)
+        realm.has_perm("view.organization.organization.*")
+        realm.has_perm("view.organization.organization.name")
+        self.assertEqual(stats.has_perm_calls, 2)
+        self.assertEqual(stats.cache_misses, 0)
+        self.assertEqual(stats.cache_hits, 0)
+
+
+class TestInstrumentationMiddleware(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.organization = OrganizationFactory()
+        realm = RealmFactory(
+            user=self.user,
+            organization=self.organization,
+            workspace=self.tenant,
+        )
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*"
+        ))
+        self.client.force_login(self.user)
+        self.collected = []
+        instrumentation.permission_stats_collected.connect(self.receiver)
+        self.addCleanup(
+            instrumentation.permission_stats_collected.disconnect,
+            self.receiver,
+        )
+
+    def receiver(self, sender, request, stats, **kwargs):
+        self.collected.append(stats)
+
+    def enable(self, **options):
+        settings = override_settings(
+            AUTH_PERMISSION_INSTRUMENTATION=True,
+            **options
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_disabled(self):
+        response = self.client.get(
+            reverse('organization:organization-api-list'),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.collected, [])
+
+    def test_enabled(self):
+        self.enable()
+        response = self.client.get(
+            reverse('organization:organization-api-list'),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Permission-Stats", response)
+        self.assertEqual(len(self.collected), 1)
+        stats = self.collected[0]
+        self.assertIs(response.wsgi_request.permission_stats, stats)
+        self.assertEqual(stats.calls["has_permission"], 1)
+        # a check per serializer field
+        self.assertEqual(stats.has_perm_calls, 2)
+        self.assertGreater(stats.queries, 0)
+        self.assertIsNone(instrumentation.get_stats())
+
+    def test_header(self):
+        self.enable(AUTH_PERMISSION_STATS_HEADER="X-Permission-Stats")
+        response = self.client.get(
+            reverse('organization:organization-api-list'),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("has_perm=2", response["X-Permission-Stats"])
+
+    def test_log(self):
+        self.enable(AUTH_PERMISSION_STATS_LOG=True)
+        with self.assertLogs("etools_permissions", level="INFO") as logs:
+            self.client.get(reverse('organization:organization-api-list'))
+        self.assertIn("has_perm=2", logs.output[0])
@@ -0,0 +1,63 @@
+import asyncio
+from unittest import skipIf
+
+from django.urls import reverse
+
+from rest_framework.test import APIRequestFactory
+from tests.base import BaseTestCase
+from tests.factories import PermissionFactory, RealmFactory
+
+from etools_permissions import utils
+from etools_permissions.backends import RealmBackend
+from etools_permissions.middleware import RealmAuthMiddleware
+from etools_permissions.utils import sync_to_async
+
+if sync_to_async is not None:
+    from asgiref.sync import async_to_sync
+
+
+class TestRealmAuthMiddleware(BaseTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.realm = RealmFactory(workspace=self.tenant)
+        self.realm.permissions.add(PermissionFactory())
+        self.request = self.factory.get(
+            reverse('organization:organization-api-list')
+        )
+        self.request.user = self.realm.user
+        self.request.tenant = self.tenant
+
+    def test_realm(self):
+        middleware = RealmAuthMiddleware(lambda request: request)
+        request = middleware(self.request)
+        self.assertEqual(request.realm, self.realm)
+        self.assertEqual(len(request.realm.get_all_permissions()), 1)
+
+    def test_realm_scope(self):
+        def get_response(request):
+            realm = request.realm._wrapped if request.realm else None
+            return realm, RealmBackend()._get_realm(request.user)
+
+        middleware = RealmAuthMiddleware(get_response)
+        realm, backend_realm = middleware(self.request)
+        self.assertIs(backend_realm, realm)
+        # realms are not cached beyond the request
+        self.assertIsNone(utils._scope.realms)
+
+    @skipIf(sync_to_async is None, "asgiref is not installed")
+    def test_arealm(self):
+        middleware = RealmAuthMiddleware(lambda request: request)
+        request = middleware(self.request)
+        self.assertEqual(async_to_sync(request.arealm)(), self.realm)
+        self.assertEqual(request.realm, self.realm)
+
+    @skipIf(sync_to_async is None, "asgiref is not installed")
+    def test_async(self):
+        async def get_response(request):
+            return await request.arealm()
+
+        middleware = RealmAuthMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertTrue(utils.iscoroutinefunction(middleware))
+        self.assertFalse(utils.iscoroutinefunction(RealmAuthMiddleware(lambda request: None)))
+        self.assertEqual(async_to_sync(middleware)(self.request), self.realm)
@@ -1,9 +1,37 @@
+from unittest import mock
+
+from django.core.exceptions import PermissionDenied
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from tests.base import BaseTestCase, SCHEMA_NAME
 from tests.factories import GroupFactory, OrganizationFactory, PermissionFactory, RealmFactory, UserFactory
 
-from etools_permissions.models import Group, Permission, Realm
+from etools_permissions import cache
+from etools_permissions.backends import RealmBackend
+from etools_permissions.conditions import BaseCondition, flatten_context
+from etools_permissions.models import EffectivePermission, Group, Permission, PermissionRecord, Realm
+
+
+class StaticCondition(BaseCondition):
+    def __init__(self, value):
+        self.value = value
+
+    def to_internal_value(self):
+        return self.value
+
+
+class HasPermOnlyBackend:
+    def has_perm(self, user, perm, obj=None):
+        realm = Realm.objects.get(user=user)
+        return RealmBackend().has_realm_perm(realm, perm, obj)
+
+
+class DenyBackend:
+    def filter_allowed_targets(self, realm, targets, kind, obj=None):
+        raise PermissionDenied
 
 
 class TestPermission(BaseTestCase):
@@ -18,6 +46,26 @@ class TestPermission(BaseTestCase):
             "Allow permission to view etools_permissions.permission.* at []"
         )
 
+    def test_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes "
+                "WHERE tablename = %s",
+                [Permission._meta.db_table],
+            )
+            indexes = dict(cursor.fetchall())
+        self.assertIn(
+            "USING gin (condition)",
+            indexes["etools_perm_condition_gin"],
+        )
+        self.assertIn(
+            "(permission, permission_type)",
+            indexes["etools_perm_type_idx"],
+        )
+        self.assertTrue(any(
+            "(target)" in definition for definition in indexes.values()
+        ))
+
     def test_filter_by_targets_for_wildcards(self):
         permission = PermissionFactory(
             permission=Permission.VIEW,
@@ -93,6 +141,50 @@ class TestPermission(BaseTestCase):
         permissions = Permission.objects.filter_by_context(contexts)
         self.assertSequenceEqual(permissions, [permission])
 
+    def test_filter_by_context_condition(self):
+        permission = PermissionFactory(
+            permission=Permission.VIEW,
+            target="etools_permissions.permission.*",
+            condition=["basic", "nested"]
+        )
+        contexts = [
+            StaticCondition("basic"),
+            [("nested", StaticCondition("other"))],
+        ]
+        self.assertEqual(flatten_context(contexts), ["basic", "nested", "other"])
+        permissions = Permission.objects.filter_by_context(contexts)
+        self.assertSequenceEqual(permissions, [permission])
+
+    def test_get_allowed_targets(self):
+        permission = PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="etools_permissions.permission.*",
+            condition=["basic"],
+        )
+        targets = ["etools_permissions.permission.target"]
+        self.assertEqual(
+            Permission.get_allowed_targets(["basic"], targets, Permission.VIEW),
+            targets,
+        )
+        self.assertEqual(
+            Permission.get_allowed_targets(["other"], targets, Permission.VIEW),
+            [],
+        )
+
+        realm = RealmFactory(workspace=self.tenant)
+        self.assertEqual(
+            Permission.get_allowed_targets(["basic"], targets, Permission.VIEW, realm),
+            [],
+        )
+        group = GroupFactory()
+        group.permissions.add(permission)
+        realm.groups.add(group)
+        self.assertEqual(
+            Permission.get_allowed_targets(["basic"], targets, Permission.VIEW, realm),
+            targets,
+        )
+
     def test_get_target(self):
         PermissionFactory(
             permission=Permission.VIEW,
@@ -197,6 +289,319 @@ class TestPermission(BaseTestCase):
             ]
         )
 
+    def test_expand_targets_wildcards(self):
+        self.assertCountEqual(
+            Permission.expand_targets(["sample.childrensbook.name"]),
+            [
+                "sample.childrensbook.name",
+                "sample.book.name",
+                "sample.childrensbook.*",
+                "sample.book.*",
+                "sample.*",
+                "*",
+            ],
+        )
+        self.assertCountEqual(Permission.expand_targets(["sample.*"]), ["sample.*", "*"])
+
+    def test_filter_by_targets_app_wildcards(self):
+        app = PermissionFactory(permission=Permission.VIEW, target="sample.*")
+        everything = PermissionFactory(permission=Permission.VIEW, target="*")
+        PermissionFactory(permission=Permission.VIEW, target="organization.*")
+        self.assertCountEqual(
+            Permission.objects.filter_by_targets(["sample.book.name"]),
+            [app, everything],
+        )
+
+    def test_apply_permissions_app_wildcards(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="sample.*",
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_DISALLOW,
+            target="*",
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_DISALLOW,
+            target="sample.book.*",
+        )
+        targets = [
+            "sample.book.name",
+            "sample.childrensbook.name",
+            "sample.author.name",
+            "sample.author.*",
+            "organization.organization.name",
+        ]
+        # the model permission of the parent beats the app permission
+        expected = ["sample.author.name", "sample.author.*"]
+        self.assertCountEqual(
+            Permission.apply_permissions(Permission.objects.all(), targets, Permission.VIEW),
+            expected,
+        )
+        self.assertCountEqual(
+            Permission.objects.all().allowed_targets(targets, Permission.VIEW),
+            expected,
+        )
+
+    def test_apply_permissions_list(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='sample.book.*'
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_DISALLOW,
+            target='sample.childrensbook.name'
+        )
+        targets = ['sample.childrensbook.name', 'sample.childrensbook.max_age']
+
+        # evaluated querysets, model instances and records are accepted
+        for permissions in [
+                list(Permission.objects.all()),
+                Permission.objects.records(),
+        ]:
+            self.assertSequenceEqual(
+                Permission.apply_permissions(permissions, targets, Permission.VIEW),
+                ['sample.childrensbook.max_age'],
+            )
+
+    def test_records(self):
+        permission = PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target='sample.book.name',
+            condition=['condition1'],
+        )
+        records = Permission.objects.records()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.target, 'sample.book.name')
+        self.assertEqual(record.condition, ['condition1'])
+        self.assertEqual(record.image_level, 0)
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertIn('edit', repr(record))
+
+        instance = record.to_permission()
+        self.assertIsNone(instance.pk)
+        self.assertEqual(str(instance), str(permission))
+        self.assertIs(PermissionRecord.from_permission(record), record)
+
+    def test_allowed_targets_empty(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.*'
+        )
+        self.assertEqual(
+            Permission.objects.all().allowed_targets([], Permission.VIEW),
+            [],
+        )
+
+    def test_allowed_targets_empty_queryset(self):
+        permission = PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.*'
+        )
+        targets = ['etools_permissions.permission.target']
+        self.assertEqual(
+            Permission.objects.none().allowed_targets(targets, Permission.VIEW),
+            [],
+        )
+        self.assertEqual(
+            Permission.objects.filter(pk__in=[]).allowed_targets(targets, Permission.VIEW),
+            [],
+        )
+        self.assertEqual(
+            Permission.objects.filter(pk=permission.pk).allowed_targets(targets, Permission.VIEW),
+            targets,
+        )
+
+    def test_allowed_targets_different_kinds(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.permission'
+        )
+        PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.target'
+        )
+
+        targets = [
+            'etools_permissions.permission.permission',
+            'etools_permissions.permission.permission_type',
+            'etools_permissions.permission.target',
+        ]
+
+        allowed_targets = Permission.objects.all().allowed_targets(
+            targets,
+            Permission.VIEW,
+        )
+        self.assertCountEqual(
+            allowed_targets,
+            [
+                'etools_permissions.permission.permission',
+                'etools_permissions.permission.target'
+            ]
+        )
+
+        allowed_targets = Permission.objects.all().allowed_targets(
+            targets,
+            Permission.EDIT,
+        )
+        self.assertSequenceEqual(
+            allowed_targets,
+            ['etools_permissions.permission.target']
+        )
+
+    def test_allowed_targets_order(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.*'
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            target='etools_permissions.permission.target',
+            permission_type=Permission.TYPE_DISALLOW,
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            target='etools_permissions.permission.permission_type',
+            permission_type=Permission.TYPE_DISALLOW,
+            condition=['condition1']
+        )
+
+        targets = [
+            'etools_permissions.permission.permission',
+            'etools_permissions.permission.permission_type',
+            'etools_permissions.permission.target',
+        ]
+
+        allowed_targets = Permission.objects.all().allowed_targets(
+            targets,
+            Permission.VIEW,
+        )
+        self.assertSequenceEqual(
+            allowed_targets,
+            ['etools_permissions.permission.permission']
+        )
+
+        PermissionFactory(
+            permission=Permission.VIEW,
+            target='etools_permissions.permission.target',
+            permission_type=Permission.TYPE_ALLOW,
+            condition=['condition1', 'condition2']
+        )
+
+        allowed_targets = Permission.objects.all().allowed_targets(
+            targets,
+            Permission.VIEW,
+        )
+        self.assertSequenceEqual(
+            allowed_targets,
+            [
+                'etools_permissions.permission.target',
+                'etools_permissions.permission.permission'
+            ]
+        )
+
+    def test_allowed_targets_wildcard(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='sample.book.*'
+        )
+        targets = [
+            'sample.book.name',
+            'sample.bookshelf.name',
+            'sample.book.*',
+            'sample.*',
+        ]
+        self.assertCountEqual(
+            Permission.objects.all().allowed_targets(targets, Permission.VIEW),
+            Permission.apply_permissions(Permission.objects.all(), targets, Permission.VIEW),
+        )
+        self.assertCountEqual(
+            Permission.objects.all().allowed_targets(targets, Permission.VIEW),
+            ['sample.book.name', 'sample.book.*'],
+        )
+
+    def test_allowed_targets_wildcard_all(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='*'
+        )
+        self.assertCountEqual(
+            Permission.objects.all().allowed_targets(
+                ['sample.book.name', 'sample.*', '*'],
+                Permission.VIEW,
+            ),
+            ['sample.book.name', 'sample.*', '*'],
+        )
+
+    def test_allowed_targets_inheritance(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='sample.book.*'
+        )
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_DISALLOW,
+            target='sample.childrensbook.name'
+        )
+
+        targets = [
+            'sample.childrensbook.name',
+            'sample.childrensbook.max_age',
+            'sample.book.name',
+        ]
+        allowed_targets = Permission.objects.all().allowed_targets(
+            targets,
+            Permission.VIEW,
+        )
+        self.assertCountEqual(
+            allowed_targets,
+            ['sample.childrensbook.max_age', 'sample.book.name']
+        )
+        self.assertCountEqual(
+            allowed_targets,
+            Permission.apply_permissions(
+                Permission.objects.all(),
+                targets,
+                Permission.VIEW,
+            )
+        )
+
+    def test_allowed_targets_filtered(self):
+        PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target='etools_permissions.permission.*',
+            condition=['condition1'],
+        )
+        targets = ['etools_permissions.permission.target']
+        self.assertEqual(
+            Permission.objects.filter_by_context(
+                ['condition1']
+            ).allowed_targets(targets, Permission.VIEW),
+            targets,
+        )
+        self.assertEqual(
+            Permission.objects.filter_by_context(
+                ['condition2']
+            ).allowed_targets(targets, Permission.VIEW),
+            [],
+        )
+
 
 class TestGroup(BaseTestCase):
     def test_str(self):
@@ -310,6 +715,184 @@ class TestRealm(BaseTestCase):
         realm.permissions.add(self.permission)
         self.assertTrue(realm.has_perm(self.permission.target))
 
+    def test_has_perm_reuses_loaded_permissions(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        realm = Realm.objects.select_related("user").get(pk=realm.pk)
+        self.assertTrue(realm.has_perm(self.permission.target))
+        with self.assertNumQueries(0):
+            for _ in range(40):
+                self.assertTrue(realm.has_perm(self.permission.target))
+
+    def test_with_permissions(self):
+        group_permission = PermissionFactory(
+            permission_type=Permission.TYPE_ALLOW,
+            permission=Permission.VIEW,
+        )
+        group = GroupFactory()
+        group.permissions.add(group_permission)
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        realm.groups.add(group)
+        realm = Realm.objects.with_permissions().get(pk=realm.pk)
+        group_label = "allow.view.{}".format(group_permission.target)
+        with self.assertNumQueries(0):
+            self.assertEqual(realm._realm_perm_cache, {self.permission_label})
+            self.assertEqual(realm._group_perm_cache, {group_label})
+            self.assertEqual(
+                realm.get_all_permissions(),
+                {self.permission_label, group_label},
+            )
+            self.assertTrue(realm.has_perm(self.permission.target))
+        self.assertFalse(hasattr(realm, "realm_perms"))
+
+    def test_with_permissions_conditional_disallow(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        realm.permissions.add(PermissionFactory(
+            permission_type=Permission.TYPE_DISALLOW,
+            permission=self.permission.permission,
+            target=self.permission.target,
+            condition=["status.draft"],
+        ))
+        loaded = Realm.objects.with_permissions().get(pk=realm.pk)
+        self.assertEqual(loaded.get_all_permissions(), {self.permission_label})
+        self.assertTrue(loaded.has_perm(self.permission.target))
+        with override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=True):
+            EffectivePermission.objects.refresh([realm.pk])
+            loaded = Realm.objects.with_permissions().get(pk=realm.pk)
+            self.assertEqual(loaded.get_all_permissions(), {self.permission_label})
+
+    def test_with_permissions_empty(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm = Realm.objects.with_permissions().get(pk=realm.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(realm.get_all_permissions(), set())
+            self.assertFalse(realm.has_perm(self.permission.target))
+
+    def test_with_permissions_superuser(self):
+        user = UserFactory(is_superuser=True)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        realm = Realm.objects.with_permissions().get(pk=realm.pk)
+        self.assertFalse(hasattr(realm, "_realm_perm_cache"))
+        self.assertIn(self.permission_label, realm.get_all_permissions())
+
+    def test_bulk_provision(self):
+        organization = OrganizationFactory()
+        group = GroupFactory()
+        permission = PermissionFactory()
+        existing = RealmFactory(user=self.user, workspace=self.tenant, organization=None)
+        existing.groups.add(group)
+        other = UserFactory()
+        records = [
+            {
+                "user": self.user,
+                "workspace": self.tenant,
+                "groups": [group],
+                "permissions": [permission],
+            },
+            {
+                "user": other.pk,
+                "workspace": self.tenant.pk,
+                "organization": organization.pk,
+                "groups": [group.pk],
+            },
+        ]
+        created = Realm.objects.bulk_provision(iter(records), batch_size=1)
+        self.assertEqual(dict(created), {
+            "realms": 1,
+            "realm groups": 1,
+            "realm permissions": 1,
+        })
+        self.assertEqual(list(existing.permissions.all()), [permission])
+        realm = Realm.objects.get(user=other)
+        self.assertEqual(realm.workspace, self.tenant)
+        self.assertEqual(realm.organization, organization)
+        self.assertEqual(list(realm.groups.all()), [group])
+
+        created = Realm.objects.bulk_provision(records)
+        self.assertEqual(set(created.values()), {0})
+
+    def test_bulk_provision_queries(self):
+        group = GroupFactory()
+        users = [UserFactory() for _ in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            Realm.objects.bulk_provision(
+                {"user": user, "workspace": self.tenant, "groups": [group]}
+                for user in users
+            )
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if not q["sql"].startswith(("SET search_path", "SAVEPOINT", "RELEASE SAVEPOINT"))
+        ]), 4)
+        self.assertEqual(group.realm_set.count(), 10)
+
+    def test_bulk_provision_bumps_linked_realms(self):
+        group = GroupFactory()
+        other = RealmFactory(workspace=self.tenant)
+        with mock.patch.object(cache, "bump_version") as bump_version:
+            Realm.objects.bulk_provision([
+                {"user": self.user, "workspace": self.tenant, "groups": [group]},
+                {"user": other.user, "workspace": self.tenant},
+            ])
+        realm = Realm.objects.get(user=self.user)
+        self.assertEqual(bump_version.call_args_list, [mock.call(realm.pk)])
+
+    def test_bulk_provision_workspace_required(self):
+        with self.settings(AUTH_REQUIRES_WORKSPACE=True):
+            with self.assertRaisesRegex(IntegrityError, "Workspace value"):
+                Realm.objects.bulk_provision([{"user": self.user}])
+        self.assertFalse(Realm.objects.exists())
+
+    def test_filter_allowed_targets_superuser(self):
+        user = UserFactory(is_superuser=True)
+        realm = RealmFactory(user=user, workspace=self.tenant)
+        targets = ["etools_permissions.group.name"]
+        self.assertEqual(
+            realm.filter_allowed_targets(targets, Permission.EDIT),
+            targets,
+        )
+
+    def test_filter_allowed_targets(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        targets = [
+            "etools_permissions.group.name",
+            "etools_permissions.permission.target",
+        ]
+        self.assertEqual(
+            realm.filter_allowed_targets(targets, Permission.EDIT),
+            ["etools_permissions.permission.target"],
+        )
+
+    def test_filter_allowed_targets_has_perm_backend(self):
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(self.permission)
+        targets = [
+            "etools_permissions.group.name",
+            "etools_permissions.permission.target",
+        ]
+        with self.settings(AUTHENTICATION_BACKENDS=[
+                "tests.test_models.HasPermOnlyBackend",
+        ]):
+            self.assertEqual(
+                realm.filter_allowed_targets(targets, Permission.EDIT),
+                ["etools_permissions.permission.target"],
+            )
+
+    def test_filter_allowed_targets_permission_denied(self):
+        realm = RealmFactory(workspace=self.tenant)
+        with self.settings(AUTHENTICATION_BACKENDS=[
+                "tests.test_models.DenyBackend",
+        ]):
+            self.assertEqual(
+                realm.filter_allowed_targets(
+                    ["etools_permissions.group.name"],
+                    Permission.EDIT,
+                ),
+                [],
+            )
+
     def test_has_perms_false(self):
         realm = RealmFactory(workspace=self.tenant)
         self.assertFalse(realm.has_perms([self.permission.target]))
@@ -318,3 +901,149 @@ class TestRealm(BaseTestCase):
         realm = RealmFactory(workspace=self.tenant)
         realm.permissions.add(self.permission)
         self.assertTrue(realm.has_perms([self.permission.target]))
+
+
+class TestEffectivePermission(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.realm = RealmFactory(workspace=self.tenant)
+        self.permission = PermissionFactory(
+            permission=Permission.EDIT,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.name",
+        )
+        self.group_permission = PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.*",
+        )
+        self.group = GroupFactory()
+        self.group.permissions.add(self.group_permission)
+
+    def effective(self, realm=None):
+        return set(EffectivePermission.objects.filter(
+            realm=realm or self.realm,
+        ).values_list("source_id", flat=True))
+
+    def test_str(self):
+        self.realm.permissions.add(self.permission)
+        effective = EffectivePermission.objects.get(realm=self.realm)
+        self.assertEqual(
+            str(effective),
+            "{}: allow.edit.organization.organization.name".format(
+                self.realm.pk,
+            ),
+        )
+
+    def test_disabled(self):
+        with override_settings(AUTH_PERMISSION_EFFECTIVE_TABLE=False):
+            self.realm.permissions.add(self.permission)
+        self.assertEqual(self.effective(), set())
+
+    def test_realm_permissions(self):
+        self.realm.permissions.add(self.permission)
+        self.assertEqual(self.effective(), {self.permission.pk})
+        self.realm.permissions.remove(self.permission)
+        self.assertEqual(self.effective(), set())
+        self.realm.permissions.add(self.permission)
+        self.realm.permissions.clear()
+        self.assertEqual(self.effective(), set())
+
+    def test_realm_permissions_reverse(self):
+        self.permission.realm_set.add(self.realm)
+        self.assertEqual(self.effective(), {self.permission.pk})
+        self.permission.realm_set.clear()
+        self.assertEqual(self.effective(), set())
+
+    def test_realm_groups(self):
+        self.realm.groups.add(self.group)
+        self.assertEqual(self.effective(), {self.group_permission.pk})
+        self.group.realm_set.clear()
+        self.assertEqual(self.effective(), set())
+
+    def test_group_permissions(self):
+        self.realm.groups.add(self.group)
+        self.realm.permissions.add(self.group_permission)
+        self.group.permissions.add(self.permission)
+        self.assertEqual(
+            self.effective(),
+            {self.permission.pk, self.group_permission.pk},
+        )
+        self.group.permissions.clear()
+        # still granted directly
+        self.assertEqual(self.effective(), {self.group_permission.pk})
+
+    def test_group_permissions_reverse(self):
+        self.realm.groups.add(self.group)
+        self.permission.group_set.add(self.group)
+        self.assertIn(self.permission.pk, self.effective())
+        self.permission.group_set.clear()
+        self.assertEqual(self.effective(), {self.group_permission.pk})
+
+    def test_permission_updated(self):
+        self.realm.permissions.add(self.permission)
+        self.permission.target = "organization.organization.id"
+        self.permission.permission_type = Permission.TYPE_DISALLOW
+        self.permission.save()
+        effective = EffectivePermission.objects.get(realm=self.realm)
+        self.assertEqual(effective.target, "organization.organization.id")
+        self.assertEqual(effective.permission_type, Permission.TYPE_DISALLOW)
+
+    def test_permission_deleted(self):
+        self.realm.permissions.add(self.permission)
+        self.permission.delete()
+        self.assertEqual(self.effective(), set())
+
+    def test_group_deleted(self):
+        self.realm.groups.add(self.group)
+        self.group.delete()
+        self.assertEqual(self.effective(), set())
+
+    def test_refresh(self):
+        self.realm.permissions.add(self.permission)
+        other = RealmFactory(workspace=self.tenant)
+        other.groups.add(self.group)
+        EffectivePermission.objects.all().delete()
+        EffectivePermission.objects.refresh([self.realm.pk])
+        self.assertEqual(self.effective(), {self.permission.pk})
+        self.assertEqual(self.effective(other), set())
+        EffectivePermission.objects.refresh()
+        self.assertEqual(self.effective(other), {self.group_permission.pk})
+        EffectivePermission.objects.refresh([])
+        self.assertEqual(EffectivePermission.objects.count(), 2)
+
+    def test_refresh_locks_realms(self):
+        self.realm.permissions.add(self.permission)
+        with CaptureQueriesContext(connection) as queries:
+            EffectivePermission.objects.refresh([self.realm.pk])
+        self.assertTrue(any("FOR UPDATE" in q["sql"] for q in queries.captured_queries))
+        self.assertEqual(self.effective(), {self.permission.pk})
+
+    def test_get_all_permissions(self):
+        self.realm.permissions.add(self.permission)
+        self.realm.groups.add(self.group)
+        realm = Realm.objects.select_related("user").get(pk=self.realm.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(realm.get_all_permissions(), {
+                "allow.edit.organization.organization.name",
+                "allow.view.organization.organization.*",
+            })
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if not q["sql"].startswith("SET search_path")
+        ]), 1)
+
+    def test_with_permissions(self):
+        self.realm.permissions.add(self.permission)
+        self.realm.groups.add(self.group)
+        realm = Realm.objects.with_permissions().get(pk=self.realm.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(realm.has_perm(
+                "view.organization.organization.id",
+            ))
+            self.assertTrue(realm.has_perm(
+                "edit.organization.organization.name",
+            ))
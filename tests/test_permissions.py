@@ -0,0 +1,131 @@
+from django.apps import apps
+
+from demo.organization.serializers import OrganizationFieldLimitSerializer, OrganizationSerializer
+from tests.base import BaseTestCase
+
+from etools_permissions.models import Permission
+from etools_permissions.permissions import RealmPermission, SerializerTargets
+
+
+class PreloadedPermission(RealmPermission):
+    pass
+
+
+class TestRealmPermission(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        RealmPermission._serializer_targets.clear()
+        self.addCleanup(RealmPermission._serializer_targets.clear)
+        self.permission = RealmPermission()
+
+    def test_permissions_by_serializer(self):
+        targets, field_limited = self.permission._permissions_by_serializer(
+            "GET",
+            OrganizationSerializer,
+        )
+        self.assertEqual(targets, [
+            "view.organization.organization.id",
+            "view.organization.organization.name",
+        ])
+        self.assertFalse(field_limited)
+
+    def test_permissions_by_serializer_field_limited(self):
+        targets, field_limited = self.permission._permissions_by_serializer(
+            "PATCH",
+            OrganizationFieldLimitSerializer,
+        )
+        self.assertEqual(targets, [
+            "edit.organization.organization.id",
+            "edit.organization.organization.name",
+        ])
+        self.assertTrue(field_limited)
+
+    def test_permissions_by_serializer_cached(self):
+        self.permission._permissions_by_serializer(
+            "GET",
+            OrganizationSerializer,
+        )
+        self.assertIn(
+            (RealmPermission, OrganizationSerializer, "GET"),
+            RealmPermission._serializer_targets,
+        )
+
+        def get_target_fields(method, serializer):
+            raise AssertionError("targets not cached")
+
+        self.permission.get_target_fields = get_target_fields
+        targets, _ = self.permission._permissions_by_serializer(
+            "GET",
+            OrganizationSerializer,
+        )
+        self.assertEqual(len(targets), 2)
+
+    def test_permissions_by_serializer_subclass(self):
+        class ViewOnlyPermission(RealmPermission):
+            def get_permission_type(self, method):
+                return Permission.VIEW
+
+        self.permission.preload_serializer(OrganizationSerializer, ["PATCH"])
+        targets, _ = ViewOnlyPermission()._permissions_by_serializer(
+            "PATCH",
+            OrganizationSerializer,
+        )
+        self.assertEqual(targets, [
+            "view.organization.organization.id",
+            "view.organization.organization.name",
+        ])
+        targets, _ = self.permission._permissions_by_serializer(
+            "PATCH",
+            OrganizationSerializer,
+        )
+        self.assertEqual(targets, [
+            "edit.organization.organization.id",
+            "edit.organization.organization.name",
+        ])
+
+    def test_serializer_targets_bounded(self):
+        memo = SerializerTargets(maxsize=2)
+        memo.get("a", lambda: 1)
+        memo.get("b", lambda: 2)
+        self.assertEqual(memo.get("a", lambda: 3), 1)
+        memo.get("c", lambda: 4)
+        self.assertEqual(list(memo), ["a", "c"])
+        self.assertEqual(memo.get("b", lambda: 5), 5)
+
+    def test_preload_serializer(self):
+        self.permission.preload_serializer(OrganizationSerializer, ["GET"])
+        self.assertEqual(list(RealmPermission._serializer_targets), [
+            (RealmPermission, OrganizationSerializer, "GET"),
+        ])
+
+    def test_preload_serializers_on_ready(self):
+        config = apps.get_app_config("etools_permissions")
+        with self.settings(AUTH_PERMISSION_PRELOAD_SERIALIZERS=[
+                "demo.organization.serializers.OrganizationSerializer",
+        ]):
+            config.preload_serializers()
+        self.assertEqual(
+            len(RealmPermission._serializer_targets),
+            len(RealmPermission.perms_map),
+        )
+
+    def test_preload_serializers_on_ready_permissions(self):
+        config = apps.get_app_config("etools_permissions")
+        with self.settings(
+                AUTH_PERMISSION_PRELOAD_SERIALIZERS=[
+                    "demo.organization.serializers.OrganizationSerializer",
+                ],
+                AUTH_PERMISSION_PRELOAD_PERMISSIONS=[
+                    "tests.test_permissions.PreloadedPermission",
+                ],
+        ):
+            config.preload_serializers()
+        self.assertEqual(
+            {key[0] for key in RealmPermission._serializer_targets},
+            {PreloadedPermission},
+        )
+
+    def test_preload_serializers_on_ready_none(self):
+        config = apps.get_app_config("etools_permissions")
+        config.preload_serializers()
+        self.assertEqual(len(RealmPermission._serializer_targets), 0)
@@ -0,0 +1,68 @@
+from django.urls import reverse
+
+from demo.organization.serializers import OrganizationFieldLimitSerializer
+from rest_framework.test import APIRequestFactory
+from tests.base import BaseTestCase
+from tests.factories import OrganizationFactory, PermissionFactory, RealmFactory
+
+from etools_permissions.models import Permission, Realm
+
+
+class TestRealmSerializerMixin(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.organization = OrganizationFactory()
+        self.request = APIRequestFactory().get(
+            reverse('organization:organization-api-list')
+        )
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(PermissionFactory(
+            permission=Permission.VIEW,
+            permission_type=Permission.TYPE_ALLOW,
+            target="organization.organization.name",
+        ))
+        self.request.realm = Realm.objects.select_related("user").get(
+            pk=realm.pk,
+        )
+
+    def test_no_realm(self):
+        self.request.realm = None
+        serializer = OrganizationFieldLimitSerializer(
+            self.organization,
+            context={"request": self.request},
+        )
+        self.assertEqual(serializer.data, {})
+
+    def test_readable_fields(self):
+        serializer = OrganizationFieldLimitSerializer(
+            self.organization,
+            context={"request": self.request},
+        )
+        self.assertEqual(serializer.data, {"name": self.organization.name})
+
+    def test_writable_fields(self):
+        serializer = OrganizationFieldLimitSerializer(
+            self.organization,
+            context={"request": self.request},
+        )
+        self.assertEqual(serializer._writable_fields, [])
+
+    def test_fields_limited_once(self):
+        serializer = OrganizationFieldLimitSerializer(
+            self.organization,
+            context={"request": self.request},
+        )
+        fields = serializer._readable_fields
+        with self.assertNumQueries(0):
+            self.assertIs(serializer._readable_fields, fields)
+
+    def test_many(self):
+        serializer = OrganizationFieldLimitSerializer(
+            many=True,
+            instance=[self.organization, self.organization],
+            context={"request": self.request},
+        )
+        self.assertEqual(
+            serializer.data,
+            [{"name": self.organization.name}] * 2,
+        )
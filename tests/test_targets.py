@@ -0,0 +1,118 @@
+from django.test import SimpleTestCase
+
+from demo.sample.models import Book
+from tests.base import BaseTestCase
+
+from etools_permissions.models import Permission
+from etools_permissions.targets import target_scope, TargetRegistry, TargetTrie, wildcard_targets
+
+
+class TestTargetRegistry(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = TargetRegistry(maxsize=2)
+
+    def test_get_target(self):
+        self.assertEqual(
+            self.registry.get_target(Book, "name"),
+            "sample.book.name",
+        )
+
+    def test_get_target_cached(self):
+        target = self.registry.get_target(Book, "name")
+        self.assertIs(self.registry.get_target(Book, "name"), target)
+
+    def test_parse_target(self):
+        self.assertEqual(
+            self.registry.parse_target("sample.book.name"),
+            (Book, "name"),
+        )
+
+    def test_parse_target_wildcards(self):
+        self.assertEqual(self.registry.parse_target("sample.*"), (None, "*"))
+        self.assertEqual(self.registry.parse_target("*"), (None, "*"))
+        self.assertEqual(self.registry.parse_target("sample.book.*"), (Book, "*"))
+
+    def test_parse_target_invalid(self):
+        with self.assertRaises(ValueError):
+            self.registry.parse_target("sample.book")
+        with self.assertRaises(LookupError):
+            self.registry.parse_target("sample.wrong.name")
+
+    def test_bounded(self):
+        for field in ["name", "author", "previous"]:
+            self.registry.get_target(Book, field)
+        info = self.registry._get_target.cache_info()
+        self.assertEqual(info.currsize, 2)
+
+    def test_clear(self):
+        self.registry.get_target(Book, "name")
+        self.registry.parse_target("sample.book.name")
+        self.registry.clear()
+        self.assertEqual(self.registry._get_target.cache_info().currsize, 0)
+        self.assertEqual(self.registry._parse_target.cache_info().currsize, 0)
+
+    def test_default_size(self):
+        with self.settings(AUTH_PERMISSION_TARGET_CACHE_SIZE=10):
+            registry = TargetRegistry()
+        self.assertEqual(registry._get_target.cache_info().maxsize, 10)
+
+    def test_permission_get_target_field(self):
+        field = Book._meta.get_field("name")
+        self.assertEqual(
+            Permission.get_target(Book, field),
+            "sample.book.name",
+        )
+
+
+class TestWildcardTargets(SimpleTestCase):
+    def test_wildcard_targets(self):
+        self.assertEqual(
+            wildcard_targets("sample.book.name"),
+            ["sample.book.*", "sample.*", "*"],
+        )
+        self.assertEqual(wildcard_targets("sample.book.*"), ["sample.book.*", "sample.*", "*"])
+        self.assertEqual(wildcard_targets("sample.*"), ["sample.*", "*"])
+        self.assertEqual(wildcard_targets("*"), ["*"])
+
+    def test_target_scope(self):
+        self.assertEqual(target_scope("sample.book.name"), 0)
+        self.assertEqual(target_scope("sample.book.*"), 0)
+        self.assertEqual(target_scope("sample.*"), 1)
+        self.assertEqual(target_scope("*"), 2)
+
+
+class TestTargetTrie(SimpleTestCase):
+    def setUp(self):
+        self.trie = TargetTrie([
+            "sample.book.name",
+            "sample.book.author",
+            "sample.author.name",
+            "organization.organization.name",
+            "sample.book.*",
+            "sample.*",
+            "*",
+        ])
+
+    def test_covered(self):
+        self.assertEqual(
+            self.trie.covered("sample.book.*"),
+            {"sample.book.name", "sample.book.author", "sample.book.*"},
+        )
+
+    def test_covered_app(self):
+        self.assertEqual(
+            self.trie.covered("sample.*"),
+            {"sample.book.name", "sample.book.author", "sample.author.name", "sample.book.*", "sample.*"},
+        )
+
+    def test_covered_all(self):
+        self.assertEqual(len(self.trie.covered("*")), 7)
+
+    def test_covered_missing(self):
+        self.assertEqual(self.trie.covered("sample.stats.*"), set())
+        self.assertEqual(self.trie.covered("sample.book.name.*"), set())
+
+    def test_covered_whole_segments(self):
+        trie = TargetTrie(["sample.book.name", "sample.bookshelf.name"])
+        self.assertEqual(trie.covered("sample.book.*"), {"sample.book.name"})
@@ -1,10 +1,14 @@
+from unittest import mock
+
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from demo.sample.models import Author, Book, ChildrensBook, Stats
 from rest_framework.test import APIRequestFactory
 from tests.base import BaseTestCase
-from tests.factories import RealmFactory
+from tests.factories import OrganizationFactory, PermissionFactory, RealmFactory
 
 from etools_permissions import utils
 
@@ -27,6 +31,77 @@ class TestGetRealm(BaseTestCase):
         request.user = AnonymousUser()
         self.assertIsNone(utils.get_realm(request))
 
+    def test_realm_with_permissions(self):
+        permission = PermissionFactory()
+        realm = RealmFactory(workspace=self.tenant)
+        realm.permissions.add(permission)
+        request = self.factory.post(
+            reverse('organization:organization-api-list')
+        )
+        request.user = realm.user
+        request.tenant = self.tenant
+        with CaptureQueriesContext(connection) as queries:
+            loaded = utils.get_realm(request)
+            self.assertEqual(loaded, realm)
+            self.assertEqual(len(loaded.get_all_permissions()), 1)
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if not q["sql"].startswith("SET search_path")
+        ]), 1)
+
+    def test_realm_workspace(self):
+        realm = RealmFactory(workspace=self.tenant)
+        RealmFactory(user=realm.user, workspace=self.tenant_other)
+        request = self.factory.post(
+            reverse('organization:organization-api-list')
+        )
+        request.user = realm.user
+        request.tenant = self.tenant_other
+        self.assertNotEqual(utils.get_realm(request), realm)
+        request.tenant = self.tenant
+        self.assertEqual(utils.get_realm(request), realm)
+
+
+class TestGetUserRealm(BaseTestCase):
+    def test_no_user(self):
+        self.assertIsNone(utils.get_user_realm(None))
+        self.assertIsNone(utils.get_user_realm(AnonymousUser()))
+
+    def test_cached(self):
+        organization = OrganizationFactory()
+        realm = RealmFactory(workspace=self.tenant, organization=organization)
+        user = realm.user
+        with utils.realm_scope():
+            self.assertIsNone(utils.get_user_realm(user, workspace=self.tenant_other))
+            self.assertEqual(
+                utils.get_user_realm(user, self.tenant, organization),
+                realm,
+            )
+            with self.assertNumQueries(0):
+                self.assertIsNone(utils.get_user_realm(user, workspace=self.tenant_other))
+                self.assertIs(
+                    utils.get_user_realm(user, self.tenant.pk, organization.pk),
+                    utils.get_user_realm(user, self.tenant, organization),
+                )
+
+    def test_not_cached_outside_scope(self):
+        realm = RealmFactory(workspace=self.tenant)
+        first = utils.get_user_realm(realm.user, self.tenant)
+        self.assertEqual(first, realm)
+        self.assertIsNot(utils.get_user_realm(realm.user, self.tenant), first)
+
+    def test_not_unique(self):
+        realm = RealmFactory(workspace=self.tenant)
+        RealmFactory(user=realm.user, workspace=self.tenant_other)
+        self.assertIsNone(utils.get_user_realm(realm.user))
+        self.assertEqual(utils.get_user_realm(realm.user, self.tenant), realm)
+
+    def test_current_workspace(self):
+        self.assertEqual(utils.get_current_workspace(), self.tenant)
+        connection.set_schema_to_public()
+        self.addCleanup(connection.set_tenant, self.tenant)
+        self.assertIsNone(utils.get_current_workspace())
+
 
 class TestSetRealm(BaseTestCase):
     def setUp(self):
@@ -64,6 +139,25 @@ class TestSetRealm(BaseTestCase):
         )
 
 
+class TestChunked(BaseTestCase):
+    def test_chunked(self):
+        self.assertEqual(list(utils.chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(utils.chunked([], 2)), [])
+
+
+class TestBulkLink(BaseTestCase):
+    def test_bulk_link(self):
+        realm = RealmFactory(workspace=self.tenant)
+        permissions = [PermissionFactory() for _ in range(2)]
+        realm.permissions.add(permissions[0])
+        pairs = [(realm.pk, perm.pk) for perm in permissions]
+        through = realm.permissions.through
+        self.assertEqual(utils.bulk_link(through, "realm_id", "permission_id", pairs, 10), 1)
+        self.assertCountEqual(realm.permissions.all(), permissions)
+        self.assertEqual(utils.bulk_link(through, "realm_id", "permission_id", pairs, 10), 0)
+        self.assertEqual(utils.bulk_link(through, "realm_id", "permission_id", [], 10), 0)
+
+
 class TestCollectParentModels(BaseTestCase):
     def test_level_zero(self):
         result = utils.collect_parent_models(None, levels=0)
@@ -98,3 +192,49 @@ class TestCollectChildModels(BaseTestCase):
     def test_child_levels(self):
         result = utils.collect_child_models(Book, levels=2)
         self.assertEqual(result, [ChildrensBook])
+
+
+class TestGetInheritanceTable(BaseTestCase):
+    def test_table(self):
+        table = utils.get_inheritance_table()
+        self.assertIn(("sample.book", "sample.childrensbook", 1), table)
+        self.assertNotIn(("sample.book", "sample.stats", 1), table)
+        self.assertIs(utils.get_inheritance_table(), table)
+
+
+class TestInheritanceRegistry(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = utils.InheritanceRegistry()
+
+    def test_lazy_build(self):
+        self.assertFalse(self.registry.ready)
+        self.assertEqual(self.registry.get_parents(ChildrensBook), (Book, ))
+        self.assertTrue(self.registry.ready)
+
+    def test_clear(self):
+        self.registry.build()
+        self.registry.clear()
+        self.assertFalse(self.registry.ready)
+
+    def test_get_parents(self):
+        self.assertEqual(self.registry.get_parents(Author), ())
+        self.assertEqual(self.registry.get_parents(ChildrensBook), (Book, ))
+
+    def test_get_children(self):
+        self.assertEqual(self.registry.get_children(Stats), ())
+        self.assertEqual(self.registry.get_children(Book), (ChildrensBook, ))
+
+    def test_get_prefix(self):
+        self.assertEqual(self.registry.get_prefix(Book), "sample.book")
+
+    def test_unregistered_model(self):
+        self.registry.build()
+        del self.registry._children[Book]
+        self.assertEqual(self.registry.get_children(Book), (ChildrensBook, ))
+
+    def test_no_introspection_after_build(self):
+        self.registry.build()
+        with mock.patch.object(utils, "collect_parent_models") as collect:
+            self.registry.get_parents(ChildrensBook)
+        collect.assert_not_called()